@@ -0,0 +1,174 @@
+"""
+Background models: given the next frame, return a uint8 foreground mask (255 where something moved).
+
+    "mog2"        OpenCV's Gaussian mixture per pixel. Copes best with swaying trees, changing light and clouds,
+                  but is the most expensive per pixel.
+    "knn"         OpenCV's K-nearest-neighbours model. Similar robustness to MOG2 with fewer false positives on
+                  noisy sensors, at about twice the cost.
+    "average"     A running average of the frames; pixels that differ from it by more than the threshold are
+                  foreground. A few arithmetic passes per pixel, which is all a static night sky needs.
+    "difference"  Compare each frame with the one `difference_frames` frames earlier. Has no memory at all, so
+                  it adapts instantly, but objects leave a second blob where they were and slow ones vanish.
+
+Every model takes the same `history` (frames it takes to adapt to a change) and `threshold` settings so the
+GUI and config can switch between them; `threshold` is MOG2's variance threshold, which the other models
+translate into their own units (see each class). Every apply() returns a new mask, since it travels down the
+pipeline with its frame.
+"""
+import collections
+
+import cv2
+import numpy as np
+
+ENGINES = ("mog2", "knn", "average", "difference")
+
+
+class OpenCVModel:
+    """
+    Adapts one of OpenCV's background subtractors to the common interface.
+    """
+    def __init__(self, subtractor):
+        self.subtractor = subtractor
+
+    def apply(self, frame):
+        return self.subtractor.apply(frame)
+
+
+class MOG2Model(OpenCVModel):
+    def __init__(self, history=80, threshold=20, detect_shadows=False):
+        super().__init__(cv2.createBackgroundSubtractorMOG2(history=history, varThreshold=threshold,
+                                                            detectShadows=detect_shadows))
+
+    def set_history(self, history):
+        self.subtractor.setHistory(history)
+
+    def set_threshold(self, threshold):
+        self.subtractor.setVarThreshold(threshold)
+
+
+class KNNModel(OpenCVModel):
+    """
+    The threshold is scaled so that the default of 20 gives OpenCV's default squared distance of 400.
+    """
+    def __init__(self, history=80, threshold=20, detect_shadows=False):
+        super().__init__(cv2.createBackgroundSubtractorKNN(history=history, dist2Threshold=threshold * 20,
+                                                           detectShadows=detect_shadows))
+
+    def set_history(self, history):
+        self.subtractor.setHistory(history)
+
+    def set_threshold(self, threshold):
+        self.subtractor.setDist2Threshold(threshold * 20)
+
+
+class DifferenceModel:
+    """
+    Shared part of the models that threshold an absolute difference: the difference of a color frame is the
+    largest over its channels, and the intermediate buffers are reused from frame to frame. The threshold is in
+    intensity levels (0-255).
+    """
+    def __init__(self, threshold=20):
+        self.threshold = threshold
+        self.shape = None
+        self._diff = None
+        self._channels = None
+
+    def set_threshold(self, threshold):
+        self.threshold = threshold
+
+    def reset(self, frame):
+        """
+        Start over from `frame`, e.g. on the first frame or when the frame size changes.
+        """
+        self.shape = frame.shape
+        self._diff = np.empty_like(frame)
+        self._channels = [np.empty(frame.shape[:2], dtype=np.uint8) for _ in range(frame.shape[2] if frame.ndim == 3 else 0)]
+
+    def foreground(self, frame, reference):
+        cv2.absdiff(frame, reference, dst=self._diff)
+        diff = self._diff
+        if diff.ndim == 3:
+            # Split and take the maximum with OpenCV; a NumPy max over the channel axis is ~50x slower
+            channels = self._channels
+            cv2.split(diff, channels)
+            for channel in channels[1:]:
+                cv2.max(channels[0], channel, dst=channels[0])
+            diff = channels[0]
+        return cv2.threshold(diff, self.threshold, 255, cv2.THRESH_BINARY)[1]
+
+
+class RunningAverageModel(DifferenceModel):
+    """
+    The background is an exponential moving average of the frames with weight 1/history, so a change is mostly
+    absorbed after `history` frames. Like MOG2 it learns faster while it has seen fewer than `history` frames,
+    so whatever was in the first frame doesn't linger as a ghost.
+    """
+    def __init__(self, history=80, threshold=20):
+        super().__init__(threshold)
+        self.history = history
+        self.frames = 0
+        self._average = None
+        self._background = None
+
+    def set_history(self, history):
+        self.history = history
+
+    def reset(self, frame):
+        super().reset(frame)
+        self._average = frame.astype(np.float32)
+        self._background = frame.copy()
+        self.frames = 1
+
+    def apply(self, frame):
+        if frame.shape != self.shape:
+            self.reset(frame)
+            return np.zeros(frame.shape[:2], dtype=np.uint8)
+        mask = self.foreground(frame, self._background)
+        self.frames += 1
+        cv2.accumulateWeighted(frame, self._average, 1.0 / max(1, min(self.frames, self.history)))
+        cv2.convertScaleAbs(self._average, dst=self._background)
+        return mask
+
+
+class FrameDifferenceModel(DifferenceModel):
+    """
+    Compares each frame with the one `frames` frames before it. `history` doesn't apply.
+    """
+    def __init__(self, threshold=20, frames=2):
+        super().__init__(threshold)
+        self.frames = max(1, frames)
+        self._previous = collections.deque(maxlen=self.frames)
+
+    def set_history(self, history):
+        pass
+
+    def reset(self, frame):
+        super().reset(frame)
+        self._previous.clear()
+
+    def apply(self, frame):
+        if frame.shape != self.shape:
+            self.reset(frame)
+        if len(self._previous) < self.frames:
+            self._previous.append(frame.copy())
+            return np.zeros(frame.shape[:2], dtype=np.uint8)
+        oldest = self._previous[0]
+        mask = self.foreground(frame, oldest)
+        np.copyto(oldest, frame)  # Reuse the oldest buffer for the newest frame
+        self._previous.rotate(-1)
+        return mask
+
+
+def create_model(engine="average", history=80, threshold=20, detect_shadows=False, difference_frames=2):
+    """
+    A background model by name, one of ENGINES.
+    """
+    if engine == "mog2":
+        return MOG2Model(history, threshold, detect_shadows)
+    if engine == "knn":
+        return KNNModel(history, threshold, detect_shadows)
+    if engine == "average":
+        return RunningAverageModel(history, threshold)
+    if engine == "difference":
+        return FrameDifferenceModel(threshold, difference_frames)
+    raise ValueError(f"Unknown background engine {engine!r}, expected one of {', '.join(ENGINES)}")
@@ -0,0 +1,341 @@
+"""
+Offline benchmark: feed a video clip through the same capture, detection, autorecord, encode and composite code
+as a live camera, at every camera resolution and with every codec, and report frames/s, per-stage latency and
+peak memory. Results are saved as JSON so a later version can be compared against them:
+
+    python benchmark.py                                          # synthetic clip, every resolution and codec
+    python benchmark.py --clip sky.avi --resolutions VGA "Full HD" --codecs FFV1 MJPG
+    python benchmark.py --compare benchmarks/20261017-120000.json   # exits with 1 on a regression
+    python benchmark.py --engines mog2 knn average difference --codecs  # background models only
+
+Without --clip a synthetic sky is generated: noise over a dark gradient with objects crossing it in bursts, so
+autorecord starts and stops. The input is the same for every run with the same arguments. Every case runs in a
+fresh process so its peak memory is its own.
+
+With --engines every background model is also run on the same input, detection only. On the synthetic sky,
+where the positions of the objects are known, this measures detection quality too: the share of objects found
+(recall) and the number of detections per frame that are not on any object.
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from multiprocessing import get_context
+
+import cv2
+import numpy as np
+
+from background import ENGINES
+from composite import peak_rss_mb
+from detection import X, Y, W, H
+from monitor import Monitor, CAMERA_RESOLUTIONS, CODECS, CODEC_EXTENSIONS
+from postprocess import composite_range
+
+RESULTS_DIRECTORY = "benchmarks"
+
+
+def synthetic_objects(width, height, index, fps=30, seed=0):
+    """
+    The centers of the objects in frame `index` of the synthetic sky, and their radius.
+    """
+    radius = max(3, width // 160)
+    burst = int(2 * fps)
+    cycle, position = divmod(index, 2 * burst)
+    centers = []
+    if position < burst:
+        track_rng = np.random.default_rng(seed + cycle)
+        for _ in range(track_rng.integers(1, 4)):
+            start = track_rng.uniform((0, 0), (width, height))
+            velocity = track_rng.uniform(-1, 1, 2) * width / burst
+            x, y = start + velocity * position
+            centers.append((int(x) % width, int(y) % height))
+    return centers, radius
+
+
+def synthetic_frames(width, height, frames, fps=30, seed=0):
+    """
+    Yield a deterministic sky: a dark gradient with sensor noise, and a few bright objects crossing it for two
+    seconds out of every four.
+    """
+    rng = np.random.default_rng(seed)
+    gradient = np.linspace(10, 40, height, dtype=np.float32)[:, None, None]
+    sky = np.broadcast_to(gradient, (height, width, 3)).astype(np.uint8)
+    noise = [rng.integers(0, 8, (height, width, 3), dtype=np.uint8) for _ in range(4)]
+    for index in range(frames):
+        frame = cv2.add(sky, noise[index % len(noise)])
+        centers, radius = synthetic_objects(width, height, index, fps, seed)
+        for center in centers:
+            cv2.circle(frame, center, radius, (230, 230, 230), -1)
+        yield frame
+
+
+def clip_frames(path, width, height, frames):
+    """
+    Yield up to `frames` frames of a video file scaled to width x height, from the start again when it ends.
+    """
+    cap = cv2.VideoCapture(path)
+    try:
+        produced = 0
+        while produced < frames:
+            ret, frame = cap.read()
+            if not ret:
+                if produced == 0:
+                    raise ValueError(f"Could not read {path}")
+                cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+                continue
+            yield cv2.resize(frame, (width, height), interpolation=cv2.INTER_AREA)
+            produced += 1
+    finally:
+        cap.release()
+
+
+def prepare_input(path, width, height, frames, fps=30, clip=None):
+    """
+    Write the benchmark input at one resolution as a lossless video file, from `clip` or synthetic frames.
+    """
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"FFV1"), fps, (width, height))
+    source = clip_frames(clip, width, height, frames) if clip else synthetic_frames(width, height, frames, fps)
+    for frame in source:
+        writer.write(frame)
+    writer.release()
+
+
+def run_case(input_path, resolution, codec, options):
+    """
+    Run one clip through a Monitor with autorecord on, then re-composite its recordings the way
+    processRecordedVideo does. Meant to run in its own process.
+    """
+    with tempfile.TemporaryDirectory(prefix="sentinel-benchmark-") as save_path:
+        monitor = Monitor(**{"save_path": save_path, "autorecord": True, "default_codec": codec, "ring_policy": "block",
+                             "post_workers": 1, "post_processes": False, **options})
+        messages = []
+        monitor.on_message = messages.append
+        if not monitor.openSource(input_path):
+            return {"resolution": resolution, "codec": codec, "error": f"Could not open {input_path}"}
+        start = time.perf_counter()
+        monitor.start()
+        monitor.waitUntilFinished()
+        monitor.stop()
+        elapsed = time.perf_counter() - start
+        metrics = monitor.metricsSnapshot()
+        frames = monitor.pipeline.stats()["encode"]["processed"]
+
+        recordings = sorted(entry.path for entry in os.scandir(save_path)
+                            if entry.name.endswith(CODEC_EXTENSIONS[codec]) and entry.is_file())
+        recorded_bytes = sum(os.path.getsize(path) for path in recordings)
+        composited = 0
+        composite_start = time.perf_counter()
+        for path in recordings:
+            composited += composite_range(path, history=monitor.fgbg_history, var_threshold=monitor.fgbg_var_threshold,
+                                          modes=monitor.composite_modes, engine=monitor.background_engine,
+                                          difference_frames=monitor.difference_frames).frames
+        composite_elapsed = time.perf_counter() - composite_start
+
+    return {
+        "resolution": resolution,
+        "codec": codec,
+        "engine": monitor.background_engine,
+        "frames": frames,
+        "seconds": round(elapsed, 3),
+        "fps": round(frames / elapsed, 2) if elapsed else 0.0,
+        "recordings": len(recordings),
+        "recorded_mb": round(recorded_bytes / 2**20, 2),
+        "composite_fps": round(composited / composite_elapsed, 2) if composite_elapsed and composited else 0.0,
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+        "timings": {name: {key: round(value, 4) for key, value in timing.items() if key != "buckets"}
+                    for name, timing in metrics["timings"].items()},
+        "dropped": metrics["dropped"],
+        "messages": [text for text in messages if "failed" in text or "Could not" in text],
+    }
+
+
+def run_engine_case(input_path, resolution, engine, options, fps=30, synthetic=True, warmup_seconds=1.0):
+    """
+    Run only detection with one background model over a clip, with the detection settings of `options`.
+    On synthetic input, also score the detections against the known objects, after a warm-up in which every
+    model learns the sky. An object counts as found when its center is inside a detection box (grown by the
+    object's radius); a detection that contains no object center is a false detection.
+    """
+    detector = Monitor(**{**options, "background_engine": engine}).detector
+    cap = cv2.VideoCapture(input_path)
+    if not cap.isOpened():
+        return {"resolution": resolution, "engine": engine, "error": f"Could not open {input_path}"}
+    warmup = int(warmup_seconds * fps)
+    frames = scored = objects = found = false = detected = 0
+    elapsed = 0.0
+    try:
+        while True:
+            ret, frame = cap.read()
+            if not ret:
+                break
+            start = time.perf_counter()
+            _, detections = detector.detect(frame)
+            elapsed += time.perf_counter() - start
+            frames += 1
+            if frames <= warmup:
+                continue
+            scored += 1
+            detected += len(detections)
+            if not synthetic:
+                continue
+            centers, radius = synthetic_objects(frame.shape[1], frame.shape[0], frames - 1, fps)
+            objects += len(centers)
+            if not len(detections):
+                continue
+            points = np.array(centers, dtype=np.int64).reshape(-1, 2)
+            inside = ((points[:, None, 0] >= detections[None, :, X] - radius)
+                      & (points[:, None, 0] < detections[None, :, X] + detections[None, :, W] + radius)
+                      & (points[:, None, 1] >= detections[None, :, Y] - radius)
+                      & (points[:, None, 1] < detections[None, :, Y] + detections[None, :, H] + radius))
+            found += int(inside.any(axis=1).sum())
+            false += int((~inside.any(axis=0)).sum())
+    finally:
+        cap.release()
+
+    case = {
+        "resolution": resolution,
+        "codec": None,
+        "engine": engine,
+        "frames": frames,
+        "fps": round(frames / elapsed, 2) if elapsed else 0.0,
+        "detect_ms": round(elapsed / frames * 1000, 3) if frames else 0.0,
+        "detections_per_frame": round(detected / scored, 3) if scored else 0.0,
+    }
+    if synthetic:
+        case["recall"] = round(found / objects, 4) if objects else None
+        case["false_per_frame"] = round(false / scored, 3) if scored else 0.0
+    return case
+
+
+def environment():
+    """
+    What the results depend on besides the code: versions, machine and the git revision if available.
+    """
+    try:
+        revision = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                  cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        revision = None
+    return {
+        "time": datetime.now().isoformat(timespec="seconds"),
+        "revision": revision,
+        "python": platform.python_version(),
+        "opencv": cv2.__version__,
+        "numpy": np.__version__,
+        "machine": platform.machine(),
+        "processor": platform.processor(),
+        "cpus": os.cpu_count(),
+        "system": platform.platform(),
+    }
+
+
+def compare(results, baseline, tolerance=0.1):
+    """
+    Print the frame rate of every case next to the baseline's. Returns the number of cases that got slower by
+    more than `tolerance` (a fraction).
+    """
+    def key(case):
+        return case["resolution"], case["codec"], case.get("engine", "mog2")
+
+    previous = {key(case): case for case in baseline["results"] if "fps" in case}
+    regressions = 0
+    for case in results:
+        old = previous.get(key(case))
+        if old is None or "fps" not in case or not old["fps"]:
+            continue
+        change = case["fps"] / old["fps"] - 1
+        flag = ""
+        if change < -tolerance:
+            flag = "  REGRESSION"
+            regressions += 1
+        print(f"{case['resolution']:>8} {case['codec'] or 'detect':<6} {case.get('engine', 'mog2'):<10} "
+              f"{old['fps']:8.1f} -> {case['fps']:8.1f} fps ({change:+.0%}){flag}")
+    return regressions
+
+
+def parse_value(text):
+    try:
+        return json.loads(text)
+    except ValueError:
+        return text
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark sentinel on video files.")
+    parser.add_argument("--clip", help="video file to use as input, scaled to every resolution (default: synthetic)")
+    parser.add_argument("--frames", type=int, default=300, help="frames per run")
+    parser.add_argument("--fps", type=float, default=30, help="frame rate of the input")
+    parser.add_argument("--resolutions", nargs="+", choices=list(CAMERA_RESOLUTIONS), default=list(CAMERA_RESOLUTIONS),
+                        metavar="NAME", help=f"any of: {', '.join(CAMERA_RESOLUTIONS)} (default: all)")
+    parser.add_argument("--codecs", nargs="*", choices=list(CODECS), default=list(CODECS),
+                        help="default: all; none with --engines to only compare background models")
+    parser.add_argument("--engines", nargs="+", choices=ENGINES, default=[],
+                        help="also run detection alone with each of these background models and score it")
+    parser.add_argument("--set", nargs="+", default=[], metavar="OPTION=VALUE",
+                        help="monitor options for every run, e.g. detection_scale=0.5 detection_grayscale=true")
+    parser.add_argument("--output", help=f"results file (default: {RESULTS_DIRECTORY}/<date>-<time>.json)")
+    parser.add_argument("--compare", help="results file of an earlier run to compare the frame rates with")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="slowdown that counts as a regression")
+    args = parser.parse_args(argv)
+
+    options = {}
+    for assignment in args.set:
+        name, _, value = assignment.partition("=")
+        options[name] = parse_value(value)
+    Monitor(**options)  # Fail early on unknown options
+
+    results = []
+    context = get_context("spawn")
+    with tempfile.TemporaryDirectory(prefix="sentinel-benchmark-input-") as input_directory:
+        for resolution in args.resolutions:
+            width, height = CAMERA_RESOLUTIONS[resolution]
+            input_path = os.path.join(input_directory, f"{width}x{height}.avi")
+            prepare_input(input_path, width, height, args.frames, args.fps, args.clip)
+            for codec in args.codecs:
+                with ProcessPoolExecutor(1, mp_context=context) as executor:
+                    case = executor.submit(run_case, input_path, resolution, codec, options).result()
+                results.append(case)
+                if "error" in case:
+                    print(f"{resolution:>8} {codec:<5} {case['error']}", flush=True)
+                    continue
+                stages = " ".join(f"{name} {case['timings'][name]['p50_ms']:.3g}ms"
+                                  for name in ("read", "detect", "annotate", "write") if name in case["timings"])
+                print(f"{resolution:>8} {codec:<5} {case['fps']:8.1f} fps | {stages} | composite {case['composite_fps']:.1f} fps"
+                      f" | {case['recordings']} recordings {case['recorded_mb']:.1f} MB | peak {case['peak_rss_mb']:.0f} MB",
+                      flush=True)
+            for engine in args.engines:
+                with ProcessPoolExecutor(1, mp_context=context) as executor:
+                    case = executor.submit(run_engine_case, input_path, resolution, engine, options, args.fps,
+                                           args.clip is None).result()
+                results.append(case)
+                if "error" in case:
+                    print(f"{resolution:>8} {engine:<10} {case['error']}", flush=True)
+                    continue
+                quality = f"{case['detections_per_frame']:.2f} detections/frame"
+                if case.get("recall") is not None:
+                    quality = f"recall {case['recall']:.1%} | {case['false_per_frame']:.2f} false/frame"
+                print(f"{resolution:>8} {engine:<10} {case['fps']:8.1f} fps | detect {case['detect_ms']:.3g}ms | {quality}",
+                      flush=True)
+
+    output = args.output or os.path.join(RESULTS_DIRECTORY, datetime.now().strftime("%Y%m%d-%H%M%S") + ".json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w") as f:
+        json.dump({"environment": environment(), "input": {"clip": args.clip, "frames": args.frames, "fps": args.fps},
+                   "options": options, "results": results}, f, indent=1)
+    print(f"Results saved to {output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if compare(results, baseline, args.tolerance):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
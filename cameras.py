@@ -0,0 +1,242 @@
+"""
+Camera discovery: find the working camera ports without holding any of them open.
+
+Every port is probed on its own thread with a timeout, so a camera that hangs in VideoCapture can't stall the
+others, and every probe releases its capture. Results are cached on disk by device identity so the next start can
+use them straight away and re-probe in the background.
+"""
+import json
+import os
+import threading
+import time
+
+import cv2
+
+# Frame rates offered in the FPS selector, up to what a mode measurably delivers
+STANDARD_FPS = (120, 90, 60, 50, 30, 25, 24, 15, 10, 5)
+
+
+def cache_path():
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "sentinel", "cameras.json")
+
+
+def device_identity(port):
+    """
+    A string that identifies the device behind a port across restarts: the V4L2 device name and its bus path where
+    available, otherwise just the port.
+    """
+    sysfs = f"/sys/class/video4linux/video{port}"
+    try:
+        with open(os.path.join(sysfs, "name")) as f:
+            name = f.read().strip()
+        return f"{name}@{os.path.realpath(os.path.join(sysfs, 'device'))}"
+    except OSError:
+        return f"port{port}"
+
+
+def probe_port(port):
+    """
+    Open a port, read one frame and release it. Returns the camera's info, or None if it doesn't deliver frames.
+    """
+    camera = cv2.VideoCapture(port)
+    try:
+        if not camera.isOpened():
+            return None
+        is_reading, _ = camera.read()
+        if not is_reading:
+            return None
+        return {
+            "width": int(camera.get(cv2.CAP_PROP_FRAME_WIDTH) + 0.5),
+            "height": int(camera.get(cv2.CAP_PROP_FRAME_HEIGHT) + 0.5),
+            "fps": camera.get(cv2.CAP_PROP_FPS),
+            "identity": device_identity(port),
+        }
+    finally:
+        camera.release()
+
+
+def discover_cameras(ports=range(8), timeout=3.0, known=None):
+    """
+    Probe all ports in parallel. Ports in `known` (port -> info, e.g. a camera that is already open) are not probed
+    again. A probe that takes longer than `timeout` seconds counts as not working; its thread still releases the
+    capture when it eventually returns. Returns a dict mapping port to info.
+    """
+    known = known or {}
+    results = {}
+    threads = []
+    for port in ports:
+        if port in known:
+            continue
+        thread = threading.Thread(target=lambda port=port: results.__setitem__(port, probe_port(port)),
+                                  name=f"Probe-{port}", daemon=True)
+        thread.start()
+        threads.append(thread)
+    deadline = time.time() + timeout
+    for thread in threads:
+        thread.join(max(0.0, deadline - time.time()))
+    cameras = dict(known)
+    cameras.update({port: info for port, info in list(results.items()) if info is not None})
+    return dict(sorted(cameras.items()))
+
+
+def measure_fps(cap, frames=15, warmup=3):
+    """
+    Read frames from an open capture and return (frames per second actually delivered, frame shape).
+    The first frames after a mode change are often slow or stale, so they are skipped.
+    """
+    shape = None
+    for _ in range(warmup):
+        ret, frame = cap.read()
+        if not ret:
+            return 0.0, None
+        shape = frame.shape
+    start = time.perf_counter()
+    for _ in range(frames):
+        if not cap.grab():
+            return 0.0, shape
+    return frames / (time.perf_counter() - start), shape
+
+
+def probe_modes(cap, resolutions, frames=15):
+    """
+    Find the resolution and frame rate combinations an open capture really delivers. Each resolution is requested
+    at the highest standard frame rate and the delivered rate is measured; resolutions the driver snaps to another
+    size are only listed once, with their real size. Returns a list of {"width", "height", "fps"}, largest first.
+    """
+    modes = []
+    seen = set()
+    for width, height in sorted(set(resolutions), key=lambda res: res[0] * res[1], reverse=True):
+        cap.set(cv2.CAP_PROP_FRAME_WIDTH, width)
+        cap.set(cv2.CAP_PROP_FRAME_HEIGHT, height)
+        cap.set(cv2.CAP_PROP_FPS, max(STANDARD_FPS))
+        fps, shape = measure_fps(cap, frames)
+        if shape is None or not fps:
+            continue
+        size = (shape[1], shape[0])
+        if size in seen:
+            continue
+        seen.add(size)
+        modes.append({"width": size[0], "height": size[1], "fps": round(fps, 1)})
+    return modes
+
+
+def fps_choices(max_fps):
+    """
+    The measured rate of a mode followed by the standard rates below it.
+    """
+    return [round(max_fps)] + [fps for fps in STANDARD_FPS if fps < max_fps * 0.95]
+
+
+class CameraCache:
+    """
+    Discovered cameras stored on disk by device identity, with the port they were last seen on.
+    """
+    def __init__(self, path=None):
+        self.path = path or cache_path()
+
+    def load(self):
+        """
+        Return the cached cameras (port -> info) whose device is still on the same port.
+        """
+        cameras = {}
+        for identity, info in self._read().items():
+            port = info["port"]
+            if device_identity(port) == identity:
+                cameras[port] = {key: value for key, value in info.items() if key != "port"}
+        return dict(sorted(cameras.items()))
+
+    def _read(self):
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _write(self, entries):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(entries, f, indent=1)
+        os.replace(tmp_path, self.path)
+
+    def save(self, cameras):
+        """
+        Store the cameras by identity, keeping the probed modes of cameras that were seen before.
+        Returns the cameras with those modes filled in.
+        """
+        previous = self._read()
+        entries = {}
+        for port, info in cameras.items():
+            entry = {**info, "port": port}
+            if "modes" not in entry and "modes" in previous.get(info["identity"], {}):
+                entry["modes"] = previous[info["identity"]]["modes"]
+            entries[info["identity"]] = entry
+        self._write(entries)
+        return {entry["port"]: {key: value for key, value in entry.items() if key != "port"} for entry in entries.values()}
+
+    def save_modes(self, port, info, modes):
+        """
+        Store the probed modes of one camera.
+        """
+        entries = self._read()
+        entries[info["identity"]] = {**entries.get(info["identity"], info), "port": port, "modes": modes}
+        self._write(entries)
+
+
+class CameraDiscovery:
+    """
+    Cached cameras now, a fresh probe in the background: load() returns what the cache knows immediately, start()
+    re-probes on a thread and calls `on_done(cameras)` from that thread when it has finished.
+    """
+    def __init__(self, cache=None, ports=range(8), timeout=3.0):
+        self.cache = cache or CameraCache()
+        self.ports = ports
+        self.timeout = timeout
+        self.thread = None
+        self.cameras = {}
+
+    def load(self):
+        self.cameras = self.cache.load()
+        return self.cameras
+
+    def start(self, on_done=None, known=None):
+        def run():
+            cameras = discover_cameras(self.ports, self.timeout, known)
+            try:
+                cameras = self.cache.save(cameras)
+            except OSError as e:
+                print("Could not cache cameras:", e)
+            self.cameras = cameras
+            if on_done is not None:
+                on_done(cameras)
+        self.thread = threading.Thread(target=run, name="CameraDiscovery", daemon=True)
+        self.thread.start()
+
+    def wait(self, timeout=None):
+        if self.thread is not None:
+            self.thread.join(timeout)
+        return self.cameras
+
+
+if __name__ == '__main__':
+    # Usage: python cameras.py [--modes]
+    import sys
+    cache = CameraCache()
+    start = time.perf_counter()
+    cached = cache.load()
+    print(f"cached: {len(cached)} camera(s) in {(time.perf_counter() - start) * 1000:.1f} ms")
+    start = time.perf_counter()
+    cameras = discover_cameras()
+    print(f"probed: {len(cameras)} camera(s) in {time.perf_counter() - start:.2f} s")
+    cameras = cache.save(cameras)
+    for port, info in cameras.items():
+        print(f"  {port}: {info['width']}x{info['height']} @ {info['fps']:g} fps  {info['identity']}")
+        if "--modes" in sys.argv[1:]:
+            from monitor import CAMERA_RESOLUTIONS
+            cap = cv2.VideoCapture(port)
+            info["modes"] = probe_modes(cap, CAMERA_RESOLUTIONS.values())
+            cap.release()
+            cache.save_modes(port, info, info["modes"])
+        for mode in info.get("modes", ()):
+            print(f"      {mode['width']}x{mode['height']} @ {mode['fps']:g} fps measured")
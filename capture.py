@@ -0,0 +1,244 @@
+import threading
+import time
+from contextlib import contextmanager
+
+import cv2
+import numpy as np
+
+
+class FrameRing:
+    """
+    Fixed-size ring of preallocated frame buffers shared by the capture thread and its consumers.
+
+    The producer decodes straight into a reserved slot, so capturing never allocates. When the ring is full
+    the producer either overwrites the oldest frame ("drop_oldest") or waits for a consumer to free a slot ("block").
+    Consumers get their own copy of a frame so slots can be recycled immediately.
+    """
+    POLICIES = ("drop_oldest", "block")
+
+    def __init__(self, capacity, shape, policy="drop_oldest", dtype=np.uint8):
+        if capacity < 1:
+            raise ValueError("Ring capacity must be at least 1")
+        if policy not in self.POLICIES:
+            raise ValueError(f"Unknown ring policy: {policy}")
+        self.capacity = capacity
+        self.policy = policy
+        self.dtype = dtype
+        self.cond = threading.Condition()
+        self.closed = False
+        self.dropped = 0  # Frames overwritten or discarded before any consumer saw them
+        self.written = 0
+        self._allocate(shape)
+
+    def _allocate(self, shape):
+        self.shape = tuple(shape)
+        self.slots = [np.empty(self.shape, dtype=self.dtype) for _ in range(self.capacity)]
+        self.timestamps = [0.0] * self.capacity
+        self.indices = [0] * self.capacity
+        self.head = 0  # Oldest committed frame
+        self.count = 0  # Number of committed frames
+        self.reserved = None
+
+    def resize(self, shape):
+        """
+        Reallocate the slots for a new frame shape. Any buffered frames are discarded.
+        """
+        with self.cond:
+            if tuple(shape) != self.shape:
+                self._allocate(shape)
+            self.cond.notify_all()
+
+    def wait_for_space(self, timeout=None):
+        """
+        Under the "block" policy, wait until a slot is free. Returns False if the ring was closed or the wait timed out.
+        """
+        with self.cond:
+            if self.policy == "block":
+                self.cond.wait_for(lambda: self.closed or self.count < self.capacity, timeout)
+                return not self.closed and self.count < self.capacity
+            return not self.closed
+
+    def reserve(self, timeout=None):
+        """
+        Reserve the next slot for writing and return its position, or None if the ring was closed or the wait timed out.
+        """
+        with self.cond:
+            if self.policy == "block":
+                if not self.cond.wait_for(lambda: self.closed or self.count < self.capacity, timeout):
+                    return None
+            if self.closed:
+                return None
+            if self.count == self.capacity:
+                # Overwrite the oldest frame
+                self.head = (self.head + 1) % self.capacity
+                self.count -= 1
+                self.dropped += 1
+            self.reserved = (self.head + self.count) % self.capacity
+            return self.reserved
+
+    def discard(self):
+        """
+        Count a captured frame that never made it into the ring, e.g. because the producer was stopped while waiting.
+        """
+        with self.cond:
+            self.dropped += 1
+
+    def commit(self, position, timestamp, frame_index):
+        """
+        Publish a previously reserved slot to consumers.
+        """
+        with self.cond:
+            if position != self.reserved:
+                return  # The ring was resized while the slot was being filled
+            self.timestamps[position] = timestamp
+            self.indices[position] = frame_index
+            self.reserved = None
+            self.count += 1
+            self.written += 1
+            self.cond.notify_all()
+
+    def get(self, block=True, timeout=None):
+        """
+        Pop the oldest frame. Returns a (frame, timestamp, frame_index) tuple, or None if nothing arrived in time.
+        """
+        with self.cond:
+            if block:
+                self.cond.wait_for(lambda: self.closed or self.count > 0, timeout)
+            if self.count == 0:
+                return None
+            position = self.head
+            item = (self.slots[position].copy(), self.timestamps[position], self.indices[position])
+            self.head = (self.head + 1) % self.capacity
+            self.count -= 1
+            self.cond.notify_all()
+            return item
+
+    def latest(self):
+        """
+        Return a copy of the newest frame without consuming it, or None if the ring is empty.
+        """
+        with self.cond:
+            if self.count == 0:
+                return None
+            position = (self.head + self.count - 1) % self.capacity
+            return self.slots[position].copy(), self.timestamps[position], self.indices[position]
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+
+    def __len__(self):
+        with self.cond:
+            return self.count
+
+    def memory_bytes(self):
+        return sum(slot.nbytes for slot in self.slots)
+
+
+class FrameGrabber(threading.Thread):
+    """
+    Background thread that continuously grabs frames from a cv2.VideoCapture into a FrameRing.
+
+    For video file sources (`is_file`), frames are timestamped from their position in the file so downstream
+    timing doesn't depend on how fast the file decodes, the ring is closed at the end of the file and
+    `finished` is set. With `realtime` the file is played back at its own frame rate, like a camera.
+    With a metrics.Metrics registry the time to grab and decode every frame is recorded as "read", and the time
+    spent waiting for a free ring slot separately as "ring_wait".
+    """
+    def __init__(self, cap, ring, retry_delay=0.01, is_file=False, realtime=False, metrics=None):
+        super().__init__(daemon=True, name="FrameGrabber")
+        self.cap = cap
+        self.ring = ring
+        self.retry_delay = retry_delay
+        self.is_file = is_file
+        self.realtime = realtime
+        self.cap_lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.finished = threading.Event()
+        self.frames_grabbed = 0
+        self.grab_failures = 0
+        self.read_time = metrics.histogram("read") if metrics is not None else None
+        self.ring_wait_time = metrics.histogram("ring_wait") if metrics is not None else None
+        self.start_time = time.time()
+
+    @contextmanager
+    def paused(self):
+        """
+        Hold the capture lock so the VideoCapture can be reconfigured or replaced safely.
+        """
+        with self.cap_lock:
+            yield
+
+    def run(self):
+        self.start_time = time.time()
+        while not self.stop_event.is_set():
+            if not self._wait_for_space():
+                break
+            with self.cap_lock:
+                start = time.perf_counter()
+                grabbed = self.cap is not None and self.cap.grab()
+                if grabbed:
+                    timestamp = self._timestamp()
+                    self._read_into_ring(timestamp)
+                    if self.read_time is not None:
+                        self.read_time.record(time.perf_counter() - start)
+            if not grabbed:
+                if self.is_file:
+                    break
+                self.grab_failures += 1
+                self.stop_event.wait(self.retry_delay)
+            elif self.is_file and self.realtime:
+                self.stop_event.wait(max(0.0, timestamp - time.time()))
+        if self.is_file:
+            self.ring.close()
+        self.finished.set()
+
+    def _timestamp(self):
+        if self.is_file:
+            return self.start_time + self.cap.get(cv2.CAP_PROP_POS_MSEC) / 1000
+        return time.time()
+
+    def _wait_for_space(self):
+        """
+        Under the "block" policy, wait for as long as it takes a consumer to free a ring slot before grabbing the
+        next frame, without holding the capture lock, so the source can still be reconfigured meanwhile.
+        Returns False once the ring is closed or the grabber stopped.
+        """
+        start = time.perf_counter()
+        while not self.ring.wait_for_space(timeout=0.5):
+            if self.ring.closed or self.stop_event.is_set():
+                return False
+        if self.ring_wait_time is not None:
+            self.ring_wait_time.record(time.perf_counter() - start)
+        return not self.stop_event.is_set()
+
+    def _read_into_ring(self, timestamp):
+        # Only this thread fills the ring, so after _wait_for_space() a slot is free and reserve() doesn't wait
+        position = self.ring.reserve(timeout=0)
+        if position is None:
+            self.ring.discard()
+            return
+        slot = self.ring.slots[position]
+        ret, frame = self.cap.retrieve(slot)
+        if not ret:
+            self.grab_failures += 1
+            return
+        if frame.shape != slot.shape:
+            # The camera resolution changed, reallocate the ring for the new size
+            self.ring.resize(frame.shape)
+            position = self.ring.reserve(timeout=0)
+            if position is None:
+                self.ring.discard()
+                return
+            np.copyto(self.ring.slots[position], frame)
+        elif frame is not slot and frame.ctypes.data != slot.ctypes.data:
+            np.copyto(slot, frame)
+        self.ring.commit(position, timestamp, self.frames_grabbed)
+        self.frames_grabbed += 1
+
+    def stop(self, timeout=2.0):
+        self.stop_event.set()
+        self.ring.close()
+        if self.is_alive():
+            self.join(timeout)
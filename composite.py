@@ -0,0 +1,187 @@
+import os
+import resource
+import sys
+import time
+
+import cv2
+import numpy as np
+
+# Composite modes and the suffix of the image each one is written to
+MODES = {
+    "max": "_composite.png",  # Brightest moving pixel, i.e. everything that moved over the sky
+    "trail": "_trail.png",  # Brightest pixel of every frame, star-trail style
+    "mean": "_mean.png",  # Average frame
+    "lastseen": "_lastseen.png",  # When each pixel last moved, as a color map (raw seconds in _lastseen.npy)
+}
+
+
+class Compositor:
+    """
+    Accumulates composites of a sequence of frames in a single pass.
+
+    All accumulators are allocated on the first frame and updated in place with OpenCV calls that write into
+    preallocated buffers, so adding a frame allocates nothing. "max" and "trail" stay uint8 like the frames,
+    "mean" sums into float32 and "lastseen" keeps float32 seconds since `origin` (NaN where nothing moved).
+    Masks at a different resolution than the frames (e.g. from a downscaled detector) are scaled up into a
+    preallocated buffer as well.
+
+    Compositors of consecutive parts of the same video can be combined with merge().
+    """
+    def __init__(self, modes=("max",), origin=None):
+        unknown = set(modes) - set(MODES)
+        if unknown:
+            raise ValueError(f"Unknown composite mode(s): {', '.join(sorted(unknown))}")
+        self.modes = tuple(modes)
+        self.origin = origin  # Timestamp that "lastseen" is relative to, the first frame's by default
+        self.frames = 0
+        self.max = None
+        self.trail = None
+        self.sum = None
+        self.last_seen = None
+        self._foreground = None
+        self._mask = None
+        self._binary = None
+
+    def _allocate(self, frame):
+        height, width = frame.shape[:2]
+        if "max" in self.modes:
+            self.max = np.zeros_like(frame)
+            self._foreground = np.empty_like(frame)
+        if "trail" in self.modes:
+            self.trail = np.zeros_like(frame)
+        if "mean" in self.modes:
+            self.sum = np.zeros(frame.shape, dtype=np.float32)
+        if "lastseen" in self.modes:
+            self.last_seen = np.full((height, width), np.nan, dtype=np.float32)
+            self._binary = np.empty((height, width), dtype=np.uint8)
+        self._mask = np.empty((height, width), dtype=np.uint8)
+
+    def add(self, frame, fgMask=None, timestamp=None):
+        """
+        Add a frame and its foreground mask. Without a mask only the unmasked modes ("trail", "mean") are updated.
+        """
+        if self.frames == 0:
+            self._allocate(frame)
+            if self.origin is None:
+                self.origin = timestamp or 0.0
+        self.frames += 1
+        if self.trail is not None:
+            cv2.max(self.trail, frame, dst=self.trail)
+        if self.sum is not None:
+            cv2.accumulate(frame, self.sum)
+        if fgMask is None:
+            return
+        mask = fgMask
+        if mask.shape != self._mask.shape:
+            mask = cv2.resize(fgMask, (self._mask.shape[1], self._mask.shape[0]), dst=self._mask, interpolation=cv2.INTER_NEAREST)
+        if self.max is not None:
+            self._foreground[:] = 0
+            cv2.copyTo(frame, mask, self._foreground)
+            cv2.max(self.max, self._foreground, dst=self.max)
+        if self.last_seen is not None and timestamp is not None:
+            cv2.threshold(mask, 0, 1, cv2.THRESH_BINARY, dst=self._binary)
+            np.copyto(self.last_seen, timestamp - self.origin, where=self._binary.view(bool))
+
+    def add_all(self, frames):
+        """
+        Add (frame, fgMask, timestamp) triples, e.g. the masked() frames of a recording's pre-roll.
+        """
+        for frame, fgMask, timestamp in frames:
+            self.add(frame, fgMask, timestamp)
+        return self
+
+    def merge(self, other):
+        """
+        Fold in the composite of a later part of the same video.
+        """
+        if other.frames == 0:
+            return self
+        if self.frames == 0:
+            return other
+        if self.max is not None:
+            cv2.max(self.max, other.max, dst=self.max)
+        if self.trail is not None:
+            cv2.max(self.trail, other.trail, dst=self.trail)
+        if self.sum is not None:
+            self.sum += other.sum
+        if self.last_seen is not None:
+            seen = ~np.isnan(other.last_seen)
+            self.last_seen[seen] = other.last_seen[seen] + (other.origin - self.origin)
+        self.frames += other.frames
+        return self
+
+    def images(self):
+        """
+        Return a dict mapping each mode to its 8-bit BGR image.
+        """
+        images = {}
+        if self.frames == 0:
+            return images
+        if self.max is not None:
+            images["max"] = self.max
+        if self.trail is not None:
+            images["trail"] = self.trail
+        if self.sum is not None:
+            images["mean"] = cv2.convertScaleAbs(self.sum, alpha=1.0 / self.frames)
+        if self.last_seen is not None:
+            seen = ~np.isnan(self.last_seen)
+            scaled = np.zeros(self.last_seen.shape, dtype=np.uint8)
+            if seen.any():
+                span = max(float(self.last_seen[seen].max()), 1e-6)
+                scaled[seen] = 1 + np.rint(self.last_seen[seen] / span * 254).astype(np.uint8)
+            lastseen = cv2.applyColorMap(scaled, cv2.COLORMAP_JET)
+            lastseen[~seen] = 0
+            images["lastseen"] = lastseen
+        return images
+
+    def write(self, video_path):
+        """
+        Write every mode next to the video, e.g. clip_composite.png for "max". Returns the paths written.
+        """
+        base = os.path.splitext(video_path)[0]
+        paths = []
+        for mode, image in self.images().items():
+            path = base + MODES[mode]
+            cv2.imwrite(path, image)
+            paths.append(path)
+        if self.last_seen is not None and self.frames:
+            np.save(base + "_lastseen.npy", self.last_seen)
+        return paths
+
+
+def peak_rss_mb():
+    """
+    Peak resident memory of this process so far, in megabytes.
+    """
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / 2**20 if sys.platform == "darwin" else rss / 2**10
+
+
+def measure_composite(video_path, modes=tuple(MODES), max_frames=None):
+    """
+    Composite a video with a fresh background model and return (frames per second, peak RSS in MB).
+    Only the background subtraction and compositing are timed, not the decoding.
+    """
+    cap = cv2.VideoCapture(video_path)
+    fgbg = cv2.createBackgroundSubtractorMOG2(history=80, varThreshold=20, detectShadows=False)
+    compositor = Compositor(modes)
+    elapsed = 0.0
+    while max_frames is None or compositor.frames < max_frames:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        timestamp = cap.get(cv2.CAP_PROP_POS_MSEC) / 1000
+        start = time.perf_counter()
+        compositor.add(frame, fgbg.apply(frame), timestamp)
+        elapsed += time.perf_counter() - start
+    cap.release()
+    return (compositor.frames / elapsed if elapsed else float("nan")), peak_rss_mb()
+
+
+if __name__ == '__main__':
+    # Usage: python composite.py <video file> [mode ...]
+    if len(sys.argv) < 2:
+        sys.exit("Usage: python composite.py <video file> [mode ...]")
+    modes = sys.argv[2:] or tuple(MODES)
+    fps, rss = measure_composite(sys.argv[1], modes)
+    print(f"{' '.join(modes)}: {fps:.1f} frames/s, peak RSS {rss:.0f} MB")
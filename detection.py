@@ -0,0 +1,288 @@
+import sys
+import threading
+import time
+
+import cv2
+import numpy as np
+
+from background import create_model
+from skymask import MaskRegion
+
+# Columns of a detections array, one row per detected object, in full-resolution pixels
+X, Y, W, H, AREA = range(5)
+
+
+def empty_detections():
+    return np.empty((0, 5), dtype=np.int32)
+
+
+def merge_boxes(detections, gap=0):
+    """
+    Merge boxes that overlap or are less than `gap` pixels apart into their union. Areas are summed.
+    """
+    if len(detections) < 2:
+        return detections
+    x1 = detections[:, X]
+    y1 = detections[:, Y]
+    x2 = x1 + detections[:, W]
+    y2 = y1 + detections[:, H]
+    # Pairwise "touching" matrix
+    near = ((x1[:, None] <= x2[None, :] + gap) & (x1[None, :] <= x2[:, None] + gap) &
+            (y1[:, None] <= y2[None, :] + gap) & (y1[None, :] <= y2[:, None] + gap))
+    # Propagate the smallest index through each group of touching boxes
+    labels = np.arange(len(detections))
+    while True:
+        new_labels = np.where(near, labels[None, :], len(detections)).min(axis=1)
+        if np.array_equal(new_labels, labels):
+            break
+        labels = new_labels
+    groups, inverse = np.unique(labels, return_inverse=True)
+    if len(groups) == len(detections):
+        return detections
+    merged = np.empty((len(groups), 5), dtype=np.int32)
+    left = np.full(len(groups), np.iinfo(np.int32).max)
+    top = left.copy()
+    right = np.full(len(groups), np.iinfo(np.int32).min)
+    bottom = right.copy()
+    np.minimum.at(left, inverse, x1)
+    np.minimum.at(top, inverse, y1)
+    np.maximum.at(right, inverse, x2)
+    np.maximum.at(bottom, inverse, y2)
+    merged[:, X] = left
+    merged[:, Y] = top
+    merged[:, W] = right - left
+    merged[:, H] = bottom - top
+    merged[:, AREA] = np.bincount(inverse, weights=detections[:, AREA], minlength=len(groups))
+    return merged
+
+
+def draw_boxes(frame, detections, buffer=0, color=(0, 0, 255), thickness=2):
+    """
+    Draw all boxes, grown by `buffer` pixels on each side, with a single polylines call.
+    """
+    if len(detections) == 0:
+        return
+    x1 = detections[:, X] - buffer
+    y1 = detections[:, Y] - buffer
+    x2 = detections[:, X] + detections[:, W] + buffer
+    y2 = detections[:, Y] + detections[:, H] + buffer
+    corners = np.stack([np.stack([x1, y1], 1), np.stack([x2, y1], 1), np.stack([x2, y2], 1), np.stack([x1, y2], 1)], 1)
+    cv2.polylines(frame, list(corners.astype(np.int32)), True, color, thickness)
+
+
+class Detector:
+    """
+    Finds moving objects in frames with background subtraction.
+
+    Detection runs on a downscaled (and optionally grayscale) copy of the frame, which is much cheaper than the
+    full-resolution BGR frame at HD and above. Bounding boxes are scaled back to full-resolution coordinates so
+    overlays and recordings don't need to know about the detection resolution.
+
+    Objects are found with connected components, which yields all areas and boxes as arrays in one call, so
+    filtering thousands of speckles on a noisy night is a single vectorized operation. With `merge_gap` set,
+    boxes closer than that many pixels are merged.
+
+    The scale is either a fraction of the frame (`scale`, e.g. 0.5) or a fixed detection width (`width`),
+    which takes precedence when set. `min_area` and `merge_gap` are expressed in full-resolution pixels.
+
+    `engine` picks the background model, one of background.ENGINES.
+    """
+    def __init__(self, history=80, var_threshold=20, detect_shadows=False, scale=1.0, width=None, grayscale=False,
+                 apply_morph=True, min_area=20, merge_gap=None, metrics=None, engine="average", difference_frames=2):
+        self.engine = engine
+        self.history = history
+        self.var_threshold = var_threshold
+        self.detect_shadows = detect_shadows
+        self.difference_frames = difference_frames
+        self.fgbg = create_model(engine, history, var_threshold, detect_shadows, difference_frames)
+        self.kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (3, 3))
+        self.lock = threading.Lock()  # The model is applied on the pipeline thread and tuned from the UI
+        self.scale = scale
+        self.width = width
+        self.grayscale = grayscale
+        self.apply_morph = apply_morph
+        self.min_area = min_area
+        self.merge_gap = merge_gap
+        self.cost = 0.0  # Smoothed seconds per detect() call
+        self.last_cost = 0.0
+        # Per-step histograms when given a metrics.Metrics registry
+        self.timings = None
+        if metrics is not None:
+            self.timings = [metrics.histogram(step) for step in ("prepare", "subtract", "morphology", "contours")]
+        self.mask = None  # Full-resolution sky mask, see set_mask()
+        self._region = None
+        self._small = None
+        self._gray = None
+
+    def set_history(self, history):
+        with self.lock:
+            self.history = history
+            self.fgbg.set_history(history)
+
+    def set_var_threshold(self, var_threshold):
+        with self.lock:
+            self.var_threshold = var_threshold
+            self.fgbg.set_threshold(var_threshold)
+
+    def set_engine(self, engine):
+        """
+        Switch to another background model. The new model starts empty and learns the sky from the next frames.
+        """
+        model = create_model(engine, self.history, self.var_threshold, self.detect_shadows, self.difference_frames)
+        with self.lock:
+            self.engine = engine
+            self.fgbg = model
+
+    def set_mask(self, mask):
+        """
+        Only detect where `mask` (uint8, non-zero over the sky) is set. Detection then runs on the bounding crop of
+        the mask only, so its cost drops with the masked area. The mask is scaled to the frame if their sizes
+        differ. None, or a mask without any sky, detects everywhere again.
+        """
+        if mask is not None and not cv2.countNonZero(mask):
+            mask = None
+        with self.lock:
+            self.mask = mask
+            self._region = None
+
+    def region(self, frame):
+        """
+        The MaskRegion of the current mask for this frame's size, or None without a mask.
+        """
+        mask = self.mask
+        if mask is None:
+            return None
+        height, width = frame.shape[:2]
+        scale = self.effective_scale(width)
+        region = self._region
+        if region is None or region.size != (height, width, scale):
+            region = MaskRegion(mask, height, width, scale)
+            self._region = region
+        return region
+
+    def effective_scale(self, frame_width):
+        """
+        The factor between detection and full-resolution coordinates for a frame of the given width.
+        """
+        if self.width:
+            return min(1.0, self.width / frame_width)
+        return min(1.0, self.scale)
+
+    def prepare(self, frame, scale=None):
+        """
+        Downscale and convert the frame for detection, reusing the buffers from the previous frame.
+        Returns the detection frame and its scale.
+        """
+        height, width = frame.shape[:2]
+        if scale is None:
+            scale = self.effective_scale(width)
+        small = frame
+        if scale < 1.0:
+            size = (max(1, round(width * scale)), max(1, round(height * scale)))
+            if self._small is None or self._small.shape[:2] != (size[1], size[0]) or self._small.shape[2:] != frame.shape[2:]:
+                self._small = None
+            self._small = cv2.resize(frame, size, dst=self._small, interpolation=cv2.INTER_AREA)
+            small = self._small
+        if self.grayscale and small.ndim == 3:
+            if self._gray is None or self._gray.shape != small.shape[:2]:
+                self._gray = None
+            self._gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY, dst=self._gray)
+            small = self._gray
+        return small, scale
+
+    def detect(self, frame):
+        """
+        Run detection on a full-resolution frame.
+        Returns the foreground mask (at detection resolution) and a detections array with one
+        (x, y, w, h, area) row per object, in frame coordinates.
+        """
+        start = time.perf_counter()
+        region = self.region(frame)
+        if region is not None:
+            small, scale = self.prepare(region.crop(frame), region.size[2])
+        else:
+            small, scale = self.prepare(frame)
+        prepared = time.perf_counter()
+
+        # Apply background subtraction
+        with self.lock:
+            fgMask = self.fgbg.apply(small)
+        if region is not None:
+            cv2.bitwise_and(fgMask, region.mask, dst=fgMask)
+        subtracted = time.perf_counter()
+
+        # Remove noise with morphological operations
+        if self.apply_morph:
+            fgMask = cv2.morphologyEx(fgMask, cv2.MORPH_OPEN, self.kernel, iterations=2)
+            fgMask = cv2.morphologyEx(fgMask, cv2.MORPH_CLOSE, self.kernel, iterations=2)
+        cleaned = time.perf_counter()
+
+        detections = self.find_objects(fgMask, scale)
+        if region is not None:
+            detections[:, X] += region.rect[0]
+            detections[:, Y] += region.rect[1]
+            fgMask = region.expand(fgMask)
+
+        end = time.perf_counter()
+        if self.timings is not None:
+            for histogram, seconds in zip(self.timings, (prepared - start, subtracted - prepared, cleaned - subtracted, end - cleaned)):
+                histogram.record(seconds)
+        self.last_cost = end - start
+        self.cost += 0.1 * (self.last_cost - self.cost) if self.cost else self.last_cost
+        return fgMask, detections
+
+    def find_objects(self, fgMask, scale=1.0):
+        """
+        Turn a foreground mask into a detections array, filtering out small movements.
+        """
+        count, _, stats, _ = cv2.connectedComponentsWithStats(fgMask, connectivity=8)
+        stats = stats[1:]  # Label 0 is the background
+        if count <= 1:
+            return empty_detections()
+        # The stats columns (left, top, width, height, area) already match the detections layout.
+        # Areas shrink with the square of the scale.
+        detections = np.ascontiguousarray(stats[stats[:, cv2.CC_STAT_AREA] >= self.min_area * scale * scale], dtype=np.int32)
+        if scale < 1.0:
+            detections[:, :4] = np.rint(detections[:, :4] / scale)
+            detections[:, AREA] = np.rint(detections[:, AREA] / (scale * scale))
+        if self.merge_gap is not None:
+            detections = merge_boxes(detections, self.merge_gap)
+        return detections
+
+
+def measure_detection_cost(frames, scales=(1.0, 0.5, 0.25), grayscale=(False, True), warmup=10, **detector_args):
+    """
+    Time detection over the same frames at each scale, with and without grayscale conversion.
+    Returns a dict mapping (scale, grayscale) to the mean milliseconds per frame, excluding the warm-up frames.
+    """
+    results = {}
+    for scale in scales:
+        for gray in grayscale:
+            detector = Detector(scale=scale, grayscale=gray, **detector_args)
+            total = 0.0
+            timed = 0
+            for i, frame in enumerate(frames):
+                detector.detect(frame)
+                if i >= warmup:
+                    total += detector.last_cost
+                    timed += 1
+            results[(scale, gray)] = total / timed * 1000 if timed else float("nan")
+    return results
+
+
+if __name__ == '__main__':
+    # Usage: python detection.py <video file> [max frames]
+    cap = cv2.VideoCapture(sys.argv[1])
+    max_frames = int(sys.argv[2]) if len(sys.argv) > 2 else 300
+    frames = []
+    while len(frames) < max_frames:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        frames.append(frame)
+    cap.release()
+    if not frames:
+        sys.exit(f"Could not read any frames from {sys.argv[1]}")
+    print(f"{len(frames)} frames at {frames[0].shape[1]}x{frames[0].shape[0]}")
+    for (scale, gray), cost in measure_detection_cost(frames).items():
+        print(f"scale {scale:<5} {'gray' if gray else 'bgr ':4}  {cost:7.2f} ms/frame")
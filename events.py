@@ -0,0 +1,312 @@
+"""
+Append-only log of detection events in SQLite.
+
+Every recording is one event: camera, start/end time, frame range, the union and peak area of everything that
+moved, the video and composite paths, the boxes detected in every frame and the tracks they formed. Events are indexed on time and camera
+so questions like "everything over 500 px in the east corner last night" don't touch any video file:
+
+    python events.py /var/lib/sentinel/events.sqlite --since "2026-10-16 20:00" --until "2026-10-17 06:00" --min-area 500
+
+Frame numbers count frames of the recorded video, which starts with the pre-roll, so they can be used with the
+clip's ClipIndex to seek to a box or track.
+"""
+import queue
+import sqlite3
+import sys
+import threading
+import time
+from datetime import datetime
+
+import numpy as np
+
+from detection import X, Y, W, H, AREA
+from tracking import path_stats
+
+EVENTS_FILE = "events.sqlite"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS events (
+    id INTEGER PRIMARY KEY,
+    camera TEXT NOT NULL,
+    start REAL NOT NULL,
+    end REAL NOT NULL,
+    start_frame INTEGER,
+    end_frame INTEGER,
+    frames INTEGER,
+    peak_area INTEGER,
+    x1 INTEGER, y1 INTEGER, x2 INTEGER, y2 INTEGER,
+    video_path TEXT,
+    composite_path TEXT
+);
+CREATE INDEX IF NOT EXISTS events_start ON events (start);
+CREATE INDEX IF NOT EXISTS events_camera_start ON events (camera, start);
+CREATE INDEX IF NOT EXISTS events_duration ON events (end - start);
+CREATE TABLE IF NOT EXISTS boxes (
+    event_id INTEGER NOT NULL REFERENCES events (id),
+    frame INTEGER NOT NULL,
+    timestamp REAL NOT NULL,
+    x INTEGER, y INTEGER, w INTEGER, h INTEGER, area INTEGER
+);
+CREATE INDEX IF NOT EXISTS boxes_event ON boxes (event_id);
+CREATE TABLE IF NOT EXISTS tracks (
+    event_id INTEGER NOT NULL REFERENCES events (id),
+    track INTEGER NOT NULL,
+    first_frame INTEGER,
+    last_frame INTEGER,
+    frames INTEGER,
+    speed REAL,
+    linearity REAL,
+    confirmed INTEGER
+);
+CREATE INDEX IF NOT EXISTS tracks_event ON tracks (event_id);
+CREATE TABLE IF NOT EXISTS track_points (
+    event_id INTEGER NOT NULL REFERENCES events (id),
+    track INTEGER NOT NULL,
+    frame INTEGER NOT NULL,
+    timestamp REAL NOT NULL,
+    x INTEGER, y INTEGER, w INTEGER, h INTEGER
+);
+CREATE INDEX IF NOT EXISTS track_points_event ON track_points (event_id, track);
+"""
+
+
+class Event:
+    """
+    A recording being collected: updated from the encode stage for every frame while it is active.
+    `first_frame` is the video frame number of the first frame added, i.e. the length of the recording's pre-roll.
+    """
+    def __init__(self, camera, video_path=None, first_frame=0):
+        self.camera = camera
+        self.video_path = video_path
+        self.first_frame = first_frame
+        self.composite_path = None
+        self.start = None
+        self.end = None
+        self.start_frame = None
+        self.end_frame = None
+        self.frames = 0
+        self.peak_area = 0
+        self.bbox = None  # Union of all boxes as [x1, y1, x2, y2]
+        self.boxes = []  # (frame, timestamp, detections) for every frame with detections
+        self.track_points = {}  # Track id -> [(frame, timestamp, x, y, w, h)]
+        self.confirmed_tracks = set()
+
+    def add(self, timestamp, detections, tracks=()):
+        index = self.first_frame + self.frames
+        if self.start is None:
+            self.start, self.start_frame = timestamp, index
+        self.end, self.end_frame = timestamp, index
+        self.frames += 1
+        for track in tracks:
+            self.track_points.setdefault(track.id, []).append((index, timestamp, *map(int, track.box[:4])))
+            if track.confirmed:
+                self.confirmed_tracks.add(track.id)
+        if len(detections) == 0:
+            return
+        self.boxes.append((index, timestamp, detections))
+        self.peak_area = max(self.peak_area, int(detections[:, AREA].max()))
+        x1 = int(detections[:, X].min())
+        y1 = int(detections[:, Y].min())
+        x2 = int((detections[:, X] + detections[:, W]).max())
+        y2 = int((detections[:, Y] + detections[:, H]).max())
+        if self.bbox is None:
+            self.bbox = [x1, y1, x2, y2]
+        else:
+            self.bbox = [min(self.bbox[0], x1), min(self.bbox[1], y1), max(self.bbox[2], x2), max(self.bbox[3], y2)]
+
+    def tracks(self):
+        """
+        Summary of every track seen during the event: (track, first_frame, last_frame, frames, speed, linearity,
+        confirmed), with speed in pixels per second.
+        """
+        rows = []
+        for track_id, points in self.track_points.items():
+            centers = [(x + w / 2, y + h / 2) for _, _, x, y, w, h in points]
+            speed, linearity = path_stats(centers, [point[1] for point in points])
+            rows.append((track_id, points[0][0], points[-1][0], len(points), speed, linearity,
+                         int(track_id in self.confirmed_tracks)))
+        return rows
+
+    def summary(self):
+        start = datetime.fromtimestamp(self.start).strftime('%Y-%m-%d %H:%M:%S')
+        text = (f"Event {self.camera} {start} {self.end - self.start:.1f}s, frames {self.start_frame}-{self.end_frame}, "
+                f"peak area {self.peak_area}")
+        if self.track_points:
+            text += f", {len(self.confirmed_tracks)} of {len(self.track_points)} track(s) confirmed"
+        return text
+
+
+class EventLog:
+    """
+    The event database. Inserts are queued and committed by a single writer thread so the pipeline never waits on
+    the disk; queries open their own connection and can run from any thread while events are being written.
+    """
+    def __init__(self, path):
+        self.path = path
+        connection = sqlite3.connect(path)
+        connection.execute("PRAGMA journal_mode=WAL")  # Readers don't block the writer
+        connection.executescript(SCHEMA)
+        connection.close()
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self._write, name="EventLog", daemon=True)
+        self.thread.start()
+
+    def append(self, event):
+        """
+        Queue a finished event for writing. Events without any frames are ignored.
+        """
+        if event.start is not None:
+            self.queue.put(event)
+
+    def _write(self):
+        connection = sqlite3.connect(self.path)
+        while True:
+            event = self.queue.get()
+            if event is None:
+                break
+            try:
+                with connection:
+                    self._insert(connection, event)
+            except sqlite3.Error as e:
+                print(f"Could not log event from {event.camera}:", e)
+        connection.close()
+
+    def _insert(self, connection, event):
+        bbox = event.bbox or [None] * 4
+        cursor = connection.execute(
+            "INSERT INTO events (camera, start, end, start_frame, end_frame, frames, peak_area, x1, y1, x2, y2, "
+            "video_path, composite_path) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (event.camera, event.start, event.end, event.start_frame, event.end_frame, event.frames, event.peak_area,
+             *bbox, event.video_path, event.composite_path))
+        event_id = cursor.lastrowid
+        connection.executemany(
+            "INSERT INTO boxes (event_id, frame, timestamp, x, y, w, h, area) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            ((event_id, int(frame), float(timestamp), *map(int, row)) for frame, timestamp, detections in event.boxes
+             for row in detections))
+        connection.executemany(
+            "INSERT INTO tracks (event_id, track, first_frame, last_frame, frames, speed, linearity, confirmed) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)", ((event_id, *row) for row in event.tracks()))
+        connection.executemany(
+            "INSERT INTO track_points (event_id, track, frame, timestamp, x, y, w, h) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            ((event_id, track_id, int(frame), float(timestamp), x, y, w, h)
+             for track_id, points in event.track_points.items() if track_id in event.confirmed_tracks
+             for frame, timestamp, x, y, w, h in points))
+
+    def close(self):
+        """
+        Write the queued events and stop the writer thread.
+        """
+        self.queue.put(None)
+        self.thread.join()
+
+    def query(self, since=None, until=None, camera=None, min_area=None, region=None, limit=None):
+        """
+        Events overlapping [since, until] (epoch seconds), optionally only from one camera, with a peak area of at
+        least `min_area` and movement overlapping `region` = (x1, y1, x2, y2). Returns a list of dicts, oldest first.
+
+        The start index is searched from `since` minus the longest event there is, so a query only reads the events
+        around its time range however long the history is.
+        """
+        connection = sqlite3.connect(self.path)
+        connection.row_factory = sqlite3.Row
+        try:
+            return [dict(row) for row in connection.execute(*self._query_sql(connection, since, until, camera,
+                                                                              min_area, region, limit))]
+        finally:
+            connection.close()
+
+    def _query_sql(self, connection, since, until, camera, min_area, region, limit):
+        clauses, params = [], []
+        if since is not None:
+            longest = connection.execute("SELECT MAX(end - start) FROM events").fetchone()[0] or 0.0
+            clauses.append("start >= ? AND end >= ?")
+            params.extend([since - longest, since])
+        if until is not None:
+            clauses.append("start <= ?")
+            params.append(until)
+        if camera is not None:
+            clauses.append("camera = ?")
+            params.append(camera)
+        if min_area is not None:
+            clauses.append("peak_area >= ?")
+            params.append(min_area)
+        if region is not None:
+            clauses.append("x1 <= ? AND x2 >= ? AND y1 <= ? AND y2 >= ?")
+            params.extend([region[2], region[0], region[3], region[1]])
+        sql = "SELECT * FROM events"
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        sql += " ORDER BY start"
+        if limit:
+            sql += f" LIMIT {int(limit)}"
+        return sql, params
+
+    def boxes(self, event_id):
+        """
+        All boxes of an event as an array with one (frame, timestamp, x, y, w, h, area) row per box.
+        """
+        connection = sqlite3.connect(self.path)
+        try:
+            rows = connection.execute("SELECT frame, timestamp, x, y, w, h, area FROM boxes WHERE event_id = ? "
+                                      "ORDER BY frame", (event_id,)).fetchall()
+        finally:
+            connection.close()
+        return np.array(rows, dtype=np.float64).reshape(-1, 7)
+
+    def tracks(self, event_id, confirmed_only=False):
+        """
+        The tracks of an event as dicts (track, first_frame, last_frame, frames, speed, linearity, confirmed), each
+        with its "points": an array with one (frame, timestamp, x, y, w, h) row per frame the track was seen in.
+        Points are only kept for confirmed tracks; the others are summarized to help tune the tracking rules.
+        """
+        connection = sqlite3.connect(self.path)
+        connection.row_factory = sqlite3.Row
+        try:
+            sql = "SELECT * FROM tracks WHERE event_id = ?" + (" AND confirmed" if confirmed_only else "") + " ORDER BY track"
+            tracks = [dict(row) for row in connection.execute(sql, (event_id,))]
+            for track in tracks:
+                rows = connection.execute("SELECT frame, timestamp, x, y, w, h FROM track_points WHERE event_id = ? "
+                                          "AND track = ? ORDER BY frame", (event_id, track["track"])).fetchall()
+                track["points"] = np.array([tuple(row) for row in rows], dtype=np.float64).reshape(-1, 6)
+        finally:
+            connection.close()
+        return tracks
+
+
+def parse_time(text):
+    """
+    Accept epoch seconds or an ISO date/time such as "2026-10-16 20:00".
+    """
+    try:
+        return float(text)
+    except ValueError:
+        return datetime.fromisoformat(text).timestamp()
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description="Query the sentinel event log.")
+    parser.add_argument("database")
+    parser.add_argument("--since", type=parse_time, help="epoch seconds or ISO time")
+    parser.add_argument("--until", type=parse_time, help="epoch seconds or ISO time")
+    parser.add_argument("--camera")
+    parser.add_argument("--min-area", type=int)
+    parser.add_argument("--region", type=int, nargs=4, metavar=("X1", "Y1", "X2", "Y2"))
+    parser.add_argument("--limit", type=int)
+    parser.add_argument("--tracks", action="store_true", help="also list the confirmed tracks of every event")
+    args = parser.parse_args()
+
+    log = EventLog(args.database)
+    start = time.perf_counter()
+    events = log.query(args.since, args.until, args.camera, args.min_area, args.region, args.limit)
+    elapsed = time.perf_counter() - start
+    log.close()
+    for event in events:
+        when = datetime.fromtimestamp(event["start"]).strftime('%Y-%m-%d %H:%M:%S')
+        print(f"{event['id']:>7} {event['camera']:<8} {when} {event['end'] - event['start']:6.1f}s "
+              f"area {event['peak_area']:>7} {event['composite_path'] or event['video_path']}")
+        if args.tracks:
+            for track in log.tracks(event["id"], confirmed_only=True):
+                print(f"{'':>9}track {track['track']:<6} frames {track['first_frame']}-{track['last_frame']} "
+                      f"{track['speed']:7.1f} px/s  linearity {track['linearity']:.2f}")
+    print(f"{len(events)} event(s) in {elapsed * 1000:.1f} ms", file=sys.stderr)
@@ -0,0 +1,207 @@
+"""
+Run sentinel without a GUI, e.g. as a systemd service on a rooftop box:
+
+    python headless.py --source 0 --width 1920 --height 1080 --fps 60 --save-path /var/lib/sentinel --autorecord
+
+Settings can also come from a JSON config file whose keys are the option names below with underscores
+(e.g. {"save_path": "/var/lib/sentinel", "autorecord": true}); command line flags override the file.
+A video file can be given as --source to run the same detection and autorecord logic without a camera.
+Several sources can be monitored at once (--source 0 1 2); each gets its own capture thread, background model
+and recordings in a subdirectory of the save path (cam0, cam1, ...), while encoding and post-processing share
+a fixed number of worker threads.
+"""
+import argparse
+import json
+import os
+import signal
+import sys
+import threading
+import time
+
+from background import ENGINES
+from cameras import CameraDiscovery
+from composite import MODES
+from metrics import MetricsExporter
+from monitor import MonitorGroup, CODECS, is_file_source
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Monitor the skies for movement without a GUI.")
+    parser.add_argument("--config", help="JSON file with default values for any of the options below")
+
+    source = parser.add_argument_group("source")
+    source.add_argument("--source", nargs="+", default=["0"], help="camera ports or video files (default: 0)")
+    source.add_argument("--width", type=int, default=1280, help="camera frame width")
+    source.add_argument("--height", type=int, default=720, help="camera frame height")
+    source.add_argument("--fps", type=float, default=60, help="camera frame rate")
+    source.add_argument("--realtime", action="store_true", help="play video files back at their own frame rate")
+    source.add_argument("--no-load-shedding", dest="load_shedding", action="store_false",
+                        help="never skip detection or drop frames when processing falls behind a camera")
+    source.add_argument("--ring-capacity", type=int, default=8, help="frames buffered after capture")
+    source.add_argument("--ring-policy", choices=("drop_oldest", "block"), help="what to do when the capture buffer is full "
+                        "(default: block for video files, drop_oldest for cameras)")
+
+    recording = parser.add_argument_group("recording")
+    recording.add_argument("--save-path", default="", help="directory for recordings and composites")
+    recording.add_argument("--autorecord", action="store_true", help="record whenever movement is detected")
+    recording.add_argument("--default-codec", choices=sorted(CODECS), default="FFV1", help="recording codec")
+    recording.add_argument("--pre-roll-seconds", type=float, default=2.0, help="seconds kept from before the movement")
+    recording.add_argument("--pre-roll-max-mb", type=float, default=256, help="memory cap for the pre-roll buffer")
+    recording.add_argument("--pre-roll-compression", choices=("jpg", "png"), help="compress pre-roll frames in memory")
+    recording.add_argument("--post-roll-seconds", type=float, default=1.0, help="seconds without movement before stopping")
+    recording.add_argument("--writer-policy", choices=("block", "drop", "downgrade"), default="block",
+                           help="what to do when the encoder falls behind")
+    recording.add_argument("--writer-queue-size", type=int, default=120, help="frames buffered before the encoder")
+    recording.add_argument("--spool-recording", action="store_true",
+                           help="write event recordings as raw frames to a memory-mapped spool and encode them afterwards")
+    recording.add_argument("--spool-chunk-mb", type=int, default=256, help="the spool file grows by this much at a time")
+    recording.add_argument("--spool-max-defer", type=float, default=60,
+                           help="seconds a spool waits for recordings to stop before it is encoded anyway")
+    recording.add_argument("--continuous", action="store_true", help="also record everything into rolling segments")
+    recording.add_argument("--segment-seconds", type=float, default=600, help="length of a continuous segment")
+    recording.add_argument("--segment-mb", type=float, help="also start a new segment once one reaches this size")
+    recording.add_argument("--disk-quota-gb", type=float,
+                           help="delete the oldest segments without movement when the save path grows beyond this")
+    recording.add_argument("--no-clip-index", dest="clip_index", action="store_false",
+                           help="don't write a frame index (.idx) next to every recording")
+    recording.add_argument("--no-event-log", dest="log_events", action="store_false",
+                           help="don't append recordings to events.sqlite in the save path")
+    recording.add_argument("--encoder-workers", type=int, default=2, help="encoder threads shared by all sources")
+
+    post = parser.add_argument_group("post-processing")
+    post.add_argument("--post-workers", type=int, default=2, help="composite workers shared by all sources")
+    post.add_argument("--post-threads", dest="post_processes", action="store_false",
+                      help="run composite workers as threads instead of processes")
+    post.add_argument("--post-chunk-frames", type=int, default=900,
+                      help="composite longer recordings as parallel ranges of this many frames, 0 to disable")
+    post.add_argument("--no-live-composite", dest="live_composite", action="store_false",
+                      help="build composites by decoding finished recordings instead of from the live frames")
+    post.add_argument("--composite-modes", nargs="+", choices=sorted(MODES), default=["max"],
+                      help="composites to build: max (moving objects), trail (star trails), mean, lastseen (time map)")
+    post.add_argument("--post-warmup-frames", type=int, default=0,
+                      help="frames the composite's background model learns from before compositing")
+    post.add_argument("--post-on-exit", choices=("finish", "persist"), default="finish",
+                      help="finish pending composites before exiting, or save them to resume on the next start")
+
+    detection = parser.add_argument_group("detection")
+    detection.add_argument("--background-engine", choices=ENGINES, default="average",
+                           help="background model: mog2, knn, average (running average, cheapest for a static sky) "
+                           "or difference (N-frame differencing)")
+    detection.add_argument("--fgbg-history", type=int, default=80, help="background model history")
+    detection.add_argument("--fgbg-var-threshold", type=float, default=20,
+                           help="background model threshold: MOG2 variance, or intensity difference for average/difference")
+    detection.add_argument("--difference-frames", type=int, default=2,
+                           help="how many frames back the difference engine compares with")
+    detection.add_argument("--no-morph", dest="apply_morph", action="store_false", help="skip the morphological noise removal")
+    detection.add_argument("--bb-sensitivity", type=int, default=20, help="minimum object area in pixels")
+    detection.add_argument("--bounding-box-buffer", type=int, default=20, help="padding around drawn boxes, and merge distance")
+    detection.add_argument("--merge-nearby-boxes", action="store_true", help="merge boxes closer than the box buffer")
+    detection.add_argument("--detection-scale", type=float, default=1.0, help="detect on a frame scaled by this factor")
+    detection.add_argument("--detection-width", type=int, help="detect on a frame scaled to this width")
+    detection.add_argument("--no-tracking", dest="tracking", action="store_false",
+                           help="record on any detection instead of only on objects tracked across frames")
+    detection.add_argument("--track-min-frames", type=int, default=5, help="frames an object must be seen in")
+    detection.add_argument("--track-min-distance", type=float, default=10, help="pixels an object must move")
+    detection.add_argument("--track-min-linearity", type=float, default=0.7,
+                           help="how straight an object's path must be, from 0 (any) to 1 (a straight line)")
+    detection.add_argument("--track-max-distance", type=float, default=80,
+                           help="pixels a detection may be from where its object was expected")
+    detection.add_argument("--track-max-missed", type=int, default=5, help="frames an object may go undetected")
+    detection.add_argument("--mask-file", nargs="+", help="sky mask: an image (white = sky) or JSON polygons, "
+                           "one for all sources or one per source; nothing outside it is detected")
+    detection.add_argument("--detection-grayscale", action="store_true", help="detect on a grayscale frame")
+
+    overlay = parser.add_argument_group("overlay")
+    overlay.add_argument("--show-bboxes", action="store_true", help="draw bounding boxes into recordings")
+    overlay.add_argument("--no-timestamp", dest="show_timestamp", action="store_false", help="don't draw the timestamp")
+    overlay.add_argument("--show-fps", action="store_true", help="draw the frame rate")
+
+    metrics = parser.add_argument_group("metrics")
+    metrics.add_argument("--metrics-file", help="export per-stage timings, drops and queue depths to this .json "
+                         "(latest snapshot) or .csv (appended) file")
+    metrics.add_argument("--metrics-interval", type=float, default=10, help="seconds between metrics exports")
+    metrics.add_argument("--metrics-port", type=int, help="serve the metrics as JSON at http://127.0.0.1:PORT/metrics")
+
+    parser.add_argument("--list-cameras", action="store_true", help="probe the camera ports, print them and exit")
+    parser.add_argument("--stats-interval", type=float, default=10, help="seconds between status lines, 0 to disable")
+    return parser
+
+
+def parse_args(argv=None):
+    parser = build_parser()
+    args, _ = parser.parse_known_args(argv)
+    if args.config:
+        with open(args.config) as f:
+            config = json.load(f)
+        known = {action.dest for action in parser._actions}
+        unknown = set(config) - known
+        if unknown:
+            parser.error(f"unknown option(s) in {args.config}: {', '.join(sorted(unknown))}")
+        parser.set_defaults(**config)
+    return parser.parse_args(argv)
+
+
+# Options that configure the run rather than the Monitor
+RUN_OPTIONS = ("config", "source", "width", "height", "fps", "stats_interval", "list_cameras", "metrics_file",
+               "metrics_interval", "metrics_port", "mask_file")
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.list_cameras:
+        discovery = CameraDiscovery()
+        discovery.start()
+        for port, info in discovery.wait().items():
+            print(f"{port}: {info['width']}x{info['height']} @ {info['fps']:g} fps  {info['identity']}")
+        return
+    if args.save_path and not os.path.isdir(args.save_path):
+        sys.exit(f"Save path {args.save_path} is not a directory")
+
+    sources = [args.source] if isinstance(args.source, (str, int)) else args.source  # A config file may give a single value
+    masks = [args.mask_file] if isinstance(args.mask_file, str) else args.mask_file or [None]
+    if len(masks) == 1:
+        masks = masks * len(sources)
+    elif len(masks) != len(sources):
+        sys.exit(f"Got {len(masks)} mask files for {len(sources)} sources")
+    options = {name: value for name, value in vars(args).items() if name not in RUN_OPTIONS}
+    ring_policy = options.pop("ring_policy")
+    group = MonitorGroup(**options)
+    group.on_message = lambda text: print(text, flush=True)
+    for i, source in enumerate(sources):
+        name = f"cam{i}" if len(sources) > 1 else None
+        policy = ring_policy or ("block" if is_file_source(source) else "drop_oldest")
+        try:
+            monitor = group.add(source, name, args.width, args.height, args.fps, ring_policy=policy, mask_file=masks[i])
+        except (OSError, ValueError) as e:
+            group.stop()
+            sys.exit(f"Could not load mask {masks[i]}: {e}")
+        if monitor is None:
+            group.stop()
+            sys.exit(f"Could not open source {source}")
+        prefix = f"[{name}] " if name else ""
+        monitor.on_recording_changed = lambda recording, prefix=prefix: print(prefix + ("Recording started" if recording else "Recording stopped"), flush=True)
+        monitor.on_message = lambda text: print(text, flush=True)
+        print(f"{prefix}Monitoring {source} at {int(monitor.width)}x{int(monitor.height)}", flush=True)
+    group.start()
+    exporter = MetricsExporter(group.metricsSnapshot, args.metrics_file, args.metrics_interval, args.metrics_port)
+    exporter.start()
+
+    stop_event = threading.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(sig, lambda *_: stop_event.set())
+
+    last_stats = time.time()
+    while not stop_event.is_set():
+        if group.waitUntilFinished(0.5):
+            break  # End of all video file sources
+        if args.stats_interval and time.time() - last_stats >= args.stats_interval:
+            last_stats = time.time()
+            print(group.statusText(), flush=True)
+
+    group.stop()
+    exporter.stop()
+    print(group.statusText(), flush=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,189 @@
+"""
+Timing histograms and their export, for capacity planning: how long every step takes per frame, where frames
+are dropped and where they queue.
+
+Recording a sample is a bisect and a few additions under a lock, cheap enough to do for every frame of every
+stage. Histograms are cumulative since the start; compare two exports to get the rates in between.
+
+The numbers can be exported to a JSON file (the latest snapshot, rewritten periodically), a CSV file (one row per
+metric and snapshot, appended) and/or served as JSON on a local HTTP port:
+
+    curl http://127.0.0.1:9108/metrics
+"""
+import bisect
+import csv
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Upper bounds of the histogram buckets in milliseconds, ten per decade from 0.01 ms to 10 s (so percentiles are
+# within 26%); the last bucket takes everything above
+BUCKETS_MS = tuple(float(f"{10 ** (exponent / 10):.3g}") for exponent in range(-20, 41))
+
+
+class Histogram:
+    """
+    Distribution of durations in fixed buckets (BUCKETS_MS), plus count, sum and maximum.
+    """
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS_MS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.lock = threading.Lock()
+
+    def record(self, seconds):
+        ms = seconds * 1000
+        bucket = bisect.bisect_left(BUCKETS_MS, ms)
+        with self.lock:
+            self.counts[bucket] += 1
+            self.count += 1
+            self.total += ms
+            if ms > self.max:
+                self.max = ms
+
+    def percentile(self, q):
+        """
+        The upper bound of the bucket holding the q-th percentile (0-100), in milliseconds.
+        """
+        with self.lock:
+            counts, count, maximum = list(self.counts), self.count, self.max
+        if not count:
+            return 0.0
+        rank = q / 100 * count
+        seen = 0
+        for bound, n in zip(BUCKETS_MS, counts):
+            seen += n
+            if seen >= rank:
+                return min(bound, maximum)
+        return maximum
+
+    def snapshot(self):
+        with self.lock:
+            count, total, maximum, counts = self.count, self.total, self.max, list(self.counts)
+        return {
+            "count": count,
+            "mean_ms": total / count if count else 0.0,
+            "p50_ms": self.percentile(50),
+            "p90_ms": self.percentile(90),
+            "p99_ms": self.percentile(99),
+            "max_ms": maximum,
+            "buckets": dict(zip([*map(str, BUCKETS_MS), "inf"], counts)),
+        }
+
+
+class Metrics:
+    """
+    Named histograms of one monitor. Components look their histogram up once and record into it directly.
+    """
+    def __init__(self):
+        self.histograms = {}
+        self.lock = threading.Lock()
+
+    def histogram(self, name):
+        with self.lock:
+            if name not in self.histograms:
+                self.histograms[name] = Histogram()
+            return self.histograms[name]
+
+    def snapshot(self):
+        with self.lock:
+            histograms = dict(self.histograms)
+        return {name: histogram.snapshot() for name, histogram in histograms.items()}
+
+
+def flatten(snapshot, prefix=""):
+    """
+    Turn a nested snapshot into (name, value) pairs such as ("timings.detect.p99_ms", 12.0). Buckets are left out.
+    """
+    rows = []
+    for key, value in snapshot.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            if key != "buckets":
+                rows.extend(flatten(value, name + "."))
+        elif isinstance(value, (int, float)):
+            rows.append((name, value))
+    return rows
+
+
+class MetricsExporter:
+    """
+    Export `collect()`, a dict of camera name -> metrics snapshot, every `interval` seconds to `path` (.json or
+    .csv) and/or on demand at http://127.0.0.1:<port>/metrics.
+    """
+    def __init__(self, collect, path=None, interval=10, port=None, on_message=print):
+        self.collect = collect
+        self.path = path
+        self.interval = interval
+        self.port = port
+        self.on_message = on_message
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.server = None
+
+    def start(self):
+        if self.path:
+            self.thread = threading.Thread(target=self.run, name="MetricsExporter", daemon=True)
+            self.thread.start()
+        if self.port:
+            collect = self.collect
+
+            class Handler(BaseHTTPRequestHandler):
+                def do_GET(self):
+                    if self.path.split("?")[0] not in ("/", "/metrics"):
+                        self.send_error(404)
+                        return
+                    body = json.dumps({"time": time.time(), "cameras": collect()}).encode()
+                    self.send_response(200)
+                    self.send_header("Content-Type", "application/json")
+                    self.send_header("Content-Length", str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+
+                def log_message(self, *args):
+                    pass
+
+            self.server = ThreadingHTTPServer(("127.0.0.1", self.port), Handler)
+            self.server.daemon_threads = True
+            threading.Thread(target=self.server.serve_forever, name="MetricsServer", daemon=True).start()
+
+    def run(self):
+        while not self.stop_event.wait(self.interval):
+            self.export()
+
+    def export(self):
+        try:
+            if self.path.endswith(".csv"):
+                self._append_csv(self.collect())
+            else:
+                self._write_json(self.collect())
+        except OSError as e:
+            self.on_message(f"Could not export metrics to {self.path}: {e}")
+
+    def _write_json(self, cameras):
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"time": time.time(), "cameras": cameras}, f, indent=1)
+        os.replace(tmp_path, self.path)
+
+    def _append_csv(self, cameras):
+        new_file = not os.path.exists(self.path)
+        now = round(time.time(), 3)
+        with open(self.path, "a", newline="") as f:
+            writer = csv.writer(f)
+            if new_file:
+                writer.writerow(["time", "camera", "metric", "value"])
+            for camera, snapshot in cameras.items():
+                writer.writerows([now, camera, name, round(value, 4)] for name, value in flatten(snapshot))
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.export()  # Final numbers
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
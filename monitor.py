@@ -0,0 +1,874 @@
+import os, uuid
+import cv2
+from datetime import datetime
+import time
+import threading
+from capture import FrameRing, FrameGrabber
+from pipeline import Pipeline
+from recording import RecordingWriter, PreRollBuffer, EncoderPool, ClipIndex, SegmentRecorder
+from retention import RetentionManager
+from postprocess import PostProcessor, PENDING_FILE, composite_path
+from composite import Compositor
+from events import Event, EventLog, EVENTS_FILE
+from cameras import probe_modes
+from detection import Detector, draw_boxes
+from metrics import Metrics
+from skymask import load_mask
+from tracking import Tracker
+from overload import OverloadController, STEPS
+from spool import SpoolWriter, SpoolTranscoder, INDEX, INDEX_ALL_KEYFRAMES, NO_INDEX
+
+CODECS = {
+    "FFV1": "FFV1 (lossless)",
+    "MJPG": "MJPG",
+    "XVID": "XVID",
+    "MP4V": "MP4V",
+    "HFYU": "HFYU (lossless)",
+}
+
+CODEC_EXTENSIONS = {
+    "FFV1": ".avi",
+    "MJPG": ".avi",
+    "XVID": ".avi",
+    "MP4V": ".mp4",
+    "HFYU": ".avi",
+}
+
+# Codecs that compress every frame on its own, so every frame is a keyframe
+INTRA_CODECS = {"FFV1", "HFYU", "MJPG"}
+
+CAMERA_RESOLUTIONS = {
+    "QVGA": (320, 240),
+    "VGA": (640, 480),
+    "SVGA": (800, 600),
+    "XGA": (1024, 768),
+    "HD": (1280, 720),
+    "WXGA": (1366, 768),
+    "Full HD": (1920, 1080),
+    "2K": (2048, 1080),
+    "QHD": (2560, 1440),
+    "3K": (3072, 1620),
+    "UHD": (3840, 2160),
+    "4K": (4096, 2160)
+}
+
+
+def is_file_source(source):
+    """
+    Camera ports are ints (or digit strings from the command line), anything else is a video file.
+    """
+    return not isinstance(source, int) and not str(source).isdigit()
+
+
+class Monitor:
+    """
+    Watches one video source for movement: capture, detection, autorecord and composite post-processing.
+
+    This is everything sentinel does apart from drawing windows, so it must not import Qt. The GUI (sentinel.py)
+    and the headless daemon (headless.py) both drive a Monitor. Any attribute set in __init__ can be overridden
+    with a keyword argument of the same name.
+    """
+    def __init__(self, **options):
+        self.name = None  # Camera name in logs; recordings then go to a subdirectory of save_path with this name
+        self.cap = None
+        self.width = 0
+        self.height = 0
+        self.fps = 30.0
+        self.realtime = False  # Play video file sources back at their own frame rate
+        self.out = None
+        self.save_path = ''
+        self.autorecord = False
+        self.recording = False
+        self.show_bboxes = False
+        self.show_timestamp = True
+        self.show_fps = False
+        self.last_movement_time = 0  # Capture timestamp of the last frame with movement
+        self.pre_roll_seconds = 2.0  # Seconds of video kept from before the movement that started a recording
+        self.pre_roll_max_mb = 256  # Memory cap for the pre-roll buffer
+        self.pre_roll_compression = None  # None (raw), "jpg" or "png"
+        self.post_roll_seconds = 1.0  # Seconds without movement before an autorecording stops
+        self.default_codec = "FFV1"
+        self.codecs = dict(CODECS)
+        self.codec_extensions = dict(CODEC_EXTENSIONS)
+
+        self.background_engine = "average"  # Background model, any of background.ENGINES
+        self.fgbg_history = 80
+        self.fgbg_var_threshold = 20
+        self.fgbg_detect_shadows = False
+        self.difference_frames = 2  # How many frames back the "difference" engine compares with
+        self.apply_morph = True
+        self.bb_sensitivity = 20
+        self.bounding_box_buffer = 20
+        self.merge_nearby_boxes = False  # Merge boxes closer than bounding_box_buffer into one detection
+
+        # Detection runs on a downscaled copy of the frame, boxes are mapped back to full resolution
+        self.detection_scale = 1.0
+        self.detection_width = None  # Fixed detection width in pixels, overrides the scale when set
+        self.detection_grayscale = False
+        # Only movement that forms a track triggers recordings: an object seen in track_min_frames frames that moved
+        # at least track_min_distance pixels along a path at least track_min_linearity straight (see tracking.py)
+        self.tracking = True
+        self.track_min_frames = 5
+        self.track_min_distance = 10
+        self.track_min_linearity = 0.7
+        self.track_max_distance = 80  # How far (pixels) a detection may be from where its track was expected
+        self.track_max_missed = 5  # Frames a track may go undetected before it ends
+        self.mask_file = None  # Sky mask (image or JSON polygons, see skymask.py); detection ignores everything outside it
+
+        self.load_shedding = True  # Shed load step by step when processing falls behind a live source (see overload.py)
+        self.ring_capacity = 8  # Number of preallocated frames between the capture thread and the pipeline
+        self.ring_policy = "drop_oldest"  # "drop_oldest" or "block" when the ring is full
+        self.writer_queue_size = 120  # Frames buffered between the pipeline and the encoder thread
+        self.writer_policy = "block"  # "block", "drop" or "downgrade" when the encoder falls behind
+        self.encoder_pool = None  # Shared EncoderPool; each recording gets its own writer thread without one
+        # Spool event recordings as raw frames into memory-mapped files and encode them afterwards (see spool.py)
+        self.spool_recording = False
+        self.spool_chunk_mb = 256  # The spool file grows by this much at a time
+        self.spool_max_defer = 60  # Seconds a spool waits for recordings to stop before it is encoded anyway
+        self.spool_transcoder = None  # Shared SpoolTranscoder; the monitor starts (and stops) its own without one
+        self.post_processor = None  # Shared PostProcessor; the monitor starts (and stops) its own without one
+        self.post_workers = 2  # Size of the monitor's own post-processing pool
+        self.post_processes = True  # Composite in worker processes rather than threads
+        self.post_chunk_frames = 900  # Recordings longer than this are composited in parallel frame ranges
+        self.continuous = False  # Record everything into rolling segments, besides the motion-triggered recordings
+        self.segment_seconds = 600  # Length of a continuous segment
+        self.segment_mb = None  # Also roll over once a segment reaches this size
+        self.disk_quota_gb = None  # Delete the oldest segments without events when save_path grows beyond this
+        self.clip_index = True  # Write a sidecar frame index (clip.avi.idx) next to every recording
+        self.log_events = True  # Append every recording to the event log in save_path
+        self.event_log = None  # Shared EventLog; the monitor opens its own in save_path without one
+        self.live_composite = True  # Build composites from the live frames and masks instead of re-decoding recordings
+        self.composite_modes = ["max"]  # Any of composite.MODES: "max", "trail", "mean", "lastseen"
+        self.post_warmup_frames = 0  # Frames each composite's own background model learns from before compositing
+        self.post_on_exit = "finish"  # "finish" pending composites on stop, or "persist" them to resume on the next start
+
+        for name, value in options.items():
+            if not hasattr(self, name):
+                raise ValueError(f"Unknown monitor option: {name}")
+            setattr(self, name, value)
+
+        self.fourcc = cv2.VideoWriter_fourcc(*self.default_codec)
+        self.metrics = Metrics()  # Timing histograms of every step a frame goes through
+        self.detector = Detector(history=self.fgbg_history, var_threshold=self.fgbg_var_threshold, detect_shadows=self.fgbg_detect_shadows,
+                                 scale=self.detection_scale, width=self.detection_width, grayscale=self.detection_grayscale,
+                                 apply_morph=self.apply_morph, min_area=self.bb_sensitivity,
+                                 merge_gap=self.bounding_box_buffer if self.merge_nearby_boxes else None, metrics=self.metrics,
+                                 engine=self.background_engine, difference_frames=self.difference_frames)
+        self.tracker = Tracker(self.track_max_distance, self.track_max_missed, self.track_min_frames,
+                               self.track_min_distance, self.track_min_linearity)
+        self.track_time = self.metrics.histogram("track")
+        self.preroll = PreRollBuffer(self.pre_roll_seconds, self.pre_roll_max_mb * 1024 * 1024, self.pre_roll_compression)
+
+        self.prev_time = None  # Capture timestamp of the previous frame, to measure the frame rate
+        self.tz_name = time.tzname[time.daylight]
+        self.current_video_name = None
+        self.out_lock = threading.RLock()  # Guards self.out (the active RecordingWriter) between the encode stage and manual control
+        self.writers = set()  # Writers that are still encoding, including ones already closed
+        self.writers_dropped = 0  # Frames dropped or downgraded by writers that have finished
+        self.compositor = None  # Composite of the active recording, built in the encode stage
+        self.preroll_compositing = None  # (Compositor, thread) building the composite of the active recording's pre-roll
+        self.event = None  # Event of the active recording, also collected in the encode stage
+        self.finishing = {}  # (compositor, preroll_compositing, event) of closed recordings by video path, until the writer is done
+        self.owns_event_log = False
+        self.segments = None  # SegmentRecorder of continuous recording
+        # Load shedding state, set by the overload controller
+        self.overload = None
+        self.preview_paused = False
+        self.detect_every = 1  # Detect on every Nth frame, the others reuse the last result
+        self.drop_every = 1  # Drop all but every Nth frame before detection
+        self.frames_shed = 0
+        self.last_detection = None  # (fgMask, detections, movement_detected) of the last detected frame
+        self.scale_shed = False  # Detection resolution halved from detection_scale/detection_width
+        self.retention = None
+
+        # Called with the new recording state, and with log messages. May be called from any thread.
+        self.on_recording_changed = None
+        self.on_message = None
+
+        self.frame_ring = None
+        self.grabber = None
+        self.pipeline = None
+        self.owns_post_processor = False
+        self.owns_spool_transcoder = False
+
+    def message(self, text):
+        if self.name:
+            text = f"[{self.name}] {text}"
+        if self.on_message is not None:
+            self.on_message(text)
+        else:
+            print(text)
+
+    ######## Source Functions ########
+    def openSource(self, source, width=None, height=None, fps=None):
+        """
+        Open a camera port or video file and start grabbing frames from it on a background thread.
+        """
+        self.source = source
+        is_file = is_file_source(source)
+        self.cap = cv2.VideoCapture(source if is_file else int(source))
+        if not is_file:
+            if width and height:
+                self.cap.set(cv2.CAP_PROP_FRAME_WIDTH, width)
+                self.cap.set(cv2.CAP_PROP_FRAME_HEIGHT, height)
+            if fps:
+                self.cap.set(cv2.CAP_PROP_FPS, fps)
+        self.width = self.cap.get(cv2.CAP_PROP_FRAME_WIDTH)
+        self.height = self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT)
+        self.fps = self.cap.get(cv2.CAP_PROP_FPS) or self.fps
+
+        # Frames are grabbed on a dedicated thread so stalls downstream don't drop camera frames
+        self.frame_ring = FrameRing(self.ring_capacity, (int(self.height), int(self.width), 3), policy=self.ring_policy)
+        self.grabber = FrameGrabber(self.cap, self.frame_ring, is_file=is_file, realtime=self.realtime, metrics=self.metrics)
+        self.grabber.start()
+        if self.mask_file:
+            self.loadMask(self.mask_file)
+        return self.cap.isOpened()
+
+    def loadMask(self, path):
+        """
+        Restrict detection to the sky mask in `path`, or detect everywhere again with None.
+        Raises OSError or ValueError if the file can't be read.
+        """
+        self.mask_file = path
+        self.setMask(load_mask(path, int(self.width), int(self.height)) if path else None)
+
+    def setMask(self, mask):
+        """
+        Restrict detection to where `mask` (uint8, frame-sized) is non-zero, or detect everywhere with None.
+        """
+        self.detector.set_mask(mask)
+        if mask is not None and mask.any():
+            self.message(f"Detecting in {cv2.countNonZero(mask) / mask.size:.0%} of the frame")
+
+    def setBackgroundEngine(self, engine):
+        """
+        Switch the background model (see background.ENGINES). Recordings composited from now on use it too.
+        """
+        self.detector.set_engine(engine)
+        self.background_engine = engine
+        self.message(f"Background model: {engine}")
+
+    def switchSource(self, port):
+        """
+        Switch the capture to the given camera port.
+        """
+        with self.grabber.paused():
+            if self.cap:
+                self.cap.release()
+            self.cap = cv2.VideoCapture(port)
+            self.grabber.cap = self.cap
+            self.width = self.cap.get(cv2.CAP_PROP_FRAME_WIDTH)
+            self.height = self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT)
+            self.prev_time = None
+
+    def setResolution(self, width, height):
+        with self.grabber.paused():
+            self.cap.set(cv2.CAP_PROP_FRAME_WIDTH, width)
+            self.cap.set(cv2.CAP_PROP_FRAME_HEIGHT, height)
+            self.fps = self.cap.get(cv2.CAP_PROP_FPS)
+        self.width = width
+        self.height = height
+
+    def setFPS(self, fps):
+        with self.grabber.paused():
+            self.cap.set(cv2.CAP_PROP_FPS, fps)
+            actual = self.cap.get(cv2.CAP_PROP_FPS)
+            self.fps = actual if actual > 0 else fps  # Not every backend reports the rate it settled on
+
+    def probeModes(self, resolutions):
+        """
+        Measure which resolution and frame rate combinations the open camera delivers (see cameras.probe_modes).
+        Capture pauses while probing and the current mode is restored afterwards. Takes a few seconds per mode,
+        so call it off the UI thread.
+        """
+        with self.grabber.paused():
+            width = self.cap.get(cv2.CAP_PROP_FRAME_WIDTH)
+            height = self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT)
+            fps = self.cap.get(cv2.CAP_PROP_FPS)
+            try:
+                return probe_modes(self.cap, resolutions)
+            finally:
+                self.cap.set(cv2.CAP_PROP_FRAME_WIDTH, width)
+                self.cap.set(cv2.CAP_PROP_FRAME_HEIGHT, height)
+                self.cap.set(cv2.CAP_PROP_FPS, fps)
+
+    def captureSize(self):
+        with self.grabber.paused():
+            return self.cap.get(cv2.CAP_PROP_FRAME_WIDTH), self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT)
+
+    ######## Pipeline ########
+    def start(self, display=None):
+        """
+        Connect the capture ring to the detect -> annotate -> encode stages and start post-processing.
+        If `display` is given it becomes a final stage that is not threaded; the caller polls
+        self.display_stage from its own (GUI) thread.
+        """
+        self.pipeline = Pipeline(self.frame_ring, self.metrics, on_message=self.message)
+        self.pipeline.add_stage("detect", self.detectStage)
+        self.pipeline.add_stage("annotate", self.annotateStage)
+        self.pipeline.add_stage("encode", self.encodeStage)
+        self.display_stage = None
+        if display is not None:
+            self.display_stage = self.pipeline.add_stage("display", display, maxsize=2, drop_when_full=True, threaded=False)
+        self.pipeline.start()
+        # Video files that are read as fast as possible are never shed, their speed is bounded by the pipeline anyway
+        if self.load_shedding and (not self.grabber.is_file or self.realtime):
+            steps = STEPS if display is not None else tuple(step for step in STEPS if step != "preview")
+            self.overload = OverloadController(self.pipeline, self.frame_ring, self.setLoadStep, steps, on_message=self.message)
+            self.overload.start()
+
+        if self.post_processor is None:
+            self.post_processor = PostProcessor(self.post_workers, self.post_processes, self.post_chunk_frames)
+            self.owns_post_processor = True
+            self.resumePostProcessing()
+        if self.spool_transcoder is None:
+            self.spool_transcoder = SpoolTranscoder(self.spool_max_defer, on_message=self.message)
+            self.owns_spool_transcoder = True
+        if self.save_path:
+            self.recoverSpools()
+        if self.continuous and self.save_path:
+            self.startContinuous()
+
+    def stop(self):
+        """
+        Stop capturing, drain the pipeline, finish the active recording and its post-processing.
+        """
+        if self.overload:
+            self.overload.stop()
+        if self.grabber:
+            self.grabber.stop()
+        if self.pipeline:
+            self.pipeline.stop()
+        self.stopRecording()
+        self.stopContinuous()
+        for writer in list(self.writers):
+            writer.join()
+        if self.owns_spool_transcoder:
+            self.stopTranscoding()
+        if self.owns_post_processor:
+            self.stopPostProcessing()
+        if self.owns_event_log:
+            self.event_log.close()
+        if self.cap:
+            if self.grabber:
+                with self.grabber.paused():  # Waits for a mode probe that is still using the capture
+                    self.cap.release()
+            else:
+                self.cap.release()
+
+    def waitUntilFinished(self, timeout=None):
+        """
+        Block until a video file source has been read to the end and every frame was fed to the pipeline.
+        Returns False on timeout.
+        """
+        if not self.grabber.finished.wait(timeout):
+            return False
+        self.pipeline.feeder.join(timeout)
+        return not self.pipeline.feeder.is_alive()
+
+    def statusText(self):
+        """
+        One-line summary of where frames are queueing and what they cost, for status bars and logs.
+        """
+        text = f"{self.name}: " if self.name else ""
+        text += f"{self.fps:.1f} fps | capture dropped {self.frame_ring.dropped} | " + self.pipeline.summary()
+        text += f" | detection {self.detector.cost * 1000:.1f}ms @{self.detector.effective_scale(max(self.width, 1)):g}"
+        preroll = self.preroll.stats()
+        text += f" | preroll {preroll['seconds']:.1f}s {preroll['bytes'] / 2**20:.0f}/{preroll['max_bytes'] / 2**20:.0f}MB"
+        out = self.out
+        if isinstance(out, SpoolWriter):
+            text += f" | spool {out.written} frames dropped {out.dropped}"
+        elif out:
+            writer = out.stats()
+            text += f" | writer {writer['queued']}/{writer['capacity']} dropped {writer['dropped'] + writer['downgraded']}"
+        segments = self.segments
+        if segments is not None:
+            text += f" | segment {segments.segments} ({segments.frames} frames)"
+        if self.overload is not None and self.overload.level:
+            text += f" | shedding {', '.join(self.overload.active_steps())}"
+        if self.owns_post_processor:
+            post = self.post_processor.stats()
+            text += f" | composites {post['pending']} pending {post['failed']} failed"
+        if self.owns_spool_transcoder and self.spool_transcoder.pending():
+            text += f" | {self.spool_transcoder.pending()} spooled to encode"
+        return text
+
+    def setLoadStep(self, step, active):
+        """
+        Shed (or restore) one load shedding step, see overload.py. Called from the overload controller's thread.
+        """
+        if step == "preview":
+            self.preview_paused = active
+        elif step == "detect_every":
+            self.detect_every = 2 if active else 1
+        elif step == "detection_scale":
+            self.scale_shed = active
+            self.applyDetectionScale()
+        elif step == "drop_frames":
+            self.drop_every = 2 if active else 1
+
+    def setDetectionScale(self, scale):
+        """
+        Detect on frames scaled by `scale`. While load shedding has lowered the detection resolution it stays
+        halved, and restoring it goes back to this setting.
+        """
+        self.detection_scale = scale
+        self.applyDetectionScale()
+
+    def applyDetectionScale(self):
+        scale, width = self.detection_scale, self.detection_width
+        if self.scale_shed:
+            scale = max(0.125, scale / 2)
+            if width:
+                width = max(80, width // 2)
+        self.detector.scale, self.detector.width = scale, width
+
+    def metricsSnapshot(self):
+        """
+        Everything needed for capacity planning in one dict: timing histograms of every step ("read" and "ring_wait",
+        the detection steps "prepare", "subtract", "morphology" and "contours", "track", the stages "detect", "annotate"
+        (overlay), "encode" and "display" (preview), "write" and "encoder_lag"), frames dropped on the way and current
+        queue depths.
+        """
+        stages = self.pipeline.stats() if self.pipeline else {}
+        writers = [writer.stats() for writer in list(self.writers)]
+        dropped = {"capture": self.frame_ring.dropped if self.frame_ring else 0}
+        dropped.update({name: stage["dropped"] for name, stage in stages.items()})
+        dropped["writer"] = self.writers_dropped + sum(writer["dropped"] + writer["downgraded"] for writer in writers)
+        queues = {"capture": len(self.frame_ring) if self.frame_ring else 0}
+        queues.update({name: stage["depth"] for name, stage in stages.items()})
+        queues["writer"] = sum(writer["queued"] for writer in writers)
+        if self.encoder_pool is not None:
+            queues["encoder_backlog"] = self.encoder_pool.backlog()
+        if self.spool_transcoder is not None:
+            queues["spooled"] = self.spool_transcoder.pending()
+        dropped["shed"] = self.frames_shed
+        shedding = list(self.overload.active_steps()) if self.overload else []
+        return {"fps": self.fps, "timings": self.metrics.snapshot(), "dropped": dropped, "queues": queues,
+                "shedding": shedding}
+
+    def metricsText(self):
+        """
+        Median and 99th percentile of every timing in one line, e.g. for a status label.
+        """
+        return " | ".join(f"{name} {timing['p50_ms']:.3g}/{timing['p99_ms']:.3g}ms"
+                          for name, timing in self.metrics.snapshot().items())
+
+    def detectStage(self, packet):
+        """
+        Background subtraction, noise removal and contour search on the detection-resolution frame, then linking
+        the detections to tracks. With tracking, only confirmed tracks count as movement.
+        """
+        if self.drop_every > 1 and packet.index % self.drop_every:
+            self.frames_shed += 1
+            return None
+        if self.detect_every > 1 and packet.index % self.detect_every and self.last_detection is not None:
+            packet.fgMask, packet.detections, packet.movement_detected = self.last_detection
+            return packet
+
+        packet.fgMask, packet.detections = self.detector.detect(packet.frame)
+        if self.tracking:
+            start = time.perf_counter()
+            packet.tracks = self.tracker.update(packet.index, packet.timestamp, packet.detections)
+            packet.movement_detected = any(track.confirmed for track in packet.tracks)
+            self.track_time.record(time.perf_counter() - start)
+        else:
+            packet.movement_detected = len(packet.detections) > 0
+        self.last_detection = (packet.fgMask, packet.detections, packet.movement_detected)
+        return packet
+
+    def annotateStage(self, packet):
+        """
+        Draw the bounding boxes, timestamp and FPS onto the frame.
+        """
+        original_frame = packet.frame
+        if self.show_bboxes:
+            draw_boxes(original_frame, packet.detections, self.bounding_box_buffer, (0, 0, 255), 2)
+
+        # Calculate FPS from the capture timestamps so it reflects the camera rate, not the UI rate
+        # Smoothed, since the value is also handed to the video writer. The first frame only seeds the measurement:
+        # the time before it says nothing about the camera rate
+        curr_time = packet.timestamp
+        if self.prev_time is not None and curr_time > self.prev_time:
+            self.fps += 0.1 * (1 / (curr_time - self.prev_time) - self.fps)
+        self.prev_time = curr_time
+
+        if self.show_timestamp:
+            timestamp = datetime.fromtimestamp(packet.timestamp).strftime('%Y-%m-%d %H:%M:%S ') + self.tz_name
+            cv2.putText(original_frame, timestamp, (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 1, (255, 255, 255), 2)
+
+        # Draw the FPS if enabled
+        if self.show_fps:
+            fps = f"FPS: {self.fps:.0f}"
+            cv2.putText(original_frame, fps, (10, 60), cv2.FONT_HERSHEY_SIMPLEX, 1, (255, 255, 255), 2)
+        return packet
+
+    def encodeStage(self, packet):
+        """
+        Start/stop autorecording and write the frame to the active recording.
+        """
+        if self.autorecord and self.save_path:
+            if packet.movement_detected:
+                self.last_movement_time = packet.timestamp
+                if not self.recording:  # Start recording if not already doing so
+                    self.startRecording()
+
+            # If no movement is detected for the post-roll time, stop recording
+            elif self.recording and packet.timestamp - self.last_movement_time > self.post_roll_seconds:
+                self.stopRecording()
+
+        with self.out_lock:
+            out = self.out
+            if self.compositor is not None:
+                self.compositor.add(packet.frame, packet.fgMask, packet.timestamp)
+            if self.event is not None:
+                self.event.add(packet.timestamp, packet.detections, packet.tracks)
+        segments = self.segments
+        if segments is not None:
+            segments.write(packet.frame, packet.timestamp, packet.movement_detected)
+        if out:
+            out.write(packet.frame, packet.timestamp, packet.movement_detected)
+        else:
+            self.preroll.append(packet.frame, packet.timestamp, packet.fgMask)
+        return packet
+
+    ##### Recording functionalities #####
+    def setCodec(self, codec):
+        self.fourcc = cv2.VideoWriter_fourcc(*codec)
+        self.default_codec = codec
+
+    def startRecording(self):
+        """
+        Open a new video writer. Safe to call from the pipeline threads.
+        """
+        with self.out_lock:
+            if self.out or not self.save_path:
+                return
+            directory = self.recordingDirectory()
+            os.makedirs(directory, exist_ok=True)
+            # Generate random UUID for the video name
+            self.current_video_name = str(uuid.uuid4())
+            codec_extension = self.codec_extensions[self.default_codec]
+            self.output_filename = f"{self.current_video_name}{codec_extension}"
+            self.video_path = os.path.join(directory, self.output_filename)
+            # The writer opens the file and encodes on its own thread, starting with the buffered pre-roll
+            preroll = self.preroll.drain()
+            if self.spool_recording:
+                self.out = self.openSpoolWriter(self.video_path, self.onRecordingClosed, preroll=preroll)
+            else:
+                self.out = self.openWriter(self.video_path, self.onRecordingClosed, preroll=preroll)
+            if self.live_composite:
+                self.compositor = Compositor(self.composite_modes)
+                if len(preroll):
+                    # The pre-roll is part of the clip, so it is part of the composite too. It is composited on a
+                    # thread of its own and merged in front of the live composite once the recording is closed
+                    compositor = Compositor(self.composite_modes)
+                    thread = threading.Thread(target=compositor.add_all, args=(preroll.masked(),),
+                                              name="PreRollComposite", daemon=True)
+                    thread.start()
+                    self.preroll_compositing = (compositor, thread)
+            if self.log_events:
+                if self.event_log is None:
+                    self.event_log = EventLog(os.path.join(self.save_path, EVENTS_FILE))
+                    self.owns_event_log = True
+                self.event = Event(self.name or str(self.source), self.video_path, first_frame=len(preroll))
+            self.out.start()
+            self.recording = True
+        if self.on_recording_changed is not None:
+            self.on_recording_changed(True)
+
+    def openWriter(self, path, on_closed, preroll=()):
+        """
+        Create an unstarted RecordingWriter for `path` with the current codec, size and frame rate.
+        """
+        writer = RecordingWriter(path, self.fourcc, self.fps, (int(self.width), int(self.height)),
+                                 maxsize=self.writer_queue_size, policy=self.writer_policy, on_closed=on_closed,
+                                 preroll=preroll, pool=self.encoder_pool,
+                                 index=ClipIndex(path, self.default_codec in INTRA_CODECS) if self.clip_index else None,
+                                 metrics=self.metrics)
+        self.writers.add(writer)
+        return writer
+
+    def openSpoolWriter(self, path, on_closed, preroll=()):
+        """
+        Create an unstarted SpoolWriter for `path`, to be encoded with the current codec once it is closed.
+        """
+        index = NO_INDEX
+        if self.clip_index:
+            index = INDEX_ALL_KEYFRAMES if self.default_codec in INTRA_CODECS else INDEX
+        writer = SpoolWriter(path, self.default_codec, self.fps, (int(self.width), int(self.height)),
+                             self.spool_transcoder, on_closed=on_closed, preroll=preroll, index=index,
+                             chunk_mb=self.spool_chunk_mb, metrics=self.metrics, on_transcoded=self.onSpoolTranscoded)
+        self.writers.add(writer)
+        return writer
+
+    def recordingDirectory(self):
+        return os.path.join(self.save_path, self.name) if self.name else self.save_path
+
+    def stopRecording(self):
+        """
+        Close the active video writer and queue the recording for post-processing. Safe to call from the pipeline threads.
+        """
+        with self.out_lock:
+            out, self.out = self.out, None  # Reset the video writer
+            was_recording, self.recording = self.recording, False
+            compositor, self.compositor = self.compositor, None
+            preroll_compositing, self.preroll_compositing = self.preroll_compositing, None
+            event, self.event = self.event, None
+            if out:
+                self.finishing[out.path] = (compositor, preroll_compositing, event)
+        if was_recording and self.on_recording_changed is not None:
+            self.on_recording_changed(False)
+        if out:
+            out.close()  # Drains and releases on the writer thread
+
+    def onRecordingClosed(self, writer):
+        """
+        Called on the writer thread once a recording has been fully written.
+        """
+        stats = writer.stats()
+        if writer.error:
+            self.message(writer.error)
+        if stats['dropped'] or stats['downgraded']:
+            self.message(f"Recording {writer.path}: {stats['written']} frames written, {stats['dropped']} dropped, {stats['downgraded']} skipped by downgrade")
+        compositor, preroll_compositing, event = self.finishing.pop(writer.path, (None, None, None))
+        if writer.error:
+            self.writerFinished(writer)  # No composite or event for a clip that wasn't recorded properly
+            return
+        if compositor is not None and preroll_compositing is not None:
+            preroll_compositor, thread = preroll_compositing
+            thread.join()
+            compositor = preroll_compositor.merge(compositor)
+        if compositor is not None and compositor.frames:
+            compositor.write(writer.path)
+            self.message(f"Composite of {writer.path} written from {compositor.frames} live frames")
+        elif not isinstance(writer, SpoolWriter):  # A spooled recording is composited once it has been encoded
+            self.processRecordedVideo(writer.path)
+        if event is not None and event.start is not None:
+            event.composite_path = composite_path(writer.path)
+            self.event_log.append(event)
+            self.message(event.summary())
+        self.writerFinished(writer)
+
+    ##### Continuous recording #####
+    def startContinuous(self):
+        """
+        Start recording everything into rolling segments in the "segments" subdirectory of the recording directory.
+        """
+        directory = os.path.join(self.recordingDirectory(), "segments")
+        self.segments = SegmentRecorder(directory, self.codec_extensions[self.default_codec],
+                                        lambda path: self.openWriter(path, self.onSegmentClosed), self.segment_seconds,
+                                        self.segment_mb * 1024 * 1024 if self.segment_mb else None)
+        if self.disk_quota_gb:
+            if not self.clip_index:
+                self.message("Without clip_index segments can't be checked for events, so none will be deleted")
+            self.retention = RetentionManager(self.save_path, self.disk_quota_gb * 2**30, directory,
+                                              self.isWriting, on_message=self.message)
+            self.retention.start()
+
+    def stopContinuous(self):
+        retention, self.retention = self.retention, None
+        if retention is not None:
+            retention.stop()
+        segments, self.segments = self.segments, None
+        if segments is not None:
+            segments.close()
+
+    def isWriting(self, path):
+        """
+        Whether a writer is still encoding into `path`, including segments that were closed but not yet flushed.
+        """
+        return any(writer.path == path for writer in list(self.writers))
+
+    def onSegmentClosed(self, writer):
+        """
+        Called on the writer thread once a segment has been fully written. The segment that was opened ahead of
+        time but never used is removed again.
+        """
+        if writer.written == 0:
+            for path in (writer.path, writer.path + ClipIndex.SUFFIX):
+                if os.path.exists(path):
+                    os.remove(path)
+        self.writerFinished(writer)
+
+    def onSpoolTranscoded(self, video_path, frames):
+        """
+        Called on the transcoder thread once a spooled recording has been encoded. Recordings without a live
+        composite, including ones recovered after a crash, are composited now.
+        """
+        self.message(f"Encoded {frames} spooled frames into {video_path}")
+        if not os.path.exists(composite_path(video_path)):
+            self.processRecordedVideo(video_path)
+
+    def recoverSpools(self):
+        """
+        Queue the spools left in the recording directory by a crash, or by stopping before they were encoded.
+        """
+        recovered = self.spool_transcoder.recover(self.recordingDirectory(), self.onSpoolTranscoded)
+        if recovered:
+            self.message(f"Encoding {recovered} spooled recording(s) left from the last run")
+
+    def writerFinished(self, writer):
+        self.writers_dropped += writer.dropped + writer.downgraded
+        self.writers.discard(writer)
+
+    ##### Post-processing #####
+    def processRecordedVideo(self, video_filename):
+        """
+        Queue the composite of a recording on the post-processing pool, which decodes it again. Recordings made
+        with live_composite don't need this; it is for external files and recordings without a live composite.
+        """
+        self.message(f"Processing video: {video_filename}")
+        self.post_processor.submit(video_filename, self.onCompositeDone,
+                                   history=self.fgbg_history, var_threshold=self.fgbg_var_threshold,
+                                   warmup_frames=self.post_warmup_frames, modes=list(self.composite_modes),
+                                   engine=self.background_engine, difference_frames=self.difference_frames)
+
+    def onCompositeDone(self, job):
+        """
+        Called on a pool thread when a composite has been written or has failed.
+        """
+        if job.error is not None:
+            self.message(f"Composite of {job.video_path} failed: {job.error}")
+        else:
+            self.message(f"Composite {job.output_path} done in {job.duration:.1f}s ({job.frames} frames), "
+                         f"{self.post_processor.pending()} pending")
+
+    def pendingFile(self):
+        return os.path.join(self.save_path, PENDING_FILE) if self.save_path else None
+
+    def setSavePath(self, path):
+        self.save_path = path
+        if self.owns_post_processor:
+            self.resumePostProcessing()
+        if self.spool_transcoder is not None and path:
+            self.recoverSpools()
+
+    def resumePostProcessing(self):
+        """
+        Queue the composites that were still pending when the monitor was last stopped with post_on_exit="persist".
+        """
+        path = self.pendingFile()
+        if path:
+            resumed = self.post_processor.resume(path, self.onCompositeDone)
+            if resumed:
+                self.message(f"Resumed {resumed} pending composite(s)")
+
+    def stopTranscoding(self):
+        """
+        Encode the remaining spools before stopping, or with post_on_exit="persist" leave them for the next start.
+        """
+        pending = self.spool_transcoder.pending()
+        finish = self.post_on_exit != "persist"
+        if pending and finish:
+            self.message(f"Encoding {pending} spooled recording(s)")
+        left = self.spool_transcoder.stop(finish)
+        if left:
+            self.message(f"Left {left} spooled recording(s) to encode on the next start")
+
+    def stopPostProcessing(self):
+        persist_path = self.pendingFile() if self.post_on_exit == "persist" else None
+        pending = self.post_processor.pending()
+        if pending and persist_path is None:
+            self.message(f"Finishing {pending} pending composite(s)")
+        persisted = self.post_processor.stop(persist_path)
+        if persisted:
+            self.message(f"Saved {persisted} pending composite(s) to {persist_path}")
+
+
+class MonitorGroup:
+    """
+    Watches several sources at once. Every source gets its own Monitor, i.e. its own capture thread,
+    background model, autorecord state and writers, while encoding and post-processing run on pools
+    shared by all of them so CPU use stays bounded as cameras are added.
+    """
+    def __init__(self, encoder_workers=2, post_workers=2, post_processes=True, post_chunk_frames=900, post_on_exit="finish",
+                 **options):
+        self.encoder_pool = EncoderPool(encoder_workers)
+        self.post_processor = PostProcessor(post_workers, post_processes, post_chunk_frames)
+        self.spool_transcoder = SpoolTranscoder(options.get("spool_max_defer", 60))
+        self.post_on_exit = post_on_exit
+        self.options = options
+        self.monitors = []
+        self.event_log = None
+        if options.get("save_path") and options.get("log_events", True):
+            self.event_log = EventLog(os.path.join(options["save_path"], EVENTS_FILE))
+        self.on_message = print
+
+    def add(self, source, name=None, width=None, height=None, fps=None, **options):
+        """
+        Open a source with its own Monitor. Options override the group's options for this source only.
+        Returns the monitor, or None if the source could not be opened.
+        """
+        monitor = Monitor(**{**self.options, **options}, name=name, encoder_pool=self.encoder_pool,
+                          post_processor=self.post_processor, spool_transcoder=self.spool_transcoder,
+                          event_log=self.event_log)
+        try:
+            opened = monitor.openSource(source, width, height, fps)
+        except (OSError, ValueError):
+            monitor.stop()
+            raise
+        if not opened:
+            monitor.stop()
+            return None
+        self.monitors.append(monitor)
+        return monitor
+
+    def pendingFile(self):
+        save_path = self.options.get("save_path")
+        return os.path.join(save_path, PENDING_FILE) if save_path else None
+
+    def start(self):
+        for monitor in self.monitors:
+            monitor.start()
+        if self.pendingFile():
+            resumed = self.post_processor.resume(self.pendingFile(), self.onCompositeDone)
+            if resumed:
+                self.on_message(f"Resumed {resumed} pending composite(s)")
+
+    def onCompositeDone(self, job):
+        if job.error is not None:
+            self.on_message(f"Composite of {job.video_path} failed: {job.error}")
+        else:
+            self.on_message(f"Composite {job.output_path} done in {job.duration:.1f}s")
+
+    def stop(self):
+        for monitor in self.monitors:
+            monitor.stop()
+        # Only after every monitor has closed its writers and queued its last recording
+        self.encoder_pool.stop()
+        left = self.spool_transcoder.stop(self.post_on_exit != "persist")  # Before composites, it may queue more
+        if left:
+            self.on_message(f"Left {left} spooled recording(s) to encode on the next start")
+        persist_path = self.pendingFile() if self.post_on_exit == "persist" else None
+        persisted = self.post_processor.stop(persist_path)
+        if persisted:
+            self.on_message(f"Saved {persisted} pending composite(s) to {persist_path}")
+        if self.event_log is not None:
+            self.event_log.close()
+
+    def waitUntilFinished(self, timeout=None):
+        """
+        Block until every video file source has been read to the end. Returns False on timeout.
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        for monitor in self.monitors:
+            remaining = None if deadline is None else max(0.0, deadline - time.time())
+            if not monitor.waitUntilFinished(remaining):
+                return False
+        return True
+
+    def metricsSnapshot(self):
+        """
+        Metrics of every monitor by name (see Monitor.metricsSnapshot).
+        """
+        return {monitor.name or str(monitor.source): monitor.metricsSnapshot() for monitor in self.monitors}
+
+    def statusText(self):
+        lines = [monitor.statusText() for monitor in self.monitors]
+        post = self.post_processor.stats()
+        lines.append(f"encoders {len(self.encoder_pool.threads)} backlog {self.encoder_pool.backlog()} | "
+                     f"composites {post['pending']} pending, {post['completed']} done ({post['mean_duration']:.1f}s avg), "
+                     f"{post['failed']} failed | spooled {self.spool_transcoder.pending()} to encode")
+        return "\n".join(lines)
@@ -0,0 +1,99 @@
+"""
+Load shedding for when the pipeline can't keep up with the camera.
+
+Once a second the controller measures how busy each pipeline stage was (the fraction of wall time it spent
+processing frames), including the preview rendered on the GUI thread, and whether frames are backing up or being
+dropped in the capture ring. While overloaded it sheds load one step at a time, cheapest loss first, and takes
+the steps back one at a time, last first, once the load has stayed low for a while:
+
+  1. "preview": stop updating the GUI preview
+  2. "detect_every": run detection on every other frame only; every frame is still recorded
+  3. "detection_scale": detect on a frame of half the resolution
+  4. "drop_frames": drop every other frame before detection, so it isn't recorded either
+
+Only the last step costs recorded frames.
+"""
+import threading
+import time
+
+STEPS = ("preview", "detect_every", "detection_scale", "drop_frames")
+
+
+class OverloadController:
+    """
+    Watches `pipeline` and `ring` and calls `apply(step, active)` to shed or restore the `steps` (in order).
+    Overloaded means a stage was busy more than `high` of the time, or the ring dropped frames or was more than
+    half full, for `escalate_after` checks in a row; relaxed means every stage was busy less than `low` of the
+    time with no drops or backlog, for `relax_after` checks in a row.
+    """
+    def __init__(self, pipeline, ring, apply, steps=STEPS, interval=1.0, high=0.9, low=0.5, escalate_after=2,
+                 relax_after=5, on_message=print):
+        self.pipeline = pipeline
+        self.ring = ring
+        self.apply = apply
+        self.steps = tuple(steps)
+        self.interval = interval
+        self.high = high
+        self.low = low
+        self.escalate_after = escalate_after
+        self.relax_after = relax_after
+        self.on_message = on_message
+        self.level = 0  # Number of steps in effect
+        self.busy = 0.0
+        self.overloaded_checks = 0
+        self.relaxed_checks = 0
+        self.last_time = time.perf_counter()
+        self.last_totals = self._totals()
+        self.last_dropped = ring.dropped
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self.run, name="OverloadController", daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread.is_alive():
+            self.thread.join()
+
+    def run(self):
+        while not self.stop_event.wait(self.interval):
+            self.check()
+
+    def _totals(self):
+        # Stages polled from another thread (the GUI preview) count too, they are what the "preview" step sheds
+        return {stage.name: stage.stats.total for stage in self.pipeline.stages}
+
+    def active_steps(self):
+        return self.steps[:self.level]
+
+    def check(self):
+        now = time.perf_counter()
+        elapsed = now - self.last_time
+        totals = self._totals()
+        self.busy = max(((total - self.last_totals.get(name, 0.0)) / elapsed for name, total in totals.items()), default=0.0)
+        dropped = self.ring.dropped - self.last_dropped
+        backlog = len(self.ring) / self.ring.capacity
+        self.last_time, self.last_totals, self.last_dropped = now, totals, self.ring.dropped
+
+        if self.busy > self.high or dropped or backlog > 0.5:
+            self.overloaded_checks += 1
+            self.relaxed_checks = 0
+        elif self.busy < self.low and backlog < 0.25:
+            self.relaxed_checks += 1
+            self.overloaded_checks = 0
+        else:
+            self.overloaded_checks = self.relaxed_checks = 0
+
+        if self.overloaded_checks >= self.escalate_after and self.level < len(self.steps):
+            step = self.steps[self.level]
+            self.level += 1
+            self.overloaded_checks = 0
+            self.apply(step, True)
+            self.on_message(f"Overloaded (busiest stage {self.busy:.0%}, {dropped} frames dropped): shedding {step}")
+        elif self.relaxed_checks >= self.relax_after and self.level > 0:
+            self.level -= 1
+            step = self.steps[self.level]
+            self.relaxed_checks = 0
+            self.apply(step, False)
+            self.on_message(f"Load back down (busiest stage {self.busy:.0%}): restored {step}")
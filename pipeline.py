@@ -0,0 +1,254 @@
+import queue
+import threading
+import time
+
+
+class FramePacket:
+    """
+    A captured frame and everything the pipeline stages attach to it on its way to the display.
+    """
+    __slots__ = ("frame", "timestamp", "index", "fgMask", "detections", "tracks", "movement_detected", "stage_times")
+
+    def __init__(self, frame, timestamp, index):
+        self.frame = frame
+        self.timestamp = timestamp
+        self.index = index
+        self.fgMask = None
+        self.detections = ()
+        self.tracks = ()
+        self.movement_detected = False
+        self.stage_times = {}
+
+
+class StageStats:
+    """
+    Running counters for one pipeline stage. Latencies are exponentially weighted so they follow the current load.
+    """
+    def __init__(self, smoothing=0.1):
+        self.smoothing = smoothing
+        self.processed = 0
+        self.dropped = 0  # Including the items lost to errors
+        self.errors = 0
+        self.latency = 0.0
+        self.max_latency = 0.0
+        self.total = 0.0  # Seconds spent processing, to tell how busy the stage is
+        self.lock = threading.Lock()
+
+    def record(self, latency):
+        with self.lock:
+            self.processed += 1
+            self.total += latency
+            if self.processed == 1:
+                self.latency = latency
+            else:
+                self.latency += self.smoothing * (latency - self.latency)
+            self.max_latency = max(self.max_latency, latency)
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                "processed": self.processed,
+                "dropped": self.dropped,
+                "errors": self.errors,
+                "latency_ms": self.latency * 1000,
+                "max_latency_ms": self.max_latency * 1000,
+            }
+
+
+class Stage:
+    """
+    One step of the pipeline: takes items from a bounded input queue, runs `func` on them and hands the result
+    to the next stage. Returning None from `func` swallows the item.
+
+    With `drop_when_full` the oldest queued item is discarded instead of blocking the upstream stage, which is
+    what we want for stages (like the display) that only care about the newest frame.
+
+    With a `histogram` (metrics.Histogram) every latency is also recorded in it.
+
+    An exception in `func` loses the item; it is counted as an error and a drop, and reported through
+    `on_message` unless it is the same error as the previous one.
+    """
+    STOP = object()
+
+    def __init__(self, name, func, maxsize=4, drop_when_full=False, threaded=True, histogram=None, on_message=print):
+        self.name = name
+        self.func = func
+        self.input = queue.Queue(maxsize=maxsize)
+        self.drop_when_full = drop_when_full
+        self.threaded = threaded
+        self.next_stage = None
+        self.stats = StageStats()
+        self.histogram = histogram
+        self.on_message = on_message
+        self.last_error = None
+        self.thread = None
+
+    def put(self, item, timeout=None):
+        """
+        Queue an item for this stage. Returns False if the item had to be dropped.
+        """
+        if not self.drop_when_full:
+            try:
+                self.input.put(item, timeout=timeout)
+                return True
+            except queue.Full:
+                self.stats.dropped += 1
+                return False
+        while True:
+            try:
+                self.input.put_nowait(item)
+                return True
+            except queue.Full:
+                try:
+                    self.input.get_nowait()
+                    self.stats.dropped += 1
+                except queue.Empty:
+                    pass
+
+    def process(self, item):
+        """
+        Run the stage on one item and pass the result downstream.
+        """
+        start = time.perf_counter()
+        try:
+            result = self.func(item)
+        except Exception as e:
+            with self.stats.lock:
+                self.stats.errors += 1
+                self.stats.dropped += 1
+            error = f"{type(e).__name__}: {e}"
+            if error != self.last_error:
+                self.last_error = error
+                self.on_message(f"Pipeline stage {self.name} failed, frame dropped: {error}")
+            return None
+        latency = time.perf_counter() - start
+        self.stats.record(latency)
+        if self.histogram is not None:
+            self.histogram.record(latency)
+        if isinstance(result, FramePacket):
+            result.stage_times[self.name] = latency
+        if result is not None and self.next_stage is not None:
+            self.next_stage.put(result)
+        return result
+
+    def poll(self, latest_only=False):
+        """
+        Process the item at the head of the queue without blocking. Used for stages that run on the GUI thread.
+        With `latest_only` every queued item but the newest is skipped.
+        Returns the processed result, or None if the queue was empty.
+        """
+        item = None
+        while True:
+            try:
+                queued = self.input.get_nowait()
+            except queue.Empty:
+                break
+            if queued is Stage.STOP:
+                break
+            if item is not None:
+                self.stats.dropped += 1
+            item = queued
+            if not latest_only:
+                break
+        if item is None:
+            return None
+        return self.process(item)
+
+    def run(self):
+        while True:
+            item = self.input.get()
+            if item is Stage.STOP:
+                if self.next_stage is not None:
+                    self.next_stage.put(Stage.STOP)
+                break
+            self.process(item)
+
+    def start(self):
+        if self.threaded:
+            self.thread = threading.Thread(target=self.run, name=f"Stage-{self.name}", daemon=True)
+            self.thread.start()
+
+    def snapshot(self):
+        stats = self.stats.snapshot()
+        stats["depth"] = self.input.qsize()
+        stats["capacity"] = self.input.maxsize
+        return stats
+
+
+class Pipeline:
+    """
+    A chain of stages connected by bounded queues, fed from a frame source such as a FrameRing.
+
+    Each threaded stage runs on its own thread so OpenCV calls (which release the GIL) overlap across cores and
+    throughput is bounded by the slowest stage instead of the sum of all of them.
+
+    With a metrics.Metrics registry, every stage records its latencies in a histogram named after the stage.
+    Stage failures are reported through `on_message`.
+    """
+    def __init__(self, source, metrics=None, on_message=print):
+        self.source = source
+        self.metrics = metrics
+        self.on_message = on_message
+        self.stages = []
+        self.stop_event = threading.Event()
+        self.feeder = None
+
+    def add_stage(self, name, func, maxsize=4, drop_when_full=False, threaded=True):
+        histogram = self.metrics.histogram(name) if self.metrics is not None else None
+        stage = Stage(name, func, maxsize=maxsize, drop_when_full=drop_when_full, threaded=threaded, histogram=histogram,
+                      on_message=self.on_message)
+        if self.stages:
+            self.stages[-1].next_stage = stage
+        self.stages.append(stage)
+        return stage
+
+    def stage(self, name):
+        for stage in self.stages:
+            if stage.name == name:
+                return stage
+        raise KeyError(name)
+
+    def _feed(self):
+        first = self.stages[0]
+        while not self.stop_event.is_set():
+            item = self.source.get(timeout=0.1)
+            if item is None:
+                if getattr(self.source, "closed", False):
+                    break
+                continue
+            frame, timestamp, index = item
+            first.put(FramePacket(frame, timestamp, index))
+
+    def start(self):
+        for stage in self.stages:
+            stage.start()
+        self.feeder = threading.Thread(target=self._feed, name="Stage-feed", daemon=True)
+        self.feeder.start()
+
+    def stop(self, timeout=2.0):
+        """
+        Stop feeding new frames and let the queued ones drain through the threaded stages.
+        """
+        self.stop_event.set()
+        if self.feeder is not None:
+            self.feeder.join(timeout)
+        if self.stages:
+            self.stages[0].put(Stage.STOP)  # Blocks until there is room, so the stages always get to see it
+        for stage in self.stages:
+            if stage.thread is not None:
+                stage.thread.join(timeout)
+
+    def stats(self):
+        """
+        Return a dict with queue depth and latency for every stage.
+        """
+        return {stage.name: stage.snapshot() for stage in self.stages}
+
+    def summary(self):
+        """
+        One-line summary of the pipeline state, e.g. for a status label.
+        """
+        parts = []
+        for name, s in self.stats().items():
+            parts.append(f"{name} {s['depth']}/{s['capacity']} {s['latency_ms']:.1f}ms")
+        return " | ".join(parts)
@@ -0,0 +1,280 @@
+import json
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+from background import create_model
+from composite import Compositor, MODES
+from recording import ClipIndex
+
+PENDING_FILE = "pending_composites.json"
+
+
+def composite_path(video_path):
+    return os.path.splitext(video_path)[0] + MODES["max"]
+
+
+def frame_ranges(frame_count, chunk_frames):
+    """
+    Split [0, frame_count) into ranges of about `chunk_frames` frames. An unknown count gives one open range.
+    """
+    if frame_count <= 0 or not chunk_frames or frame_count <= chunk_frames:
+        return [(0, None)]
+    chunks = -(-frame_count // chunk_frames)
+    bounds = np.linspace(0, frame_count, chunks + 1).astype(int)
+    return [(int(start), int(end)) for start, end in zip(bounds[:-1], bounds[1:])]
+
+
+def open_video(video_path, start=0):
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        raise IOError(f"Could not open {video_path}")
+    if start:
+        ClipIndex.seek(cap, ClipIndex.load(video_path), start)
+    return cap
+
+
+def warm_up(fgbg, video_path, start, frames):
+    """
+    Train the background model on up to `frames` frames before `start`, or on the first frames of the video
+    when the range starts at the beginning, so the model has seen the sky before the first composited frame.
+    """
+    warmup_start = max(0, start - frames) if start else 0
+    count = start - warmup_start if start else frames
+    cap = open_video(video_path, warmup_start)
+    try:
+        for _ in range(count):
+            ret, frame = cap.read()
+            if not ret:
+                break
+            fgbg.apply(frame)
+    finally:
+        cap.release()
+
+
+def composite_range(video_path, start=0, end=None, history=80, var_threshold=20, warmup_frames=0, modes=("max",),
+                    engine="average", difference_frames=2):
+    """
+    Composite frames [start, end) of a video with a Compositor.
+
+    Every call opens its own capture and creates its own background model (see background.create_model), so
+    jobs never touch the live detector and the result only depends on the video and the arguments. Without `warmup_frames` the first
+    frame of the range only primes the model and is left out of the masked modes.
+    Returns the Compositor, which is empty if no frame could be read.
+    """
+    fgbg = create_model(engine, history, var_threshold, difference_frames=difference_frames)
+    if warmup_frames:
+        warm_up(fgbg, video_path, start, warmup_frames)
+    compositor = Compositor(modes)
+    cap = open_video(video_path, start)
+    try:
+        ret, first_frame = cap.read()
+        if not ret:
+            return compositor
+        fgMask = fgbg.apply(first_frame)
+        compositor.add(first_frame, fgMask if warmup_frames else None, cap.get(cv2.CAP_PROP_POS_MSEC) / 1000)
+        position = start + 1
+        while end is None or position < end:
+            ret, frame = cap.read()
+            if not ret:
+                break
+            position += 1
+            compositor.add(frame, fgbg.apply(frame), cap.get(cv2.CAP_PROP_POS_MSEC) / 1000)
+        return compositor
+    finally:
+        cap.release()
+
+
+class CompositeJob:
+    """
+    One recording being turned into a composite, possibly as several frame ranges running in parallel.
+    """
+    def __init__(self, video_path, options, on_done=None):
+        self.video_path = video_path
+        self.output_path = composite_path(video_path)
+        self.options = options
+        self.on_done = on_done
+        self.futures = []
+        self.parts = []
+        self.remaining = 0
+        self.submitted = time.time()
+        self.duration = None
+        self.frames = 0
+        self.error = None
+
+
+class PostProcessor:
+    """
+    Builds composites of finished recordings on a pool of worker processes.
+
+    Each recording is split into ranges of `chunk_frames` frames that are composited in parallel and max-reduced
+    when the last one finishes, so one long clip can use every worker. With `processes=False` the pool uses
+    threads instead, which start faster and still overlap since OpenCV releases the GIL.
+
+    One PostProcessor can be shared by several monitors so the number of clips being decoded at the same time
+    stays bounded however many cameras are recording. Jobs that have not finished when it is stopped can be
+    persisted to a file and resumed later.
+    """
+    def __init__(self, workers=2, processes=True, chunk_frames=900):
+        self.workers = workers
+        self.processes = processes
+        self.chunk_frames = chunk_frames
+        if processes:
+            # Spawned, not forked: the parent has capture, pipeline and Qt threads running
+            self.executor = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn"))
+        else:
+            self.executor = ThreadPoolExecutor(workers, thread_name_prefix="PostProcess")
+        self.lock = threading.Lock()
+        self.jobs = []  # Jobs that have not finished yet
+        self.completed = 0
+        self.failed = 0
+        self.last_duration = 0.0
+        self.total_duration = 0.0
+        self.stopped = False
+
+    def submit(self, video_path, on_done=None, **options):
+        """
+        Queue a composite of the video. `on_done(job)` is called from a pool thread when it has been written or
+        has failed. Options are passed on to composite_range.
+        """
+        job = CompositeJob(video_path, options, on_done)
+        index = ClipIndex.load(video_path)
+        if index is not None:
+            frame_count = len(index)  # Exact, unlike CAP_PROP_FRAME_COUNT
+        else:
+            cap = cv2.VideoCapture(video_path)
+            frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT)) if cap.isOpened() else 0
+            cap.release()
+        ranges = frame_ranges(frame_count, self.chunk_frames)
+        with self.lock:
+            if self.stopped:
+                raise RuntimeError("PostProcessor has been stopped")
+            self.jobs.append(job)
+            job.remaining = len(ranges)
+            job.parts = [None] * len(ranges)
+            for i, (start, end) in enumerate(ranges):
+                future = self.executor.submit(composite_range, video_path, start, end, **options)
+                future.add_done_callback(lambda future, job=job, i=i: self._range_done(job, i, future))
+                job.futures.append(future)
+        return job
+
+    def _range_done(self, job, index, future):
+        if future.cancelled():
+            return  # Left in self.jobs, so stop() can persist it
+        try:
+            job.parts[index] = future.result()
+        except Exception as e:
+            job.error = job.error or e
+        with self.lock:
+            job.remaining -= 1
+            if job.remaining:
+                return
+        try:
+            if job.error is None:
+                self._write(job)
+        except Exception as e:
+            job.error = e
+        job.duration = time.time() - job.submitted
+        with self.lock:
+            self.jobs.remove(job)
+            if job.error is None:
+                self.completed += 1
+                self.last_duration = job.duration
+                self.total_duration += job.duration
+            else:
+                self.failed += 1
+        if job.on_done is not None:
+            job.on_done(job)
+
+    def _write(self, job):
+        compositor = job.parts[0]
+        for part in job.parts[1:]:
+            compositor = compositor.merge(part)
+        if compositor.frames == 0:
+            raise IOError(f"No frames could be read from {job.video_path}")
+        job.frames = compositor.frames
+        compositor.write(job.video_path)
+
+    def pending(self):
+        """
+        Number of recordings queued or being composited.
+        """
+        with self.lock:
+            return len(self.jobs)
+
+    def stats(self):
+        with self.lock:
+            return {
+                "pending": len(self.jobs),
+                "completed": self.completed,
+                "failed": self.failed,
+                "last_duration": self.last_duration,
+                "mean_duration": self.total_duration / self.completed if self.completed else 0.0,
+            }
+
+    def stop(self, persist_path=None):
+        """
+        Stop the pool. Without `persist_path` every queued job is finished first. With it, ranges that haven't
+        started are cancelled, running ones are waited for, and the recordings that still lack a composite are
+        written to `persist_path` for resume(). Returns the number of persisted jobs.
+        """
+        with self.lock:
+            self.stopped = True
+        if persist_path is None:
+            self.executor.shutdown(wait=True)
+            return 0
+        self.executor.shutdown(wait=True, cancel_futures=True)
+        with self.lock:
+            pending = [{"video_path": job.video_path, "options": job.options} for job in self.jobs]
+            self.jobs = []
+        if pending:
+            with open(persist_path, "w") as f:
+                json.dump(pending, f, indent=1)
+        elif os.path.exists(persist_path):
+            os.remove(persist_path)
+        return len(pending)
+
+    def resume(self, persist_path, on_done=None):
+        """
+        Queue the jobs saved by stop(persist_path=...). Returns the number of jobs resumed.
+        """
+        if not os.path.exists(persist_path):
+            return 0
+        with open(persist_path) as f:
+            pending = json.load(f)
+        os.remove(persist_path)
+        resumed = 0
+        for entry in pending:
+            if os.path.exists(entry["video_path"]):
+                self.submit(entry["video_path"], on_done, **entry["options"])
+                resumed += 1
+        return resumed
+
+
+if __name__ == '__main__':
+    # Usage: python postprocess.py <video file> [...]
+    # Composites externally supplied videos; recordings made by sentinel get theirs while recording.
+    import argparse
+    parser = argparse.ArgumentParser(description="Build composites of video files.")
+    parser.add_argument("videos", nargs="+")
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--chunk-frames", type=int, default=900)
+    parser.add_argument("--modes", nargs="+", choices=sorted(MODES), default=["max"])
+    parser.add_argument("--warmup-frames", type=int, default=0)
+    args = parser.parse_args()
+
+    def report(job):
+        if job.error is not None:
+            print(f"{job.video_path}: failed: {job.error}", flush=True)
+        else:
+            print(f"{job.video_path}: {job.frames} frames in {job.duration:.1f}s -> {job.output_path}", flush=True)
+
+    processor = PostProcessor(args.workers, chunk_frames=args.chunk_frames)
+    for video in args.videos:
+        processor.submit(video, report, modes=args.modes, warmup_frames=args.warmup_frames)
+    processor.stop()
@@ -0,0 +1,497 @@
+import os
+import queue
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+import cv2
+import numpy as np
+
+
+class RecordingWriter(threading.Thread):
+    """
+    Owns the cv2.VideoWriter of one recording and encodes its frames off the capture path.
+
+    Frames are fed through a bounded queue. When the encoder falls behind, `policy` decides what happens:
+      - "block": the caller waits for room in the queue (nothing is lost, backpressure goes upstream)
+      - "drop": the frame is discarded and counted
+      - "downgrade": once the queue is more than half full only every other frame is kept, until it drains again
+    Opening and releasing the writer both happen off the caller's thread, so starting or stopping a recording
+    never blocks the caller. If the video can't be opened or encoding fails (e.g. on a full disk) the error is kept
+    in `error`, the frames still queued are dropped, and the writer is finished and released as if it had been
+    closed.
+
+    With a ClipIndex, every encoded frame is also recorded in the recording's sidecar index. With a
+    metrics.Metrics registry the encoding time of every frame is recorded as "write" and the time it waited in the
+    queue as "encoder_lag".
+
+    By default the writer runs on its own thread. When given an EncoderPool it is serviced by the pool's
+    workers instead, so many concurrent recordings share a fixed number of encoder threads.
+    """
+    POLICIES = ("block", "drop", "downgrade")
+
+    def __init__(self, path, fourcc, fps, size, maxsize=120, policy="block", on_closed=None, preroll=(), pool=None,
+                 index=None, metrics=None):
+        super().__init__(daemon=True, name=f"RecordingWriter-{path}")
+        if policy not in self.POLICIES:
+            raise ValueError(f"Unknown writer policy: {policy}")
+        self.path = path
+        self.fourcc = fourcc
+        self.fps = fps
+        self.size = size
+        self.policy = policy
+        self.on_closed = on_closed
+        self.preroll = preroll  # (frame, timestamp) pairs captured before the recording started, written first
+        self.pool = pool
+        self.index = index
+        self.write_time = self.lag = None
+        if metrics is not None:
+            self.write_time = metrics.histogram("write")
+            self.lag = metrics.histogram("encoder_lag")
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.closing = False
+        self.written = 0
+        self.dropped = 0
+        self.downgraded = 0  # Frames skipped by the "downgrade" policy
+        self.max_depth = 0
+        self.downgrading = False
+        self.submitted = 0
+        self.error = None
+        self.writer = None
+        self.finished = threading.Event()
+        self.schedule_lock = threading.Lock()
+        self.scheduled = False
+
+    def start(self):
+        if self.pool is None:
+            super().start()
+        else:
+            self._schedule()
+
+    def join(self, timeout=None):
+        if self.pool is None:
+            super().join(timeout)
+        else:
+            self.finished.wait(timeout)
+
+    def write(self, frame, timestamp=None, motion=False):
+        """
+        Queue a frame for encoding. Returns False if the frame was dropped.
+        """
+        if self.closing:
+            if self.error is not None:
+                self.dropped += 1  # Lost to a failed encoder rather than refused after close()
+            return False
+        self.submitted += 1
+        depth = self.queue.qsize()
+        self.max_depth = max(self.max_depth, depth)
+        if self.policy == "block":
+            self.queue.put((frame, timestamp, motion, time.perf_counter()))
+            self._schedule()
+            return True
+        if self.policy == "downgrade":
+            if depth > self.queue.maxsize // 2:
+                self.downgrading = True
+            elif depth == 0:
+                self.downgrading = False
+            if self.downgrading and self.submitted % 2:
+                self.downgraded += 1
+                return False
+        try:
+            self.queue.put_nowait((frame, timestamp, motion, time.perf_counter()))
+        except queue.Full:
+            self.dropped += 1
+            return False
+        self._schedule()
+        return True
+
+    def close(self):
+        """
+        Finish the queued frames and release the writer in the background.
+        """
+        self.closing = True
+        self._schedule()
+
+    def _open(self):
+        self.writer = cv2.VideoWriter(self.path, self.fourcc, self.fps, self.size)
+        if not self.writer.isOpened():
+            self.dropped += len(self.preroll)
+            self.preroll = ()
+            raise OSError("could not open the video writer")
+        for frame, timestamp in self.preroll:
+            self._encode(frame, timestamp, False)
+        self.preroll = ()
+
+    def _encode(self, frame, timestamp, motion, queued=None):
+        start = time.perf_counter()
+        self.writer.write(frame)
+        if self.write_time is not None:
+            self.write_time.record(time.perf_counter() - start)
+            if queued is not None:
+                self.lag.record(start - queued)
+        self.written += 1
+        if self.index is not None:
+            self.index.append(timestamp, motion)
+
+    def _fail(self, error):
+        """
+        Stop encoding after an error: refuse new frames and drop the queued ones, so no producer stays blocked.
+        """
+        self.error = f"Encoding {self.path} failed: {error}"
+        print(self.error)
+        self.closing = True
+        while True:
+            try:
+                self.queue.get_nowait()
+            except queue.Empty:
+                break
+            self.dropped += 1
+
+    def _finish(self):
+        try:
+            if self.writer is not None:
+                self.writer.release()
+            if self.index is not None:
+                self.index.close()
+                if self.error is not None and self.written == 0:
+                    os.remove(self.index.path)  # Nothing was recorded
+        except Exception as e:
+            self.error = self.error or f"Closing {self.path} failed: {e}"
+            print(self.error)
+        try:
+            if self.on_closed is not None:
+                self.on_closed(self)
+        finally:
+            self.finished.set()
+
+    def run(self):
+        try:
+            self._open()
+            while True:
+                try:
+                    item = self.queue.get(timeout=0.1)
+                except queue.Empty:
+                    if self.closing:
+                        break
+                    continue
+                self._encode(*item)
+        except Exception as e:
+            self._fail(e)
+        self._finish()
+
+    def _schedule(self):
+        """
+        Put the writer on the pool's ready queue unless it is already there. No-op without a pool.
+        """
+        if self.pool is None:
+            return
+        with self.schedule_lock:
+            if self.scheduled or self.finished.is_set():
+                return
+            self.scheduled = True
+        self.pool.ready.put(self)
+
+    def service(self, batch=16):
+        """
+        Called by an EncoderPool worker: encode up to `batch` queued frames, then give the worker back.
+        """
+        try:
+            if self.writer is None:
+                self._open()
+            for _ in range(batch):
+                try:
+                    item = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+                self._encode(*item)
+        except Exception as e:
+            # Stays "scheduled", so no worker picks the failed writer up again
+            self._fail(e)
+            self._finish()
+            return
+        with self.schedule_lock:
+            # Stay "scheduled" while finishing so no other worker picks the writer up in between
+            done = self.closing and self.queue.empty()
+            if not done:
+                self.scheduled = False
+        if done:
+            self._finish()
+        elif not self.queue.empty() or self.closing:
+            self._schedule()
+
+    def stats(self):
+        return {
+            "queued": self.queue.qsize(),
+            "capacity": self.queue.maxsize,
+            "max_queued": self.max_depth,
+            "written": self.written,
+            "dropped": self.dropped,
+            "downgraded": self.downgraded,
+        }
+
+
+class EncoderPool:
+    """
+    A fixed number of encoder threads shared by the recordings of all cameras.
+
+    Writers with queued frames wait on the ready queue; a worker encodes a batch of frames for one writer and
+    puts it back if it has more. A writer is never on the ready queue twice, so its frames stay in order.
+    """
+    def __init__(self, workers=2, batch=16):
+        self.batch = batch
+        self.ready = queue.Queue()
+        self.threads = [threading.Thread(target=self._work, name=f"Encoder-{i}", daemon=True) for i in range(workers)]
+        for thread in self.threads:
+            thread.start()
+
+    def _work(self):
+        while True:
+            writer = self.ready.get()
+            if writer is None:
+                break
+            try:
+                writer.service(self.batch)
+            except Exception as e:
+                print(f"Encoding {writer.path} failed:", e)
+
+    def backlog(self):
+        """
+        Number of writers waiting for an encoder thread.
+        """
+        return self.ready.qsize()
+
+    def stop(self):
+        for _ in self.threads:
+            self.ready.put(None)
+        for thread in self.threads:
+            thread.join()
+
+
+class SegmentRecorder:
+    """
+    Continuous recording split into segments of `segment_seconds` seconds or `segment_bytes` bytes, whichever
+    comes first.
+
+    The writer of the next segment is always created and opened ahead of time, so a rollover is just a swap:
+    the frame after the boundary goes to an already open file and the previous segment is closed in the
+    background. `open_writer(path)` returns a new, unstarted RecordingWriter.
+    """
+    def __init__(self, directory, extension, open_writer, segment_seconds=600, segment_bytes=None):
+        self.directory = directory
+        self.extension = extension
+        self.open_writer = open_writer
+        self.segment_seconds = segment_seconds
+        self.segment_bytes = segment_bytes
+        self.prefix = datetime.now().strftime("%Y%m%d-%H%M%S")
+        self.sequence = 0
+        self.current = None
+        self.current_start = None
+        self.frames = 0
+        self.segments = 0  # Segments started so far
+        os.makedirs(directory, exist_ok=True)
+        self.next = self._open_next()
+
+    def _open_next(self):
+        path = os.path.join(self.directory, f"segment-{self.prefix}-{self.sequence:05d}{self.extension}")
+        self.sequence += 1
+        writer = self.open_writer(path)
+        writer.start()
+        return writer
+
+    def _due(self, timestamp):
+        if self.current is None:
+            return True
+        if self.segment_seconds and timestamp - self.current_start >= self.segment_seconds:
+            return True
+        # Checking the file size costs a stat call, so only do it once in a while
+        if self.segment_bytes and self.frames % 30 == 0:
+            try:
+                return os.path.getsize(self.current.path) >= self.segment_bytes
+            except OSError:
+                return False
+        return False
+
+    def write(self, frame, timestamp, motion=False):
+        if self._due(timestamp):
+            previous, self.current = self.current, self.next
+            self.current_start = timestamp
+            self.frames = 0
+            self.segments += 1
+            self.next = self._open_next()
+            if previous is not None:
+                previous.close()
+        self.frames += 1
+        return self.current.write(frame, timestamp, motion)
+
+    def active_paths(self):
+        return {writer.path for writer in (self.current, self.next) if writer is not None}
+
+    def close(self):
+        for writer in (self.current, self.next):
+            if writer is not None:
+                writer.close()
+
+
+class PreRollBuffer:
+    """
+    Keeps the most recent frames so a recording can include the seconds before the motion that triggered it.
+
+    The buffer holds at most `seconds` worth of frames and never more than `max_bytes`. Frames can be kept raw or
+    compressed ("jpg" or "png") to fit a longer pre-roll in the same memory; compressed frames are decoded lazily
+    on the writer thread when the buffer is flushed. The foreground mask of every frame is kept too (uncompressed,
+    they are a fraction of the size), so the pre-roll can be added to the live composite of a recording.
+    """
+    COMPRESSION = {None: None, "jpg": ".jpg", "png": ".png"}
+
+    def __init__(self, seconds=2.0, max_bytes=256 * 1024 * 1024, compression=None, jpeg_quality=95):
+        if compression not in self.COMPRESSION:
+            raise ValueError(f"Unknown pre-roll compression: {compression}")
+        self.seconds = seconds
+        self.max_bytes = max_bytes
+        self.compression = compression
+        self.encode_params = [cv2.IMWRITE_JPEG_QUALITY, jpeg_quality] if compression == "jpg" else []
+        self.frames = deque()  # (timestamp, data, nbytes, fgMask)
+        self.bytes = 0
+        self.lock = threading.Lock()
+
+    def append(self, frame, timestamp, fgMask=None):
+        if self.seconds <= 0 or self.max_bytes <= 0:
+            return
+        if self.compression:
+            ok, data = cv2.imencode(self.COMPRESSION[self.compression], frame, self.encode_params)
+            if not ok:
+                return
+        else:
+            data = frame
+        nbytes = data.nbytes + (fgMask.nbytes if fgMask is not None else 0)
+        with self.lock:
+            self.frames.append((timestamp, data, nbytes, fgMask))
+            self.bytes += nbytes
+            # Trim to the configured duration and memory cap
+            while self.frames and (timestamp - self.frames[0][0] > self.seconds or self.bytes > self.max_bytes):
+                self.bytes -= self.frames.popleft()[2]
+
+    def drain(self):
+        """
+        Empty the buffer and return its frames as a PreRoll.
+        """
+        with self.lock:
+            entries = list(self.frames)
+            self.frames.clear()
+            self.bytes = 0
+        return PreRoll(entries, self._decode)
+
+    def _decode(self, data):
+        if self.compression:
+            return cv2.imdecode(data, cv2.IMREAD_COLOR)
+        return data
+
+    def clear(self):
+        with self.lock:
+            self.frames.clear()
+            self.bytes = 0
+
+    def stats(self):
+        with self.lock:
+            duration = self.frames[-1][0] - self.frames[0][0] if self.frames else 0.0
+            return {"frames": len(self.frames), "seconds": duration, "bytes": self.bytes, "max_bytes": self.max_bytes}
+
+
+class PreRoll:
+    """
+    The frames drained from a PreRollBuffer. Iterating yields (frame, timestamp) pairs, oldest first; compressed
+    frames are only decoded then, i.e. on the thread that writes them. masked() also yields the foreground masks.
+    """
+    def __init__(self, entries, decode):
+        self.entries = entries
+        self.decode = decode
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __iter__(self):
+        return ((self.decode(data), timestamp) for timestamp, data, _, _ in self.entries)
+
+    def masked(self):
+        """
+        Iterate over (frame, fgMask, timestamp) triples, e.g. for Compositor.add. The mask is None where none was kept.
+        """
+        return ((self.decode(data), fgMask, timestamp) for timestamp, data, _, fgMask in self.entries)
+
+
+class ClipIndex:
+    """
+    Sidecar index of a recording (clip.avi -> clip.avi.idx), written frame by frame as the recording is encoded.
+
+    Row n describes frame n of the video: its capture timestamp, whether the detector saw movement in it and
+    whether it is a keyframe. The number of rows is the exact frame count, which CAP_PROP_FRAME_COUNT isn't for
+    every container, and the motion flags let reviewers and post-processing seek straight to the interesting part.
+    cv2.VideoWriter doesn't report byte offsets, so seeking goes by frame number; with an intra-only codec every
+    frame is a keyframe and such seeks are exact.
+    """
+    DTYPE = np.dtype([("timestamp", "<f8"), ("motion", "u1"), ("keyframe", "u1")])
+    SUFFIX = ".idx"
+
+    def __init__(self, video_path, all_keyframes=False):
+        self.path = video_path + self.SUFFIX
+        self.all_keyframes = all_keyframes
+        self.file = open(self.path, "wb")
+        self.frames = 0
+
+    def append(self, timestamp, motion=False):
+        keyframe = self.all_keyframes or self.frames == 0
+        row = np.array([(np.nan if timestamp is None else timestamp, motion, keyframe)], dtype=self.DTYPE)
+        self.file.write(row.tobytes())
+        self.frames += 1
+
+    def close(self):
+        self.file.close()
+
+    @classmethod
+    def load(cls, video_path):
+        """
+        Read the index of a video, or return None if it has none.
+        """
+        path = video_path + cls.SUFFIX
+        if not os.path.exists(path):
+            return None
+        return np.fromfile(path, dtype=cls.DTYPE)
+
+    @staticmethod
+    def motion_ranges(index):
+        """
+        Contiguous [start, end) frame ranges with movement.
+        """
+        motion = np.concatenate([[0], index["motion"].astype(np.int8), [0]])
+        edges = np.flatnonzero(np.diff(motion))
+        return list(zip(edges[::2].tolist(), edges[1::2].tolist()))
+
+    @staticmethod
+    def seek(cap, index, frame):
+        """
+        Position `cap` so the next read returns `frame`. Without an intra-only codec the capture is positioned on
+        the keyframe before it and decodes forward.
+        """
+        if index is None or index["keyframe"][frame]:
+            cap.set(cv2.CAP_PROP_POS_FRAMES, frame)
+            return
+        keyframes = np.flatnonzero(index["keyframe"][:frame + 1])
+        keyframe = int(keyframes[-1]) if len(keyframes) else 0
+        cap.set(cv2.CAP_PROP_POS_FRAMES, keyframe)
+        for _ in range(frame - keyframe):
+            cap.grab()
+
+
+if __name__ == '__main__':
+    # Usage: python recording.py <recording>
+    # Print the exact frame count, time span and motion ranges from a recording's index
+    import sys
+    index = ClipIndex.load(sys.argv[1])
+    if index is None:
+        sys.exit(f"{sys.argv[1]} has no {ClipIndex.SUFFIX} index")
+    timestamps = index["timestamp"][~np.isnan(index["timestamp"])]
+    span = timestamps[-1] - timestamps[0] if len(timestamps) else 0.0
+    print(f"{len(index)} frames over {span:.2f}s, {int(index['keyframe'].sum())} keyframes")
+    for start, end in ClipIndex.motion_ranges(index):
+        print(f"motion in frames {start}-{end - 1}")
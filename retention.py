@@ -0,0 +1,91 @@
+import os
+import threading
+
+from recording import ClipIndex
+
+
+def directory_size(path):
+    total = 0
+    for entry in os.scandir(path):
+        try:
+            if entry.is_dir(follow_symlinks=False):
+                total += directory_size(entry.path)
+            else:
+                total += entry.stat(follow_symlinks=False).st_size
+        except OSError:
+            pass  # Deleted while we were looking
+    return total
+
+
+class RetentionManager:
+    """
+    Keeps the save path under a disk quota by deleting the oldest continuous-recording segments.
+
+    Only segments without movement are deleted: a segment whose frame index has a motion flag set contains an
+    event and is kept, and so is a segment without a frame index, which can't be checked. Segments still being
+    written (`is_active(path)`) are never touched.
+    """
+    def __init__(self, root, quota_bytes, directory, is_active=lambda path: False, interval=60, on_message=print):
+        self.root = root
+        self.quota_bytes = quota_bytes
+        self.directory = directory
+        self.is_active = is_active
+        self.interval = interval
+        self.on_message = on_message
+        self.deleted = 0
+        self.freed = 0
+        self.over_quota = False
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self.run, name="Retention", daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread.is_alive():
+            self.thread.join()
+
+    def run(self):
+        while not self.stop_event.wait(self.interval):
+            try:
+                self.enforce()
+            except OSError as e:
+                self.on_message(f"Retention check failed: {e}")
+
+    def segments(self):
+        """
+        Finished segments in the directory, oldest first.
+        """
+        if not os.path.isdir(self.directory):
+            return []
+        paths = [entry.path for entry in os.scandir(self.directory)
+                 if entry.name.startswith("segment-") and not entry.name.endswith(ClipIndex.SUFFIX)]
+        paths = [path for path in paths if not self.is_active(path)]
+        return sorted(paths, key=os.path.getmtime)
+
+    def enforce(self):
+        """
+        Delete event-free segments, oldest first, until the save path is under the quota.
+        Returns the number of bytes freed.
+        """
+        usage = directory_size(self.root)
+        freed = 0
+        for path in self.segments():
+            if usage - freed <= self.quota_bytes:
+                break
+            index = ClipIndex.load(path)
+            if index is None or index["motion"].any():
+                continue
+            size = os.path.getsize(path)
+            os.remove(path)
+            os.remove(path + ClipIndex.SUFFIX)
+            freed += size
+            self.deleted += 1
+        self.freed += freed
+        over_quota = usage - freed > self.quota_bytes
+        if over_quota and not self.over_quota:
+            self.on_message(f"Save path is over its quota ({(usage - freed) / 2**30:.1f} GB) "
+                            "and every remaining segment contains an event or has no frame index")
+        self.over_quota = over_quota
+        return freed
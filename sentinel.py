@@ -1,13 +1,16 @@
-import os, sys, uuid
+import sys
 import cv2
 from PyQt5.QtWidgets import (QApplication, QMainWindow, QPushButton, QVBoxLayout, QWidget, QCheckBox, QLineEdit, QSizePolicy, QPlainTextEdit, 
                              QLabel, QSlider, QHBoxLayout, QSplitter, QFileDialog, QFrame, QRadioButton, QGroupBox)
-from PyQt5.QtCore import QTimer, Qt
-from PyQt5.QtGui import QImage, QPixmap, QColor, QPainter, QTextCursor
-from datetime import datetime
+from PyQt5.QtCore import QTimer, Qt, pyqtSignal, QPoint
+from PyQt5.QtGui import QImage, QPixmap, QColor, QPainter, QTextCursor, QPen, QPolygon
+import os
 import time
 import numpy as np
-import threading, queue
+from monitor import Monitor, CAMERA_RESOLUTIONS
+from cameras import CameraDiscovery, device_identity, fps_choices
+from skymask import mask_path, load_polygons, save_polygons, polygon_mask
+import threading
 
 class StickyRadioButton(QRadioButton):
     """
@@ -20,96 +23,48 @@ class StickyRadioButton(QRadioButton):
 
 
 class VideoApp(QMainWindow):
+    # Emitted from the monitor threads, delivered on the GUI thread
+    recordingStatusChanged = pyqtSignal(bool)
+    messageLogged = pyqtSignal(str)
+    camerasDiscovered = pyqtSignal(dict)
+    modesProbed = pyqtSignal(int, list)
+
     def __init__(self):
         super().__init__()
 
-        self.cap = cv2.VideoCapture(0)
-        self.width = self.cap.get(cv2.CAP_PROP_FRAME_WIDTH)
-        self.height = self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT)
-        self.aspect_ratio = self.width / self.height
-        self.fps = self.cap.get(cv2.CAP_PROP_FPS)
-        self.out = None  
-        self.save_path = ''
+        # Capture, detection and recording live in the Monitor, this window only drives and displays it
+        self.monitor = Monitor()
+        self.monitor.on_recording_changed = self.recordingStatusChanged.emit
+        self.monitor.on_message = self.messageLogged.emit
         self.cameras = {}
-        self.autorecord = False
-        self.recording = False
         self.show_video = True
-        self.no_movement_frame_count = 0  # To track how many frames have passed without movement
-        self.no_movement_threshold = 30  # Threshold number of frames to stop recording
-        self.default_codec = "FFV1"
-        self.fourcc = cv2.VideoWriter_fourcc(*self.default_codec)
-        self.codecs = {
-            "FFV1": "FFV1 (lossless)",
-            "MJPG": "MJPG",
-            "XVID": "XVID",
-            "MP4V": "MP4V",
-            "HFYU": "HFYU (lossless)",
-        }
-        self.codec_extensions = {
-            "FFV1": ".avi",
-            "MJPG": ".avi",
-            "XVID": ".avi",
-            "MP4V": ".mp4",
-            "HFYU": ".avi",
-        }
-
-        self.fgbg_history = 80
-        self.fgbg_var_threshold = 20
-        self.fgbg_detect_shadows = False
-        self.fgbg = cv2.createBackgroundSubtractorMOG2(history=self.fgbg_history, varThreshold=self.fgbg_var_threshold, detectShadows=self.fgbg_detect_shadows)
-        self.kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (3, 3))
-        self.bb_sensitivity = 20
-        self.bounding_box_buffer = 20
-
-        self.all_camera_resolutions = {
-            "QVGA": (320, 240),
-            "VGA": (640, 480),
-            "SVGA": (800, 600),
-            "XGA": (1024, 768),
-            "HD": (1280, 720),
-            "WXGA": (1366, 768),
-            "Full HD": (1920, 1080),
-            "2K": (2048, 1080),
-            "QHD": (2560, 1440),
-            "3K": (3072, 1620),
-            "UHD": (3840, 2160),
-            "4K": (4096, 2160)
-        }
+        self.detection_scales = {"Full": 1.0, "1/2": 0.5, "1/4": 0.25}
+        self.background_engines = {"MOG2": "mog2", "KNN": "knn", "Average": "average", "Difference": "difference"}
+        self.all_camera_resolutions = CAMERA_RESOLUTIONS
         self.resolution_fps_map = {}
-        self.prev_time = time.time()
-        self.tz_name = time.tzname[time.daylight]
-        self.current_video_name = None
-
-        # self.composite_storage = None
-
-        self.composite_storage = None
-        self.frame_count = 0
-
-
-
-        self.detect_cameras()
-        self.cap.set(cv2.CAP_PROP_FRAME_WIDTH, 1280)
-        self.cap.set(cv2.CAP_PROP_FRAME_HEIGHT, 720)
-        self.cap.set(cv2.CAP_PROP_FPS, 60)
+        self.preview_fps = 30  # Preview refresh cap, independent of the capture rate
+        self.last_preview_time = 0
+        self.preview_buffers = {}  # Downscaled frame per label, reused across frames
+        self.mask_polygons = []  # Sky polygons of the current camera, in coordinates relative to the frame size
+        self.mask_points = []  # Polygon being drawn in the mask editor
+        self.editing_mask = False
+
+        # Start with the cameras cached by the last run, the fresh probe finishes after the window is up
+        self.discovery = CameraDiscovery()
+        self.cameras = self.discovery.load()
+        self.current_port = 0
+        self.monitor.openSource(0, 1280, 720, 60)
+        self.aspect_ratio = self.monitor.width / self.monitor.height
+
+        self.recordingStatusChanged.connect(self.setRecordingStatus)
+        self.messageLogged.connect(self.logMessage)
+        self.camerasDiscovered.connect(self.onCamerasDiscovered)
+        self.modesProbed.connect(self.onModesProbed)
+        self.probing_modes = False
         self.initUI()
-
-        self.recordings_queue = queue.Queue()
-        self.worker_thread = threading.Thread(target=self.worker_function)
-        self.worker_thread.start()    
-
-
-    def worker_function(self):
-        time.sleep(1)
-        while True:
-            # Block until a recording is available for processing
-            video_filename = self.recordings_queue.get()
-
-            # Check for termination signal
-            if video_filename == "TERMINATE":
-                break
-
-            self.processRecordedVideo(video_filename)
-            self.recordings_queue.task_done()  # Mark the task as done
+        self.loadCameraMask()
+        self.monitor.start(display=self.displayStage)
+        self.detect_cameras()
 
 
     def initUI(self):
@@ -166,10 +121,26 @@ class VideoApp(QMainWindow):
         self.frames_checkbox.setChecked(True)
         self.frames_checkbox.stateChanged.connect(self.toggleDisplayMode)
         self.autorecord_checkbox = QCheckBox("Autorecord", self)
+        self.autorecord_checkbox.toggled.connect(lambda checked: setattr(self.monitor, 'autorecord', checked))
+        self.spool_checkbox = QCheckBox("Spool raw frames, encode later", self)
+        self.spool_checkbox.setChecked(self.monitor.spool_recording)
+        self.spool_checkbox.setToolTip("Write recordings as raw frames and encode them once recording stops, "
+                                       "so bursts of events are limited by the disk rather than the encoder")
+        self.spool_checkbox.toggled.connect(lambda checked: setattr(self.monitor, 'spool_recording', checked))
         self.timestamp_checkbox = QCheckBox("Show Timestamp", self)
-        self.timestamp_checkbox.setChecked(True)
+        self.timestamp_checkbox.setChecked(self.monitor.show_timestamp)
+        self.timestamp_checkbox.toggled.connect(lambda checked: setattr(self.monitor, 'show_timestamp', checked))
         self.fps_display_checkbox = QCheckBox("Show FPS", self)
+        self.fps_display_checkbox.toggled.connect(lambda checked: setattr(self.monitor, 'show_fps', checked))
         self.bbox_checkbox = QCheckBox("Show Bounding Boxes", self)
+        self.bbox_checkbox.toggled.connect(lambda checked: setattr(self.monitor, 'show_bboxes', checked))
+
+        # Per-stage queue depth and latency, to spot the bottleneck
+        self.pipeline_label = QLabel("", self)
+        self.pipeline_stats_time = 0
+        # Median/99th percentile time of every step a frame goes through
+        self.metrics_label = QLabel("", self)
+        self.metrics_label.setWordWrap(True)
 
         
 
@@ -178,100 +149,147 @@ class VideoApp(QMainWindow):
         self.bg_history = QSlider(Qt.Horizontal, self)
         self.bg_history.setFixedWidth(200)
         self.bg_history.setRange(0, 500)
-        self.bg_history.setValue(self.fgbg_history)  # Default value
+        self.bg_history.setValue(self.monitor.fgbg_history)  # Default value
         self.bg_history.valueChanged.connect(self.updateFgbgHistory)
         self.bg_history.setSizePolicy(QSizePolicy.Preferred, QSizePolicy.Preferred)
 
         self.bg_var_threshold = QSlider(Qt.Horizontal, self)
         self.bg_var_threshold.setFixedWidth(200)     
         self.bg_var_threshold.setRange(0, 100)
-        self.bg_var_threshold.setValue(self.fgbg_var_threshold)  # Default value
+        self.bg_var_threshold.setValue(self.monitor.fgbg_var_threshold)  # Default value
         self.bg_var_threshold.valueChanged.connect(self.updateFgbgVarThreshold)
         self.bg_var_threshold.setSizePolicy(QSizePolicy.Preferred, QSizePolicy.Preferred)
 
         self.bg_history_edit = QLineEdit(self)
         self.bg_history_edit.setFixedWidth(50)
-        self.bg_history_edit.setText(str(self.fgbg_history))
+        self.bg_history_edit.setText(str(self.monitor.fgbg_history))
         self.bg_history_edit.textChanged.connect(self.updateFgbgHistoryFromEdit)
 
         self.bg_var_threshold_edit = QLineEdit(self)
         self.bg_var_threshold_edit.setFixedWidth(50)
-        self.bg_var_threshold_edit.setText(str(self.fgbg_var_threshold))
+        self.bg_var_threshold_edit.setText(str(self.monitor.fgbg_var_threshold))
         self.bg_var_threshold_edit.textChanged.connect(self.updateFgbgVarThresholdFromEdit)
 
+        self.background_engine_radios = []
+        engine_tips = {"average": "Running average of the sky: several times cheaper than MOG2, enough for a static sky",
+                       "difference": f"Compare each frame with the one {self.monitor.difference_frames} frames before; ignores History"}
+        background_engine_layout = QHBoxLayout()
+        background_engine_layout.addWidget(QLabel("Model:"))
+        for name, engine in self.background_engines.items():
+            radio = StickyRadioButton(name)
+            radio.engine = engine
+            radio.setChecked(engine == self.monitor.background_engine)
+            radio.setToolTip(engine_tips.get(engine, ""))
+            radio.toggled.connect(self.onBackgroundEngineRadioToggled)
+            background_engine_layout.addWidget(radio)
+            self.background_engine_radios.append(radio)
+        background_engine_layout.addStretch(1)
+
         # Processing options
         self.processing_group = QGroupBox("Background Processing Settings")
         self.morph_checkbox = QCheckBox("Apply morphological operations", self)
-        self.morph_checkbox.setChecked(True)
+        self.morph_checkbox.setChecked(self.monitor.detector.apply_morph)
+        self.morph_checkbox.toggled.connect(lambda checked: setattr(self.monitor.detector, 'apply_morph', checked))
+
+        self.merge_checkbox = QCheckBox("Merge nearby bounding boxes", self)
+        self.merge_checkbox.setChecked(self.monitor.merge_nearby_boxes)
+        self.merge_checkbox.toggled.connect(self.updateMergeNearbyBoxes)
+
+        self.tracking_checkbox = QCheckBox("Record only tracked objects", self)
+        self.tracking_checkbox.setChecked(self.monitor.tracking)
+        self.tracking_checkbox.setToolTip("Start recordings only for objects seen moving in a line over several frames")
+        self.tracking_checkbox.toggled.connect(lambda checked: setattr(self.monitor, 'tracking', checked))
+        self.grayscale_checkbox = QCheckBox("Grayscale detection", self)
+        self.grayscale_checkbox.setChecked(self.monitor.detection_grayscale)
+        self.grayscale_checkbox.toggled.connect(self.updateDetectionGrayscale)
+
+        self.detection_scale_radios = []
+        detection_scale_layout = QHBoxLayout()
+        detection_scale_layout.addWidget(QLabel("Detection Scale:"))
+        for name, scale in self.detection_scales.items():
+            radio = StickyRadioButton(name)
+            radio.scale_value = scale
+            radio.setChecked(scale == self.monitor.detection_scale)
+            radio.toggled.connect(self.onDetectionScaleRadioToggled)
+            detection_scale_layout.addWidget(radio)
+            self.detection_scale_radios.append(radio)
+        detection_scale_layout.addStretch(1)
 
         self.bb_sensitivity_slider = QSlider(Qt.Horizontal, self)
         self.bb_sensitivity_slider.setFixedWidth(200)
         self.bb_sensitivity_slider.setRange(0, 500)
-        self.bb_sensitivity_slider.setValue(self.bb_sensitivity)  # Default value
+        self.bb_sensitivity_slider.setValue(self.monitor.bb_sensitivity)  # Default value
         self.bb_sensitivity_slider.valueChanged.connect(self.updateBBSensitivity)
         self.bb_sensitivity_slider.setSizePolicy(QSizePolicy.Preferred, QSizePolicy.Preferred)
 
         self.bb_sensitivity_edit = QLineEdit(self)
         self.bb_sensitivity_edit.setFixedWidth(50)
-        self.bb_sensitivity_edit.setText(str(self.bb_sensitivity))
+        self.bb_sensitivity_edit.setText(str(self.monitor.bb_sensitivity))
         self.bb_sensitivity_edit.textChanged.connect(self.updateBBSensitivityFromEdit)
 
         self.bb_size_slider = QSlider(Qt.Horizontal, self)
         self.bb_size_slider.setFixedWidth(200)
         self.bb_size_slider.setRange(0, 50)
-        self.bb_size_slider.setValue(self.bounding_box_buffer)  # Default value
+        self.bb_size_slider.setValue(self.monitor.bounding_box_buffer)  # Default value
         self.bb_size_slider.valueChanged.connect(self.updateBBSize)
         self.bb_size_slider.setSizePolicy(QSizePolicy.Preferred, QSizePolicy.Preferred)
 
         self.bb_size_edit = QLineEdit(self)
         self.bb_size_edit.setFixedWidth(50)
-        self.bb_size_edit.setText(str(self.bounding_box_buffer))
+        self.bb_size_edit.setText(str(self.monitor.bounding_box_buffer))
         self.bb_size_edit.textChanged.connect(self.updateBBSizeFromEdit)
 
 
         # Create radio buttons for different camera options
         self.camera_radios = []
         self.camera_radio_group = QGroupBox("Select Camera")
-        radio_layout = QVBoxLayout()
+        self.camera_radio_group.setLayout(QVBoxLayout())
 
         self.resolutions_radios = []
         self.resolutions_radio_group = QGroupBox("Select Resolution")
         self.resolutions_radio_group.setLayout(QVBoxLayout())
 
-        # self.fps_radios = []
-        # self.fps_radio_group = QGroupBox("Select FPS")
-        # self.fps_radio_group.setLayout(QVBoxLayout())
-
-        for port, info in self.cameras.items():
-            radio = StickyRadioButton(f"Camera {port}") #: {info['width']}x{info['height']} @ {info['fps']}fps")
-            radio.camera_port = port  # Attach the port number to the radio button object
-            if port == 0:  # Default to the first detected camera
-                radio.setChecked(True)
-                self.switchCamera(port)
-                
-            radio.toggled.connect(self.onCameraRadioToggled)
-            radio_layout.addWidget(radio)
-            self.camera_radios.append(radio)
+        self.fps_radios = []
+        self.fps_radio_group = QGroupBox("Select FPS")
+        self.fps_radio_group.setLayout(QVBoxLayout())
 
-        self.camera_radio_group.setLayout(radio_layout)    
-        self.onCameraRadioToggled()    
+        self.populateCameraSelector()
 
         self.codec_radios = []
         self.codec_radio_group = QGroupBox("Select Codec")
         codec_layout = QVBoxLayout()
 
-        for codec, description in self.codecs.items():
+        for codec, description in self.monitor.codecs.items():
             radio = StickyRadioButton(description)
             radio.codec_value = codec  # Attach the codec value to the radio button object
-            if codec == self.default_codec:
+            if codec == self.monitor.default_codec:
                 radio.setChecked(True)
-                self.fourcc = cv2.VideoWriter_fourcc(*codec)
             radio.toggled.connect(self.onCodecRadioToggled)
             codec_layout.addWidget(radio)
             self.codec_radios.append(radio)
 
         self.codec_radio_group.setLayout(codec_layout)
 
+        # Sky mask editor: click around the sky in the video, detection ignores everything outside the polygons
+        self.mask_group = QGroupBox("Sky Mask")
+        self.mask_edit_button = QPushButton("Edit Mask", self)
+        self.mask_edit_button.setCheckable(True)
+        self.mask_edit_button.setToolTip("Click in the video to add points, right-click to close the polygon")
+        self.mask_edit_button.toggled.connect(self.toggleMaskEditing)
+        self.mask_close_button = QPushButton("Close Polygon", self)
+        self.mask_close_button.clicked.connect(self.closeMaskPolygon)
+        self.mask_clear_button = QPushButton("Clear Mask", self)
+        self.mask_clear_button.clicked.connect(self.clearMask)
+        self.mask_label = QLabel("", self)
+        mask_layout = QVBoxLayout()
+        mask_layout.addWidget(self.mask_edit_button)
+        mask_layout.addWidget(self.mask_close_button)
+        mask_layout.addWidget(self.mask_clear_button)
+        mask_layout.addWidget(self.mask_label)
+        mask_layout.addStretch(1)
+        self.mask_group.setLayout(mask_layout)
+        self.label_original.mousePressEvent = self.onPreviewClicked
+
 
         # Adjust file picker layout
         file_layout = QHBoxLayout()
@@ -294,6 +312,7 @@ class VideoApp(QMainWindow):
 
 
         sliders_layout = QVBoxLayout()
+        sliders_layout.addLayout(background_engine_layout)
         sliders_layout.addLayout(bg_history_layout)
         sliders_layout.addLayout(bg_var_threshold_layout)
         bg_group_layout = QVBoxLayout()
@@ -314,6 +333,10 @@ class VideoApp(QMainWindow):
 
         proc_layout = QVBoxLayout()
         proc_layout.addWidget(self.morph_checkbox)
+        proc_layout.addWidget(self.merge_checkbox)
+        proc_layout.addWidget(self.grayscale_checkbox)
+        proc_layout.addWidget(self.tracking_checkbox)
+        proc_layout.addLayout(detection_scale_layout)
         proc_layout.addLayout(bb_sensitivity_slider_layout)
         proc_layout.addLayout(bb_size_slider_layout)
         bg_group_layout = QVBoxLayout()
@@ -330,16 +353,20 @@ class VideoApp(QMainWindow):
         selector_layout.addWidget(self.camera_radio_group)  # Adding the camera radio group
         selector_layout.addWidget(self.codec_radio_group)  # Adding the codec radio group        
         selector_layout.addWidget(self.resolutions_radio_group)  # Adding the resolutions radio group
-        # selector_layout.addWidget(self.fps_radio_group)  # Adding the FPS radio group
+        selector_layout.addWidget(self.fps_radio_group)  # Adding the FPS radio group
+        selector_layout.addWidget(self.mask_group)
 
         # Main Control Layout
         control_layout = QVBoxLayout()
         control_layout.addLayout(file_layout)
         control_layout.addWidget(self.frames_checkbox)
         control_layout.addWidget(self.autorecord_checkbox)
+        control_layout.addWidget(self.spool_checkbox)
         control_layout.addWidget(self.timestamp_checkbox)
         control_layout.addWidget(self.fps_display_checkbox)
         control_layout.addWidget(self.bbox_checkbox)        
+        control_layout.addWidget(self.pipeline_label)
+        control_layout.addWidget(self.metrics_label)
         # control_layout.addWidget(self.bg_group)
         # control_layout.addWidget(self.processing_group)
         control_layout.addLayout(background_layout)
@@ -367,7 +394,6 @@ class VideoApp(QMainWindow):
         self.resize(800, int(800 / self.aspect_ratio))
         self.setFocus()
         self.setWindowTitle('Video Display with PyQt5')
-        self.prev_time = time.time()
         self.show()
 
     def logMessage(self, message):
@@ -392,34 +418,86 @@ class VideoApp(QMainWindow):
     ######## Camera Functions ########
     def detect_cameras(self):
         """
-        Test the ports and returns a tuple with the available ports and the ones that are working.
-        """
-        non_working_ports = []
-        dev_port = 0
-        while len(non_working_ports) < 6: # if there are more than 5 non working ports stop the testing. 
-            camera = cv2.VideoCapture(dev_port)
-            if not camera.isOpened():
-                non_working_ports.append(dev_port)
-            else:
-                is_reading, img = camera.read()
-                w = int(camera.get(3) + 0.5)
-                h = int(camera.get(4) + 0.5)
-                fps = camera.get(cv2.CAP_PROP_FPS)
-                if is_reading:
-                    self.cameras[dev_port] = {"width": w, "height": h, "fps": fps}
-            dev_port +=1
-
-      
+        Probe the camera ports in the background. The camera we already have open isn't probed again.
+        """
+        known = {}
+        if self.monitor.cap is not None and self.monitor.cap.isOpened():
+            known[self.current_port] = {"width": int(self.monitor.width), "height": int(self.monitor.height),
+                                        "fps": self.monitor.fps, "identity": device_identity(self.current_port)}
+        self.discovery.start(self.camerasDiscovered.emit, known=known)
+
+    def onCamerasDiscovered(self, cameras):
+        if cameras != self.cameras:
+            self.cameras = cameras
+            self.populateCameraSelector()
+
+    def populateCameraSelector(self):
+        for radio in self.camera_radios:
+            self.camera_radio_group.layout().removeWidget(radio)
+            radio.deleteLater()
+        self.camera_radios = []
+
+        for port, info in self.cameras.items():
+            radio = StickyRadioButton(f"Camera {port}") #: {info['width']}x{info['height']} @ {info['fps']}fps")
+            radio.camera_port = port  # Attach the port number to the radio button object
+            if port == self.current_port:
+                radio.setChecked(True)
+            radio.toggled.connect(self.onCameraRadioToggled)
+            self.camera_radio_group.layout().addWidget(radio)
+            self.camera_radios.append(radio)
+
+        if self.current_port in self.cameras:
+            info = self.cameras[self.current_port]
+            self.populateResolutionSelector(info['width'], info['height'])
+            if 'modes' not in info:
+                self.probeModes()
+
+    def probeModes(self):
+        """
+        Measure the resolution/FPS modes of the current camera on a background thread, once per camera.
+        The result is cached with the discovered cameras.
+        """
+        if self.probing_modes:
+            return
+        self.probing_modes = True
+        port = self.current_port
+        info = dict(self.cameras[port])
+        self.logMessage(f"Measuring the modes of camera {port}, the preview pauses meanwhile")
+
+        def probe():
+            modes = []
+            try:
+                modes = self.monitor.probeModes(self.all_camera_resolutions.values())
+                try:
+                    self.discovery.cache.save_modes(port, info, modes)
+                except OSError as e:
+                    self.messageLogged.emit(f"Could not cache camera modes: {e}")
+            except Exception as e:
+                self.messageLogged.emit(f"Could not measure the modes of camera {port}: {e}")
+            finally:
+                self.modesProbed.emit(port, modes)  # Always, so probing_modes is reset
+        threading.Thread(target=probe, name="ModeProbe", daemon=True).start()
+
+    def onModesProbed(self, port, modes):
+        self.probing_modes = False
+        if not modes:
+            return  # Probing failed, it is tried again the next time the camera is selected
+        if port in self.cameras:
+            self.cameras[port]['modes'] = modes
+        self.logMessage(f"Camera {port}: " + ", ".join(f"{m['width']}x{m['height']}@{m['fps']:g}" for m in modes))
+        if port == self.current_port:
+            info = self.cameras[port]
+            self.populateResolutionSelector(info['width'], info['height'])
+
+
     def switchCamera(self, port):
         """
         Switch the camera to the given port.
         """
-        if self.cap:
-            self.cap.release()
-        self.cap = cv2.VideoCapture(port)
-        self.width = self.cap.get(cv2.CAP_PROP_FRAME_WIDTH)
-        self.height = self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT)
-        self.aspect_ratio = self.width / self.height
+        self.monitor.switchSource(port)
+        self.current_port = port
+        self.aspect_ratio = self.monitor.width / self.monitor.height
+        self.loadCameraMask()
 
 
     def onCameraRadioToggled(self):
@@ -428,7 +506,8 @@ class VideoApp(QMainWindow):
         """
         for radio in self.camera_radios:
             if radio.isChecked():
-                self.switchCamera(radio.camera_port)
+                if radio.camera_port != self.current_port:
+                    self.switchCamera(radio.camera_port)
                 max_width = self.cameras[radio.camera_port]['width']
                 max_height = self.cameras[radio.camera_port]['height']
                 self.populateResolutionSelector(max_width, max_height)
@@ -437,7 +516,15 @@ class VideoApp(QMainWindow):
     def get_resolutions(self, max_width, max_height):
         """
         Returns a dictionary with the available resolutions for the given max width and height.
-        """    
+        Once the camera's modes have been measured only those are offered, with their measured FPS in
+        self.resolution_fps_map.
+        """
+        modes = self.cameras.get(self.current_port, {}).get('modes')
+        if modes:
+            names = {res: name for name, res in self.all_camera_resolutions.items()}
+            self.resolution_fps_map = {(m['width'], m['height']): m['fps'] for m in modes}
+            return {names.get(res, "Custom"): res for res in sorted(self.resolution_fps_map, key=lambda res: res[0] * res[1])}
+        self.resolution_fps_map = {}
         return {name: res for name, res in self.all_camera_resolutions.items() if res[0] <= max_width and res[1] <= max_height}
 
 
@@ -448,13 +535,10 @@ class VideoApp(QMainWindow):
         for radio in self.resolutions_radios:
             if radio.isChecked():
                 width, height = radio.resolution_value
-                self.cap.set(cv2.CAP_PROP_FRAME_WIDTH, width)
-                self.cap.set(cv2.CAP_PROP_FRAME_HEIGHT, height)
-                self.width = width
-                self.height = height
-                self.aspect_ratio = self.width / self.height
-                self.fps = self.cap.get(cv2.CAP_PROP_FPS)
-                # self.populateFPSSelector(self.resolution_fps_map[radio.resolution_value])
+                self.monitor.setResolution(width, height)
+                self.aspect_ratio = width / height
+                self.applyMask()  # Rasterize the polygons at the new size
+                self.populateFPSSelector(self.resolution_fps_map.get(radio.resolution_value))
                 break
 
 
@@ -491,12 +575,14 @@ class VideoApp(QMainWindow):
             self.resolutions_radios.append(radio)
 
         if self.resolutions_radios:
+            current_width, current_height = self.monitor.captureSize()
             for radio in self.resolutions_radios:
                 width, height = radio.resolution_value
-                self.width = self.cap.get(cv2.CAP_PROP_FRAME_WIDTH)
-                self.height = self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT)
-                if width == self.width and height == self.height:
+                if width == current_width and height == current_height:
+                    radio.blockSignals(True)  # Already capturing at this resolution
                     radio.setChecked(True)
+                    radio.blockSignals(False)
+                    self.populateFPSSelector(self.resolution_fps_map.get(radio.resolution_value))
                     break
             # self.resolutions_radios[0].setChecked(True)
             # self.populateFPSSelector(resolution_fps_map[self.resolutions_radios[0].resolution_value])
@@ -513,151 +599,186 @@ class VideoApp(QMainWindow):
         """
         for radio in self.fps_radios:
             if radio.isChecked():
-                self.cap.set(cv2.CAP_PROP_FPS, radio.fps_value)
+                self.monitor.setFPS(radio.fps_value)
                 break
 
 
-    # def get_fps_for_resolution(self, width, height):
-    #     self.cap.set(cv2.CAP_PROP_FRAME_WIDTH, width)
-    #     self.cap.set(cv2.CAP_PROP_FRAME_HEIGHT, height)
-    #     time.sleep(0.5)  # Giving a delay of 0.5 seconds to let the camera adjust
-    #     return self.cap.get(cv2.CAP_PROP_FPS)
-
-
-    # def populateFPSSelector(self, max_fps_for_resolution):
-    #     """
-    #     Populate the FPS radio group with the available FPS values for the given resolution.
-    #     """
-    #     # First, clear out existing radio buttons
-    #     for radio in self.fps_radios:
-    #         self.fps_radio_group.layout().removeWidget(radio)
-    #         radio.deleteLater()
-    #     self.fps_radios = []
-
-    #     available_fps = [int(max_fps_for_resolution)]
-    #     # You can customize this list based on standard FPS values you want to support:
-    #     possible_fps_values = [120, 60, 30, 24, 15]
-
-    #     for fps in possible_fps_values:
-    #         if fps <= max_fps_for_resolution:
-    #             available_fps.append(fps)
-
-    #     for fps in available_fps:
-    #         radio = StickyRadioButton(f"{fps} FPS")
-    #         radio.fps_value = fps
-    #         radio.toggled.connect(self.onFPSRadioToggled)
-    #         self.fps_radio_group.layout().addWidget(radio)
-    #         self.fps_radios.append(radio)
-
-    #     # Check the highest FPS by default
-    #     if self.fps_radios:
-    #         self.fps_radios[0].setChecked(True)
-
-    def nextFrame(self):
+    def populateFPSSelector(self, max_fps_for_resolution):
         """
-        Read the next frame from the video and process it.
+        Populate the FPS radio group with the measured FPS of the resolution and the standard rates below it.
+        Empty until the camera's modes have been measured.
         """
-        ret, original_frame = self.cap.read()
-        if not ret:
+        # First, clear out existing radio buttons
+        for radio in self.fps_radios:
+            self.fps_radio_group.layout().removeWidget(radio)
+            radio.deleteLater()
+        self.fps_radios = []
+        if not max_fps_for_resolution:
             return
 
-        # original_frame = frame
+        current_fps = self.monitor.fps
+        choices = fps_choices(max_fps_for_resolution)
+        selected = min(choices, key=lambda fps: abs(fps - current_fps))
+        for fps in choices:
+            radio = StickyRadioButton(f"{fps} FPS")
+            radio.fps_value = fps
+            if fps == selected:
+                radio.setChecked(True)
+            radio.toggled.connect(self.onFPSRadioToggled)
+            self.fps_radio_group.layout().addWidget(radio)
+            self.fps_radios.append(radio)
 
-        # Apply background subtraction
-        fgMask = self.fgbg.apply(original_frame)
+    def nextFrame(self):
+        """
+        Display the newest frame that made it through the pipeline.
+        """
+        self.monitor.display_stage.poll(latest_only=True)
 
-        # Remove noise with morphological operations
-        if self.morph_checkbox.isChecked():
-            fgMask = cv2.morphologyEx(fgMask, cv2.MORPH_OPEN, self.kernel, iterations=2)
-            fgMask = cv2.morphologyEx(fgMask, cv2.MORPH_CLOSE, self.kernel, iterations=2)
+        now = time.time()
+        if now - self.pipeline_stats_time >= 1:
+            self.pipeline_stats_time = now
+            self.pipeline_label.setText(self.monitor.statusText())
+            self.metrics_label.setText("p50/p99: " + self.monitor.metricsText())
 
-        # Find contours
-        contours, _ = cv2.findContours(fgMask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-    
-        movement_detected = False
-        # Draw bounding boxes
-        for contour in contours:
-            if cv2.contourArea(contour) < self.bb_sensitivity:  # Filter out small movements
-                continue
-            if self.bbox_checkbox.isChecked():
-                (x, y, w, h) = cv2.boundingRect(contour)
-                cv2.rectangle(original_frame, (x - self.bounding_box_buffer, y - self.bounding_box_buffer), (x + w + self.bounding_box_buffer, y + h + self.bounding_box_buffer), (0, 0, 255), 2)
-            movement_detected = True
-
-        if self.autorecord_checkbox.isChecked():
-            if movement_detected:
-                self.no_movement_frame_count = 0  # Reset the count
-                if not self.recording:  # Start recording if not already doing so
-                    self.toggleRecording()
-                    self.recording = True
-            else:
-                self.no_movement_frame_count += 1  # Increment the count
-
-            # If no movement is detected for a certain number of frames, stop recording
-            if self.recording and self.no_movement_frame_count > self.no_movement_threshold:
-                self.toggleRecording()
-                self.recording = False
-
-
-        # Calculate FPS
-        curr_time = time.time()
-        self.fps = 1 / (curr_time - self.prev_time)
-        # print(self.fps)
-        self.prev_time = curr_time
-
-        if self.timestamp_checkbox.isChecked():
-            timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S ') + self.tz_name
-            cv2.putText(original_frame, timestamp, (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 1, (255, 255, 255), 2)
-            # cv2.putText(processed_frame, timestamp, (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 1, (255, 255, 255), 2)
-        
-        # Draw the FPS if the checkbox is checked
-        if self.fps_display_checkbox.isChecked():
-            fps = f"FPS: {self.fps:.0f}"
-            cv2.putText(original_frame, fps, (10, 60), cv2.FONT_HERSHEY_SIMPLEX, 1, (255, 255, 255), 2)
-            # cv2.putText(processed_frame, fps, (10, 60), cv2.FONT_HERSHEY_SIMPLEX, 1, (255, 255, 255), 2)
-        
-        if self.save_path and self.out:
-            self.out.write(original_frame)
-
-        if self.frames_checkbox.isChecked():
-            # Set the frames to the labels
-            # self.message_log.hide()
-            # self.label_original.show()
-            # self.label_processed.show()            
-            self.updateLabelWithFrame(self.label_original, original_frame)
-            self.updateLabelWithFrame(self.label_processed, fgMask)
-        # else:
-        #     # Hide video frames and display messages
-        #     self.label_original.hide()
-        #     self.label_processed.hide()
-        #     self.message_log.show()
-        #     # Process and log messages here
-        #     # self.logMessage('Processing saved videos...')
+    def displayStage(self, packet):
+        """
+        Show the annotated frame and its foreground mask. Runs on the GUI thread.
+        Nothing is rendered while the window is minimized, the frames are hidden or the monitor is shedding load,
+        and at most preview_fps times a second otherwise; capture, detection and recording keep running at full rate either way.
+        """
+        if (not self.frames_checkbox.isChecked() or self.isMinimized() or not self.label_original.isVisible()
+                or self.monitor.preview_paused):
+            return packet
+        now = time.time()
+        if now - self.last_preview_time < 1 / self.preview_fps:
+            return packet
+        self.last_preview_time = now
+        # Set the frames to the labels
+        self.updateLabelWithFrame(self.label_original, packet.frame)
+        self.updateLabelWithFrame(self.label_processed, packet.fgMask)
+        return packet
 
     def updateLabelWithFrame(self, label, frame):
         """
         Update the given label with the given frame.
+
+        Frames larger than the label are shrunk with cv2.resize into a buffer that is reused across frames, so Qt only
+        converts and copies a label-sized image instead of scaling the full frame. The QImage points into that buffer;
+        it stays referenced in preview_buffers until QPixmap.fromImage has made its own copy.
         """
-        if len(frame.shape) == 2:  # Grayscale image
-            height, width = frame.shape
-            bytesPerLine = width
-            qImg = QImage(frame.data, width, height, bytesPerLine, QImage.Format_Grayscale8)
-            pixmap = QPixmap.fromImage(qImg)
-            label_width = label.width()
-            label_height = int(label_width / self.aspect_ratio)
-            label.setPixmap(pixmap.scaled(label_width, label_height))
+        label_width = label.width()
+        label_height = int(label_width / self.aspect_ratio)
+        if label_width <= 0 or label_height <= 0:
+            return
+        if label_width < frame.shape[1]:
+            shape = (label_height, label_width) + frame.shape[2:]
+            buffer = self.preview_buffers.get(label)
+            if buffer is None or buffer.shape != shape:
+                buffer = np.empty(shape, dtype=np.uint8)
+            interpolation = cv2.INTER_NEAREST if frame.ndim == 2 else cv2.INTER_AREA
+            frame = cv2.resize(frame, (label_width, label_height), dst=buffer, interpolation=interpolation)
+        else:
+            frame = np.ascontiguousarray(frame)
+        self.preview_buffers[label] = frame
+
+        height, width = frame.shape[:2]
+        if frame.ndim == 2:  # Grayscale image
+            qImg = QImage(frame.data, width, height, frame.strides[0], QImage.Format_Grayscale8)
         else:  # RGB image
-            height, width, channel = frame.shape
-            bytesPerLine = 3 * width
-            qImg = QImage(frame.data, width, height, bytesPerLine, QImage.Format_BGR888) # BGR888 because OpenCV uses BGR format
-            pixmap = QPixmap.fromImage(qImg)
-            label_width = label.width()
-            label_height = int(label_width / self.aspect_ratio)
-            # painter = QPainter(pixmap)
-            # painter.setBrush(QColor('red'))
-            # painter.drawEllipse(10, 10, 20, 20)        
-            label.setPixmap(pixmap.scaled(label_width, label_height))
+            qImg = QImage(frame.data, width, height, frame.strides[0], QImage.Format_BGR888) # BGR888 because OpenCV uses BGR format
+        pixmap = QPixmap.fromImage(qImg)
+        if width != label_width:  # Only frames smaller than the label still need scaling up
+            pixmap = pixmap.scaled(label_width, label_height)
+        if self.editing_mask and label is self.label_original:
+            self.drawMaskOverlay(pixmap)
+        label.setPixmap(pixmap)
+
+    ##### Sky mask #####
+    def cameraMaskPath(self):
+        identity = self.cameras.get(self.current_port, {}).get('identity') or device_identity(self.current_port)
+        return mask_path(identity)
+
+    def loadCameraMask(self):
+        """
+        Load and apply the saved sky mask of the current camera, if it has one.
+        """
+        path = self.cameraMaskPath()
+        self.mask_points = []
+        self.mask_polygons = []
+        if os.path.exists(path):
+            try:
+                self.mask_polygons = load_polygons(path)
+            except (OSError, ValueError, KeyError) as e:
+                self.logMessage(f"Could not load sky mask {path}: {e}")
+        self.applyMask()
+
+    def applyMask(self):
+        if self.mask_polygons:
+            self.monitor.setMask(polygon_mask(self.mask_polygons, int(self.monitor.width), int(self.monitor.height)))
+            self.mask_label.setText(f"{len(self.mask_polygons)} polygon(s)")
+        else:
+            self.monitor.setMask(None)
+            self.mask_label.setText("Detecting everywhere")
 
+    def saveMask(self):
+        path = self.cameraMaskPath()
+        try:
+            if self.mask_polygons:
+                save_polygons(path, self.mask_polygons)
+            elif os.path.exists(path):
+                os.remove(path)
+        except OSError as e:
+            self.logMessage(f"Could not save sky mask {path}: {e}")
+        self.applyMask()
+
+    def toggleMaskEditing(self, editing):
+        self.editing_mask = editing
+        if not editing:
+            self.closeMaskPolygon()
+
+    def onPreviewClicked(self, event):
+        """
+        Add a point to the polygon being drawn, or close it on a right click.
+        """
+        if not self.editing_mask:
+            return
+        if event.button() == Qt.RightButton:
+            self.closeMaskPolygon()
+            return
+        pixmap = self.label_original.pixmap()
+        if pixmap is None or pixmap.isNull():
+            return
+        y_offset = (self.label_original.height() - pixmap.height()) / 2  # The label centers its pixmap vertically
+        x = event.pos().x() / pixmap.width()
+        y = (event.pos().y() - y_offset) / pixmap.height()
+        if 0 <= x <= 1 and 0 <= y <= 1:
+            self.mask_points.append([x, y])
+
+    def closeMaskPolygon(self):
+        if len(self.mask_points) >= 3:
+            self.mask_polygons.append(self.mask_points)
+            self.saveMask()
+        self.mask_points = []
+
+    def clearMask(self):
+        self.mask_polygons = []
+        self.mask_points = []
+        self.saveMask()
+
+    def drawMaskOverlay(self, pixmap):
+        """
+        Draw the sky polygons (green) and the one being drawn (yellow) over the preview.
+        """
+        width, height = pixmap.width(), pixmap.height()
+        def polygon(points):
+            return QPolygon([QPoint(int(x * width), int(y * height)) for x, y in points])
+        painter = QPainter(pixmap)
+        painter.setPen(QPen(QColor('lime'), 2))
+        for points in self.mask_polygons:
+            painter.drawPolygon(polygon(points))
+        painter.setPen(QPen(QColor('yellow'), 2))
+        painter.drawPolyline(polygon(self.mask_points))
+        painter.end()
     
     ##### Recording functionalities #####
     def setRecordingStatus(self, is_recording):
@@ -681,7 +802,6 @@ class VideoApp(QMainWindow):
                     background-color: lightgray;
                 }
             """)
-            self.recording = True
         else:
             # Gray color when not recording
             self.recording_button.setText("RECORD")
@@ -699,85 +819,18 @@ class VideoApp(QMainWindow):
                     background-color: lightgray;
                 }
             """)            
-            self.recording = False
 
 
     def toggleRecording(self):
-        if not self.recording:                   
-            if not self.save_path:  # If directory not chosen
+        if not self.monitor.recording:                   
+            if not self.monitor.save_path:  # If directory not chosen
                 self.pickDirectory()  # This method will handle starting the recording
-            if not self.save_path:
+            if not self.monitor.save_path:
                 return
-            # Generate random UUID for the video name
-            self.current_video_name = str(uuid.uuid4())
-            codec_extension = self.codec_extensions[self.default_codec]
-            self.output_filename = f"{self.current_video_name}{codec_extension}"
-            self.video_path = os.path.join(self.save_path, self.output_filename)
-            self.out = cv2.VideoWriter(self.video_path, self.fourcc, self.fps, (int(self.width), int(self.height)))
-            self.setRecordingStatus(True)
+            self.monitor.startRecording()
         else:
-            self.setRecordingStatus(False)
-            if self.out:
-                self.out.release()
-                self.video_path = os.path.join(self.save_path, self.output_filename)
-                self.recordings_queue.put(self.video_path)                
-                self.out = None  # Reset the video writer
-
-            # if self.composite_storage is not None:
-            #     normalized_composite = cv2.convertScaleAbs(self.composite_storage)
-            #     composite_filename = os.path.join(self.save_path, f"{self.current_video_name}_composite.png")
-            #     cv2.imwrite(composite_filename, normalized_composite)
-
-            #     # Reset the composite storage and frame count
-            #     self.composite_storage = None
-            #     self.frame_count = 0
-
-    def processRecordedVideo(self, video_filename):
-        print("Processing video:", video_filename)
-        # def manual_count(handler):
-        #     frames = 0
-        #     while True:
-        #         status, frame = handler.read()
-        #         if not status:
-        #             break
-        #         frames += 1
-        #     return frames 
-
-        cap = cv2.VideoCapture(video_filename)
-        # ret, frame = self.cap.read()
-        while not cap.isOpened():
-            time.sleep(0.5)
-
-        # cap = cv2.VideoCapture(video_filename)
-        # Determine the total frame count
-        # total_frames = manual_count(cap)
-        total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-        # if total_frames == 0:
-        #     total_frames = manual_count(cap) # attempt manual counting
-        # print("Total frames:", total_frames)
-        weight = 1.0 / total_frames
-        
-        # cap = cv2.VideoCapture(video_filename)
-        ret, first_frame = cap.read()
-        composite_storage = np.zeros_like(first_frame, dtype='float')
+            self.monitor.stopRecording()
 
-        while True:
-            ret, frame = cap.read()
-
-            if not ret:
-                break
-
-            fgMask = self.fgbg.apply(frame)
-            foreground = cv2.bitwise_and(frame, frame, mask=fgMask)
-            # cv2.accumulateWeighted(foreground, composite_storage, weight)
-            composite_storage = np.maximum(composite_storage, foreground)
-
-
-        composite_image = composite_storage.astype(np.uint8)
-        new_filename = os.path.splitext(video_filename)[0] + '_composite.png'
-        cv2.imwrite(new_filename, composite_image)
-        cap.release()
-        
 
     def pickDirectory(self):
         """
@@ -785,8 +838,8 @@ class VideoApp(QMainWindow):
         """
         directory = QFileDialog.getExistingDirectory(self, "Select Directory to Save Videos")
         if directory:
-            self.save_path = directory
-            self.file_label.setText(self.save_path)
+            self.monitor.setSavePath(directory)  # Also resumes composites left pending by the last session
+            self.file_label.setText(self.monitor.save_path)
 
 
 
@@ -795,10 +848,10 @@ class VideoApp(QMainWindow):
         """
         Update the history value for the background subtractor.
         """
-        self.fgbg_history = value
-        self.fgbg.setHistory(self.fgbg_history)
-        # self.bg_history_label.setText(str(self.fgbg_history))  # Update the QLabel text
-        self.bg_history_edit.setText(str(self.fgbg_history))
+        self.monitor.fgbg_history = value
+        self.monitor.detector.set_history(self.monitor.fgbg_history)
+        # self.bg_history_label.setText(str(self.monitor.fgbg_history))  # Update the QLabel text
+        self.bg_history_edit.setText(str(self.monitor.fgbg_history))
 
     def updateFgbgHistoryFromEdit(self):
         try:
@@ -813,10 +866,10 @@ class VideoApp(QMainWindow):
         """
         Update the var threshold value for the background subtractor.
         """
-        self.fgbg_var_threshold = value
-        self.fgbg.setVarThreshold(self.fgbg_var_threshold)
-        # self.bg_var_threshold_label.setText(str(self.fgbg_var_threshold))  # Update the QLabel text
-        self.bg_var_threshold_edit.setText(str(self.fgbg_var_threshold))
+        self.monitor.fgbg_var_threshold = value
+        self.monitor.detector.set_var_threshold(self.monitor.fgbg_var_threshold)
+        # self.bg_var_threshold_label.setText(str(self.monitor.fgbg_var_threshold))  # Update the QLabel text
+        self.bg_var_threshold_edit.setText(str(self.monitor.fgbg_var_threshold))
 
     def updateFgbgVarThresholdFromEdit(self):
         try:
@@ -831,8 +884,9 @@ class VideoApp(QMainWindow):
         """
         Update the history value for the background subtractor.
         """
-        self.bb_sensitivity = value
-        self.bb_sensitivity_edit.setText(str(self.bb_sensitivity))
+        self.monitor.bb_sensitivity = value
+        self.monitor.detector.min_area = value
+        self.bb_sensitivity_edit.setText(str(self.monitor.bb_sensitivity))
 
     def updateBBSensitivityFromEdit(self):
         try:
@@ -847,8 +901,10 @@ class VideoApp(QMainWindow):
         """
         Update the history value for the background subtractor.
         """
-        self.bounding_box_buffer = value
-        self.bb_size_edit.setText(str(self.bounding_box_buffer))
+        self.monitor.bounding_box_buffer = value
+        if self.monitor.merge_nearby_boxes:
+            self.monitor.detector.merge_gap = value
+        self.bb_size_edit.setText(str(self.monitor.bounding_box_buffer))
 
     def updateBBSizeFromEdit(self):
         try:
@@ -861,6 +917,33 @@ class VideoApp(QMainWindow):
 
 
 
+    def onDetectionScaleRadioToggled(self):
+        """
+        Update the detection resolution based on the selected radio button.
+        """
+        for radio in self.detection_scale_radios:
+            if radio.isChecked():
+                self.monitor.setDetectionScale(radio.scale_value)
+                break
+
+    def onBackgroundEngineRadioToggled(self):
+        """
+        Switch the background model to the selected one.
+        """
+        for radio in self.background_engine_radios:
+            if radio.isChecked() and radio.engine != self.monitor.background_engine:
+                self.monitor.setBackgroundEngine(radio.engine)
+                break
+
+    def updateMergeNearbyBoxes(self, checked):
+        self.monitor.merge_nearby_boxes = checked
+        self.monitor.detector.merge_gap = self.monitor.bounding_box_buffer if checked else None
+
+    def updateDetectionGrayscale(self, checked):
+        self.monitor.detection_grayscale = checked
+        self.monitor.detector.grayscale = checked
+
+
     # Codec selection
     def onCodecRadioToggled(self):
         """
@@ -868,8 +951,7 @@ class VideoApp(QMainWindow):
         """
         for radio in self.codec_radios:
             if radio.isChecked():
-                self.fourcc = cv2.VideoWriter_fourcc(*radio.codec_value)
-                self.default_codec = radio.codec_value
+                self.monitor.setCodec(radio.codec_value)
                 break
 
 
@@ -881,13 +963,10 @@ class VideoApp(QMainWindow):
 
 
     def closeEvent(self, event):
+        # Don't keep the window hanging on a composite or spool backlog, pick it up again next time
+        self.monitor.post_on_exit = "persist"
+        self.monitor.stop()
         self.setRecordingStatus(False)
-        self.recordings_queue.put("TERMINATE")
-        self.worker_thread.join()        
-        if self.cap:    
-            self.cap.release()
-        if self.out:
-            self.out.release()        
 
 if __name__ == '__main__':
     app = QApplication(sys.argv)
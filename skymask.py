@@ -0,0 +1,105 @@
+"""
+Sky masks: the part of a camera's view where detection runs.
+
+A mask file is either an image (white where the sky is, black over rooftops, trees and horizon) or a JSON file
+with polygons around the sky in coordinates relative to the frame size, as written by the GUI's mask editor:
+
+    {"polygons": [[[0.0, 0.0], [1.0, 0.0], [1.0, 0.55], [0.0, 0.7]]]}
+
+Relative coordinates keep a polygon mask valid when the camera resolution changes. The GUI keeps one mask per
+camera in ~/.config/sentinel/masks, named after the device identity.
+"""
+import json
+import os
+import re
+
+import cv2
+import numpy as np
+
+
+def masks_directory():
+    base = os.environ.get("XDG_CONFIG_HOME") or os.path.join(os.path.expanduser("~"), ".config")
+    return os.path.join(base, "sentinel", "masks")
+
+
+def mask_path(identity):
+    """
+    The GUI's mask file of the camera with the given identity (see cameras.device_identity).
+    """
+    return os.path.join(masks_directory(), re.sub(r"[^\w.-]+", "_", identity).strip("_") + ".json")
+
+
+def polygon_mask(polygons, width, height):
+    """
+    Rasterize polygons in relative coordinates into a width x height uint8 mask (255 inside).
+    """
+    mask = np.zeros((height, width), dtype=np.uint8)
+    scale = np.array([width, height], dtype=np.float64)
+    points = [np.rint(np.asarray(polygon, dtype=np.float64) * scale).astype(np.int32) for polygon in polygons if len(polygon) >= 3]
+    if points:
+        cv2.fillPoly(mask, points, 255)
+    return mask
+
+
+def load_polygons(path):
+    with open(path) as f:
+        return json.load(f)["polygons"]
+
+
+def save_polygons(path, polygons):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump({"polygons": [[[round(x, 5), round(y, 5)] for x, y in polygon] for polygon in polygons]}, f)
+    os.replace(tmp_path, path)
+
+
+def load_mask(path, width, height):
+    """
+    Read a mask file (JSON polygons or an image) as a width x height uint8 mask, 255 where detection runs.
+    """
+    if path.endswith(".json"):
+        return polygon_mask(load_polygons(path), width, height)
+    image = cv2.imread(path, cv2.IMREAD_GRAYSCALE)
+    if image is None:
+        raise ValueError(f"Could not read mask image {path}")
+    if image.shape != (height, width):
+        image = cv2.resize(image, (width, height), interpolation=cv2.INTER_NEAREST)
+    return cv2.threshold(image, 127, 255, cv2.THRESH_BINARY)[1]
+
+
+class MaskRegion:
+    """
+    A mask prepared for one frame size and detection scale: the bounding rectangle of the sky in the frame, and
+    the mask cropped to that rectangle at detection resolution. Detection only processes the crop and clears the
+    masked pixels of its foreground mask.
+    """
+    def __init__(self, mask, height, width, scale):
+        if mask.shape[:2] != (height, width):
+            mask = cv2.resize(mask, (width, height), interpolation=cv2.INTER_NEAREST)
+        self.size = (height, width, scale)
+        self.rect = cv2.boundingRect(mask)  # (x, y, w, h) in full-resolution pixels
+        x, y, w, h = self.rect
+        crop = mask[y:y + h, x:x + w]
+        self.shape = (max(1, round(h * scale)), max(1, round(w * scale)))  # Crop at detection resolution
+        if scale < 1.0:
+            crop = cv2.resize(crop, (self.shape[1], self.shape[0]), interpolation=cv2.INTER_NEAREST)
+        self.mask = np.ascontiguousarray(crop)
+        self.full_shape = (max(1, round(height * scale)), max(1, round(width * scale)))
+        # Where the crop goes in the full detection-resolution mask
+        self.offset = (min(round(x * scale), self.full_shape[1] - self.shape[1]),
+                       min(round(y * scale), self.full_shape[0] - self.shape[0]))
+        self.coverage = cv2.countNonZero(mask) / (height * width)
+
+    def crop(self, frame):
+        x, y, w, h = self.rect
+        return frame[y:y + h, x:x + w]
+
+    def expand(self, fgMask):
+        """
+        Place a crop-sized foreground mask into an otherwise empty mask of the whole frame at detection resolution.
+        """
+        full = np.zeros(self.full_shape, dtype=np.uint8)
+        x, y = self.offset
+        full[y:y + fgMask.shape[0], x:x + fgMask.shape[1]] = fgMask
+        return full
@@ -0,0 +1,425 @@
+"""
+Raw frame spool: event recordings written as raw frames into a preallocated memory-mapped file, and encoded
+into the recording's codec afterwards by a background transcoder.
+
+Lossless real-time encoding (FFV1, HFYU) is the first thing to fall behind during a burst of events. Spooling a
+frame is a single copy into the page cache, so a spooled recording keeps up for as long as the disk does, and
+the encoding happens once the burst is over.
+
+A spool (clip.spool, next to where clip.avi will be) is laid out as:
+
+    header   one page: magic, frame size, frame rate, codec, target file name, index option, closed flag
+    slots    one per frame, page-aligned: a 64-byte record (sequence number, timestamp, motion flag) followed by
+             the raw BGR frame
+
+The file grows `chunk_mb` at a time, preallocated so a full disk shows up as an error when a chunk is added
+rather than as a crash while writing into the map. A slot's record is written after its frame and its sequence
+number last, so after a crash every slot up to the first one without the expected sequence number holds a
+complete frame; SpoolTranscoder.recover() encodes those. The maps are flushed to disk every `flush_seconds`
+from the writer's own thread, which bounds what a power cut can lose; a crash of the process loses nothing.
+"""
+import mmap
+import os
+import queue
+import threading
+import time
+
+import cv2
+import numpy as np
+
+from recording import ClipIndex
+
+SUFFIX = ".spool"
+MAGIC = b"SENTSPL1"
+PAGE = mmap.PAGESIZE
+HEADER = np.dtype([("magic", "S8"), ("height", "<u4"), ("width", "<u4"), ("channels", "<u4"), ("fps", "<f8"),
+                   ("codec", "S4"), ("index", "u1"), ("closed", "u1"), ("target", "S256")])
+RECORD = np.dtype([("sequence", "<u8"), ("timestamp", "<f8"), ("motion", "u1")])
+RECORD_BYTES = 64
+# Values of the header's index field
+NO_INDEX, INDEX, INDEX_ALL_KEYFRAMES = range(3)
+
+
+def spool_path(video_path):
+    return os.path.splitext(video_path)[0] + SUFFIX
+
+
+def slot_bytes(height, width, channels=3):
+    """
+    Size of one frame's slot: the record and the frame, rounded up to whole pages.
+    """
+    return -(-(RECORD_BYTES + height * width * channels) // PAGE) * PAGE
+
+
+def map_slots(file, offset, count, size, mode="r+"):
+    """
+    Map `count` slots of `size` bytes starting at `offset`. Returns the records and the frames of the slots.
+    """
+    slots = np.memmap(file, dtype=np.uint8, mode=mode, offset=offset, shape=(count, size))
+    records = slots[:, :RECORD.itemsize].view(RECORD)[:, 0]
+    return slots, records
+
+
+class SpoolWriter:
+    """
+    Stands in for a RecordingWriter: write() copies the frame into the spool on the caller's thread instead of
+    queueing it for an encoder, so frames are only dropped when the disk is full. Creating the spool, copying the
+    pre-roll into it, flushing, closing and the hand-over to `transcoder`, which then encodes `path` with `codec`,
+    happen on the writer's own thread, so start() returns at once; frames written before the pre-roll is in are
+    kept in order in `pending` until it is.
+
+    With a metrics.Metrics registry the time each frame takes to spool is recorded as "write".
+    """
+    def __init__(self, path, codec, fps, size, transcoder, on_closed=None, preroll=(), index=INDEX, chunk_mb=256,
+                 flush_seconds=1.0, metrics=None, on_transcoded=None):
+        self.path = path
+        self.spool_path = spool_path(path)
+        self.codec = codec
+        self.fps = fps
+        self.size = size
+        self.transcoder = transcoder
+        self.on_closed = on_closed
+        self.on_transcoded = on_transcoded
+        self.preroll = preroll
+        self.index = index
+        self.flush_seconds = flush_seconds
+        self.write_time = metrics.histogram("write") if metrics is not None else None
+        width, height = size
+        self.shape = (height, width, 3)
+        self.frame_bytes = height * width * 3
+        self.slot_bytes = slot_bytes(height, width)
+        self.chunk_frames = max(1, chunk_mb * 2**20 // self.slot_bytes)
+        self.capacity = 0  # Slots allocated so far
+        self.written = 0
+        self.dropped = 0
+        self.downgraded = 0  # Always 0, there is no queue to fall behind on
+        self.error = None
+        self.closing = False
+        self.file = None
+        self.pending = []  # (frame, timestamp, motion) written before the spool was created, None once it is
+        self.chunks = []  # (slots, records) maps that may have unflushed frames, the current chunk last
+        self.chunks_lock = threading.Lock()
+        self.write_lock = threading.Lock()  # Closing waits for a write() in progress on the caller's thread
+        self.wake = threading.Event()
+        self.finished = threading.Event()
+        self.thread = threading.Thread(target=self.run, name=f"SpoolWriter-{path}", daemon=True)
+
+    def start(self):
+        self.transcoder.writer_started(self.spool_path)
+        self.thread.start()
+
+    def _create(self):
+        """
+        Create the spool and copy the pre-roll and the frames written meanwhile into it. Runs on the writer thread.
+        """
+        try:
+            self.file = open(self.spool_path, "w+b")
+            header = np.zeros(1, dtype=HEADER)
+            header[0] = (MAGIC, self.shape[0], self.shape[1], 3, self.fps, self.codec.encode(), self.index, 0,
+                         os.path.basename(self.path).encode())
+            self.file.write(header.tobytes().ljust(PAGE, b"\0"))
+            self.file.flush()
+            self._grow()
+        except OSError as e:
+            self.error = f"Could not create spool {self.spool_path}: {e}"
+            print(self.error)
+        for frame, timestamp in self.preroll:
+            with self.write_lock:
+                self._store(frame, timestamp, False)
+        self.preroll = ()
+        with self.write_lock:
+            for frame, timestamp, motion in self.pending:
+                self._store(frame, timestamp, motion)
+            self.pending = None
+
+    def join(self, timeout=None):
+        self.finished.wait(timeout)
+
+    def _grow(self):
+        """
+        Preallocate and map the next chunk of slots.
+        """
+        offset = PAGE + self.capacity * self.slot_bytes
+        length = self.chunk_frames * self.slot_bytes
+        if hasattr(os, "posix_fallocate"):
+            os.posix_fallocate(self.file.fileno(), offset, length)
+        else:
+            self.file.truncate(offset + length)
+        chunk = map_slots(self.file, offset, self.chunk_frames, self.slot_bytes)
+        with self.chunks_lock:
+            self.chunks.append(chunk)
+        self.capacity += self.chunk_frames
+
+    def write(self, frame, timestamp=None, motion=False):
+        """
+        Copy a frame into the spool. Returns False if it was dropped.
+        """
+        start = time.perf_counter()
+        with self.write_lock:
+            if self.closing:
+                return False
+            if self.pending is not None:
+                self.pending.append((frame, timestamp, motion))  # The writer thread is still copying the pre-roll
+                return True
+            if not self._store(frame, timestamp, motion):
+                return False
+        if self.write_time is not None:
+            self.write_time.record(time.perf_counter() - start)
+        return True
+
+    def _store(self, frame, timestamp, motion):
+        """
+        Copy a frame into the next slot, with write_lock held. Returns False if it was dropped.
+        """
+        if self.error or frame.shape != self.shape:
+            self.dropped += 1
+            return False
+        if self.written == self.capacity:
+            try:
+                self._grow()
+            except OSError as e:
+                self.error = f"Spool {self.spool_path} is full: {e}"
+                print(self.error)
+                self.dropped += 1
+                return False
+        slots, records = self.chunks[-1]
+        slot = self.written % self.chunk_frames
+        np.copyto(slots[slot, RECORD_BYTES:RECORD_BYTES + self.frame_bytes].reshape(self.shape), frame)
+        records["timestamp"][slot] = np.nan if timestamp is None else timestamp
+        records["motion"][slot] = motion
+        records["sequence"][slot] = self.written + 1  # Last, so the slot only counts once it is complete
+        self.written += 1
+        return True
+
+    def close(self):
+        """
+        Stop accepting frames; the spool is flushed, closed and handed to the transcoder in the background.
+        """
+        self.closing = True
+        self.wake.set()
+
+    def _flush(self):
+        """
+        Write the mapped frames to disk and drop the maps of full chunks.
+        """
+        with self.chunks_lock:
+            chunks = list(self.chunks)
+            self.chunks[:-1] = []
+        for slots, _ in chunks:
+            slots.flush()
+
+    def run(self):
+        self._create()
+        while not self.wake.wait(self.flush_seconds):
+            self._flush()
+        with self.write_lock:
+            pass  # No write() is copying into the maps from here on
+        try:
+            if self.file is not None:
+                self._flush()
+                self.chunks = []
+                self.file.seek(HEADER.fields["closed"][1])
+                self.file.write(b"\1")
+                self.file.close()
+        except OSError as e:
+            self.error = f"Could not close spool {self.spool_path}: {e}"
+            print(self.error)
+        self.transcoder.writer_finished(self.spool_path)
+        if self.file is not None:
+            if self.written:
+                self.transcoder.submit(self.spool_path, self.on_transcoded)
+            else:
+                os.remove(self.spool_path)
+        if self.on_closed is not None:
+            self.on_closed(self)
+        self.finished.set()
+
+    def stats(self):
+        return {
+            "queued": 0,
+            "capacity": self.capacity,
+            "max_queued": 0,
+            "written": self.written,
+            "dropped": self.dropped,
+            "downgraded": self.downgraded,
+        }
+
+
+def read_spool(path):
+    """
+    Open a spool for reading. Returns its header, the number of complete frames, and their records and frames
+    (as a read-only map).
+    """
+    header = np.fromfile(path, dtype=HEADER, count=1)
+    if len(header) == 0 or header[0]["magic"] != MAGIC:
+        raise ValueError(f"{path} is not a spool file")
+    header = header[0]
+    height, width, channels = int(header["height"]), int(header["width"]), int(header["channels"])
+    size = slot_bytes(height, width, channels)
+    count = (os.path.getsize(path) - PAGE) // size
+    if count <= 0:
+        return header, 0, None, None
+    slots, records = map_slots(path, PAGE, count, size, mode="r")
+    complete = records["sequence"] == np.arange(1, count + 1)
+    frames = count if complete.all() else int(np.argmin(complete))
+    shape = (height, width, channels)
+    frame_bytes = height * width * channels
+    return header, frames, records[:frames], (slots[i, RECORD_BYTES:RECORD_BYTES + frame_bytes].reshape(shape)
+                                              for i in range(frames))
+
+
+class SpoolTranscoder:
+    """
+    Encodes closed spools into their recording's codec on one background thread, writes the recording's frame
+    index from the spooled timestamps, and deletes the spool once the recording is in place.
+
+    While any spool is being written the transcoder holds off, also in the middle of a spool, for at most
+    `max_defer` seconds after the spool was queued, so encoding doesn't compete with a burst of events for the
+    CPU. A spool that was never closed (the process died while recording) is encoded up to its last complete
+    frame. Spools that are still being written are never touched; their writer submits them once closed.
+    """
+    def __init__(self, max_defer=60, on_message=print):
+        self.max_defer = max_defer
+        self.on_message = on_message
+        self.queue = queue.Queue()
+        self.queued = set()  # Spool paths queued or being transcoded
+        self.lock = threading.Lock()
+        self.writing = set()  # Paths of the spools being written
+        self.idle = threading.Event()
+        self.idle.set()
+        self.abort = threading.Event()
+        self.completed = 0
+        self.failed = 0
+        self.left = 0  # Spools left for the next start by stop(finish=False)
+        self.thread = threading.Thread(target=self.run, name="SpoolTranscoder", daemon=True)
+        self.thread.start()
+
+    def writer_started(self, path):
+        with self.lock:
+            self.writing.add(os.path.abspath(path))
+            self.idle.clear()
+
+    def writer_finished(self, path):
+        with self.lock:
+            self.writing.discard(os.path.abspath(path))
+            if not self.writing:
+                self.idle.set()
+
+    def submit(self, path, on_done=None):
+        """
+        Queue a spool. `on_done(video_path, frames)` is called on the transcoder thread once it has been encoded.
+        """
+        path = os.path.abspath(path)  # The same spool may come from its writer and from recover()
+        with self.lock:
+            if path in self.queued:
+                return False
+            self.queued.add(path)
+        self.queue.put((path, on_done, time.monotonic()))
+        return True
+
+    def recover(self, directory, on_done=None):
+        """
+        Queue the spools left in `directory`, e.g. by a crash or by stopping with pending transcodes, skipping
+        the ones that are being written. Returns how many were queued.
+        """
+        try:
+            names = sorted(name for name in os.listdir(directory) if name.endswith(SUFFIX))
+        except OSError:
+            return 0
+        with self.lock:
+            paths = [path for path in (os.path.abspath(os.path.join(directory, name)) for name in names)
+                     if path not in self.writing]
+        return sum(self.submit(path, on_done) for path in paths)
+
+    def pending(self):
+        with self.lock:
+            return len(self.queued)
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            path, on_done, queued = item
+            with self.lock:
+                if path in self.writing:
+                    # Recovered while it was (or before it was) being written again; its writer resubmits it
+                    self.queued.discard(path)
+                    continue
+            try:
+                result = self.transcode(path, queued + self.max_defer)
+                if result is None:
+                    self.left += 1
+                else:
+                    self.completed += 1
+                    if on_done is not None:
+                        on_done(*result)
+            except Exception as e:
+                self.failed += 1
+                self.on_message(f"Transcoding {path} failed: {e}")
+            finally:
+                with self.lock:
+                    self.queued.discard(path)
+
+    def wait_idle(self, deadline):
+        while not self.idle.is_set() and not self.abort.is_set():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            self.idle.wait(min(1.0, remaining))
+
+    def transcode(self, path, deadline):
+        """
+        Encode one spool into its recording and delete it. Returns (video_path, frames), or None if stopped
+        before it was done, in which case the spool is left for the next start.
+        """
+        self.wait_idle(deadline)
+        if self.abort.is_set():
+            return None
+        header, frames, records, images = read_spool(path)
+        directory = os.path.dirname(path)
+        video_path = os.path.join(directory, header["target"].decode())
+        root, extension = os.path.splitext(video_path)
+        partial_path = f"{root}.partial{extension}"
+        codec = header["codec"].decode()
+        size = (int(header["width"]), int(header["height"]))
+        writer = cv2.VideoWriter(partial_path, cv2.VideoWriter_fourcc(*codec), float(header["fps"]), size)
+        if not writer.isOpened():
+            raise IOError(f"Could not open video writer for {partial_path}")
+        index = ClipIndex(video_path, header["index"] == INDEX_ALL_KEYFRAMES) if header["index"] != NO_INDEX else None
+        try:
+            for i, frame in enumerate(images or ()):
+                self.wait_idle(deadline)
+                if self.abort.is_set():
+                    break
+                writer.write(frame)
+                if index is not None:
+                    timestamp = records["timestamp"][i]
+                    index.append(None if np.isnan(timestamp) else float(timestamp), bool(records["motion"][i]))
+        finally:
+            writer.release()
+            if index is not None:
+                index.close()
+            del images, records  # Unmap before deleting
+        if self.abort.is_set():
+            os.remove(partial_path)
+            if index is not None:
+                os.remove(index.path)
+            return None
+        os.replace(partial_path, video_path)
+        os.remove(path)
+        if not header["closed"]:
+            self.on_message(f"Recovered {frames} frames of {video_path} from an unfinished spool")
+        return video_path, frames
+
+    def stop(self, finish=True):
+        """
+        Stop the transcoder: after the queued spools with `finish`, otherwise right away, leaving the spools that
+        weren't done for recover(). Returns how many were left.
+        """
+        if not finish:
+            self.abort.set()
+        self.idle.set()  # Nothing more is being written
+        self.queue.put(None)
+        self.thread.join()
+        return self.left
@@ -0,0 +1,133 @@
+"""
+Links detections across frames into tracks, so that recordings start for things that actually cross the sky
+rather than for single-frame noise, insects or flickering cloud edges.
+
+A track is confirmed once it has been seen in `min_frames` frames, has moved at least `min_distance` pixels and
+its path is straight enough: the distance between its first and last position divided by the length of the path
+it took (1.0 for a straight line, close to 0 for jitter in place) must be at least `min_linearity`.
+"""
+import numpy as np
+
+from detection import X, Y, W, H
+
+
+def path_stats(centers, timestamps):
+    """
+    Speed (pixels per second) and linearity (displacement / path length) of a sequence of centers.
+    """
+    centers = np.asarray(centers, dtype=np.float64).reshape(-1, 2)
+    if len(centers) < 2:
+        return 0.0, 0.0
+    path = float(np.hypot(*np.diff(centers, axis=0).T).sum())
+    displacement = float(np.hypot(*(centers[-1] - centers[0])))
+    duration = timestamps[-1] - timestamps[0]
+    return (displacement / duration if duration > 0 else 0.0), (displacement / path if path > 0 else 0.0)
+
+
+class Track:
+    """
+    One object followed across frames. Positions are box centers in full-resolution pixels.
+    """
+    __slots__ = ("id", "box", "center", "start_center", "velocity", "hits", "missed", "path", "first_index",
+                 "last_index", "last_timestamp", "confirmed")
+
+    def __init__(self, track_id, index, timestamp, box):
+        self.id = track_id
+        self.box = box
+        self.center = np.array([box[X] + box[W] / 2, box[Y] + box[H] / 2], dtype=np.float64)
+        self.start_center = self.center
+        self.velocity = np.zeros(2)  # Pixels per second, smoothed
+        self.hits = 1
+        self.missed = 0
+        self.path = 0.0
+        self.first_index = index
+        self.last_index = index
+        self.last_timestamp = timestamp
+        self.confirmed = False
+
+    def predict(self, timestamp):
+        return self.center + self.velocity * (timestamp - self.last_timestamp)
+
+    def update(self, index, timestamp, box):
+        center = np.array([box[X] + box[W] / 2, box[Y] + box[H] / 2], dtype=np.float64)
+        dt = timestamp - self.last_timestamp
+        if dt > 0:
+            velocity = (center - self.center) / dt
+            self.velocity = velocity if self.hits == 1 else self.velocity + 0.5 * (velocity - self.velocity)
+        self.path += float(np.hypot(*(center - self.center)))
+        self.center = center
+        self.box = box
+        self.hits += 1
+        self.missed = 0
+        self.last_index = index
+        self.last_timestamp = timestamp
+
+    def displacement(self):
+        return float(np.hypot(*(self.center - self.start_center)))
+
+    def linearity(self):
+        return self.displacement() / self.path if self.path > 0 else 0.0
+
+    def speed(self):
+        return float(np.hypot(*self.velocity))
+
+
+class Tracker:
+    """
+    Greedy nearest-neighbour tracker. Every frame, each detection is matched to the closest track whose predicted
+    position is within `max_distance` pixels; unmatched detections start new tracks, and tracks that go unmatched
+    for more than `max_missed` frames end. Cheap enough to run on every frame: the work is one distance matrix
+    between the active tracks and the detections.
+    """
+    def __init__(self, max_distance=80, max_missed=5, min_frames=5, min_distance=10, min_linearity=0.7):
+        self.max_distance = max_distance
+        self.max_missed = max_missed
+        self.min_frames = min_frames
+        self.min_distance = min_distance
+        self.min_linearity = min_linearity
+        self.tracks = []
+        self.next_id = 1
+
+    def reset(self):
+        self.tracks = []
+
+    def update(self, index, timestamp, detections):
+        """
+        Match the detections of a frame to the tracks. Returns the tracks that were seen in this frame.
+        """
+        tracks = self.tracks
+        matched_tracks = set()
+        matched_detections = set()
+        if tracks and len(detections):
+            predicted = np.array([track.predict(timestamp) for track in tracks])
+            centers = detections[:, [X, Y]] + detections[:, [W, H]] / 2
+            distances = np.hypot(predicted[:, None, 0] - centers[None, :, 0], predicted[:, None, 1] - centers[None, :, 1])
+            for flat in np.argsort(distances, axis=None):
+                t, d = divmod(int(flat), len(detections))
+                if distances[t, d] > self.max_distance:
+                    break
+                if t in matched_tracks or d in matched_detections:
+                    continue
+                tracks[t].update(index, timestamp, detections[d])
+                matched_tracks.add(t)
+                matched_detections.add(d)
+
+        active = []
+        for t, track in enumerate(tracks):
+            if t not in matched_tracks:
+                track.missed += 1
+                if track.missed > self.max_missed:
+                    continue
+            active.append(track)
+        for d in range(len(detections)):
+            if d not in matched_detections:
+                active.append(Track(self.next_id, index, timestamp, detections[d]))
+                self.next_id += 1
+        self.tracks = active
+
+        seen = [track for track in active if track.last_index == index]
+        for track in seen:
+            if not track.confirmed:
+                track.confirmed = (track.hits >= self.min_frames and track.displacement() >= self.min_distance
+                                   and track.linearity() >= self.min_linearity)
+        return seen